@@ -0,0 +1,145 @@
+import os
+import tempfile
+import zipfile
+
+from funcompiler import bytecode
+from funcompiler import classfile
+from funcompiler import frames
+from funcompiler import runtime
+from funcompiler.cache import compiler_version
+
+
+class Backend:
+    """Receives every class generated for a module, and serializes it somewhere. Code generation only builds
+    ClassDefs, so this is the one place where text or bytes are produced."""
+
+    # The extension of the files written for each class.
+    extension = None
+
+    # The serialized runtime classes, as (name, data) pairs, for each kind of backend. They are the same for every
+    # module, so they are only made once.
+    _runtime = {}
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def start(self, module):
+        """Called before any class of the module named *module* is written."""
+
+    def finish(self):
+        """Called once every class of the module, and the runtime, has been written."""
+
+    def write(self, classdef):
+        self.store(classdef.name, self.assemble(classdef))
+
+    def assemble(self, classdef):
+        """Works out the frame sizes of the methods in *classdef*, then serializes it."""
+        frames.set_limits(classdef)
+        return self.serialize(classdef)
+
+    def serialize(self, classdef):
+        """The bytes of the file for *classdef*."""
+        raise NotImplementedError
+
+    def store(self, name, data):
+        """Writes the serialized class *name*, either just made or taken from a cache."""
+        with open(self._path('{}.{}'.format(name, self.extension)), 'wb') as outfile:
+            outfile.write(data)
+
+    def runtime_classes(self):
+        """The runtime classes that every module relies on, serialized by this backend."""
+        kind = type(self)
+        if kind not in Backend._runtime:
+            Backend._runtime[kind] = [(classdef.name, self.assemble(classdef)) for classdef in runtime.classes()]
+        return Backend._runtime[kind]
+
+    def write_runtime(self):
+        for name, data in self.runtime_classes():
+            self.store(name, data)
+
+
+class JasminBackend(Backend):
+    """Writes each class as a .j file, to be assembled separately by Jasmin."""
+
+    extension = 'j'
+
+    def serialize(self, classdef):
+        return bytecode.to_jasmin(classdef).encode('utf-8')
+
+
+class ClassFileBackend(Backend):
+    """Assembles each class in process and writes the .class file directly, so no Jasmin run is needed."""
+
+    extension = 'class'
+
+    def serialize(self, classdef):
+        return classfile.to_bytes(classdef)
+
+
+def _entry(name):
+    # Entries are all given the same date, so that compiling the same module twice gives the same jar.
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def runtime_jar():
+    """The name of the jar holding the runtime classes made by this version of the compiler."""
+    return 'funruntime-{}.jar'.format(compiler_version()[:16])
+
+
+class JarBackend(ClassFileBackend):
+    """Streams the classes of each module into a single executable jar named after it, in the directory. The
+    runtime classes are kept in a jar of their own, which is only written the first time it is needed in the
+    directory and is then shared by every module, whose manifest puts it on the class path.
+
+    Each jar is written to a temporary file and then renamed, so a jar is never seen half written, even when
+    several builds share the directory."""
+
+    def __init__(self, directory='.'):
+        super().__init__(directory)
+        self._jar = None
+
+    def __getstate__(self):
+        # Only the directory is needed to assemble classes in another process.
+        state = self.__dict__.copy()
+        state['_jar'] = None
+        return state
+
+    def _open(self):
+        """Starts writing a jar, which _close() then moves into place. Returns the ZipFile and its temporary path."""
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        return zipfile.ZipFile(temp, 'w'), temp
+
+    def _close(self, jar, temp, filename):
+        jar.close()
+        # Temporary files are only readable by their owner.
+        os.chmod(temp, 0o644)
+        os.replace(temp, self._path(filename))
+
+    def start(self, module):
+        self._module = module
+        self._jar, self._temp = self._open()
+        manifest = 'Manifest-Version: 1.0\r\nMain-Class: {}\r\nClass-Path: {}\r\n\r\n'.format(module, runtime_jar())
+        self._jar.writestr(_entry('META-INF/MANIFEST.MF'), manifest)
+
+    def store(self, name, data):
+        self._jar.writestr(_entry('{}.class'.format(name)), data)
+
+    def write_runtime(self):
+        if os.path.exists(self._path(runtime_jar())):
+            return
+
+        jar, temp = self._open()
+        jar.writestr(_entry('META-INF/MANIFEST.MF'), 'Manifest-Version: 1.0\r\n\r\n')
+        for name, data in self.runtime_classes():
+            jar.writestr(_entry('{}.class'.format(name)), data)
+        self._close(jar, temp, runtime_jar())
+
+    def finish(self):
+        self._close(self._jar, self._temp, '{}.jar'.format(self._module))
+        self._jar = None
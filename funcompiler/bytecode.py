@@ -0,0 +1,334 @@
+ACCESS_FLAGS = {
+    'public': 0x0001,
+    'private': 0x0002,
+    'protected': 0x0004,
+    'static': 0x0008,
+    'final': 0x0010,
+    'super': 0x0020,
+    'synchronized': 0x0020,
+    'volatile': 0x0040,
+    'transient': 0x0080,
+    'native': 0x0100,
+    'interface': 0x0200,
+    'abstract': 0x0400
+}
+
+# Operand kinds, which decide how an instruction's operands are parsed, printed and encoded.
+NONE = 'none'
+LOCAL = 'local'
+BYTE = 'byte'
+SHORT = 'short'
+CONSTANT = 'constant'
+CLASS = 'class'
+FIELD = 'field'
+METHOD = 'method'
+INTERFACE_METHOD = 'interface_method'
+BRANCH = 'branch'
+IINC = 'iinc'
+NEWARRAY = 'newarray'
+MULTIANEWARRAY = 'multianewarray'
+TABLESWITCH = 'tableswitch'
+LOOKUPSWITCH = 'lookupswitch'
+
+OPCODES = {}
+
+def _opcodes(kind, *names_and_codes):
+    for name, code in names_and_codes:
+        OPCODES[name] = (code, kind)
+
+_opcodes(NONE,
+    ('nop', 0), ('aconst_null', 1), ('iconst_m1', 2),
+    *(('iconst_{}'.format(i), 3 + i) for i in range(6)),
+    ('lconst_0', 9), ('lconst_1', 10), ('fconst_0', 11), ('fconst_1', 12), ('fconst_2', 13),
+    ('dconst_0', 14), ('dconst_1', 15),
+    *(('{}load_{}'.format(prefix, i), 26 + 4 * p + i) for p, prefix in enumerate('ilfda') for i in range(4)),
+    *(('{}aload'.format(prefix), 46 + p) for p, prefix in enumerate('ilfdabcs')),
+    *(('{}store_{}'.format(prefix, i), 59 + 4 * p + i) for p, prefix in enumerate('ilfda') for i in range(4)),
+    *(('{}astore'.format(prefix), 79 + p) for p, prefix in enumerate('ilfdabcs')),
+    ('pop', 87), ('pop2', 88), ('dup', 89), ('dup_x1', 90), ('dup_x2', 91), ('dup2', 92),
+    ('dup2_x1', 93), ('dup2_x2', 94), ('swap', 95),
+    *(('{}{}'.format(prefix, op), 96 + 4 * o + p)
+      for o, op in enumerate(('add', 'sub', 'mul', 'div', 'rem', 'neg')) for p, prefix in enumerate('ilfd')),
+    ('ishl', 120), ('lshl', 121), ('ishr', 122), ('lshr', 123), ('iushr', 124), ('lushr', 125),
+    ('iand', 126), ('land', 127), ('ior', 128), ('lor', 129), ('ixor', 130), ('lxor', 131),
+    ('i2l', 133), ('i2f', 134), ('i2d', 135), ('l2i', 136), ('l2f', 137), ('l2d', 138),
+    ('f2i', 139), ('f2l', 140), ('f2d', 141), ('d2i', 142), ('d2l', 143), ('d2f', 144),
+    ('i2b', 145), ('i2c', 146), ('i2s', 147),
+    ('lcmp', 148), ('fcmpl', 149), ('fcmpg', 150), ('dcmpl', 151), ('dcmpg', 152),
+    ('ireturn', 172), ('lreturn', 173), ('freturn', 174), ('dreturn', 175), ('areturn', 176), ('return', 177),
+    ('arraylength', 190), ('athrow', 191), ('monitorenter', 194), ('monitorexit', 195))
+_opcodes(LOCAL, *(('{}load'.format(prefix), 21 + p) for p, prefix in enumerate('ilfda')),
+    *(('{}store'.format(prefix), 54 + p) for p, prefix in enumerate('ilfda')), ('ret', 169))
+_opcodes(BYTE, ('bipush', 16))
+_opcodes(SHORT, ('sipush', 17))
+_opcodes(CONSTANT, ('ldc', 18), ('ldc_w', 19), ('ldc2_w', 20))
+_opcodes(CLASS, ('new', 187), ('anewarray', 189), ('checkcast', 192), ('instanceof', 193))
+_opcodes(FIELD, ('getstatic', 178), ('putstatic', 179), ('getfield', 180), ('putfield', 181))
+_opcodes(METHOD, ('invokevirtual', 182), ('invokespecial', 183), ('invokenonvirtual', 183), ('invokestatic', 184))
+_opcodes(INTERFACE_METHOD, ('invokeinterface', 185))
+_opcodes(BRANCH,
+    ('ifeq', 153), ('ifne', 154), ('iflt', 155), ('ifge', 156), ('ifgt', 157), ('ifle', 158),
+    ('if_icmpeq', 159), ('if_icmpne', 160), ('if_icmplt', 161), ('if_icmpge', 162), ('if_icmpgt', 163),
+    ('if_icmple', 164), ('if_acmpeq', 165), ('if_acmpne', 166), ('goto', 167), ('jsr', 168),
+    ('ifnull', 198), ('ifnonnull', 199), ('goto_w', 200), ('jsr_w', 201))
+_opcodes(IINC, ('iinc', 132))
+_opcodes(NEWARRAY, ('newarray', 188))
+_opcodes(MULTIANEWARRAY, ('multianewarray', 197))
+_opcodes(TABLESWITCH, ('tableswitch', 170))
+_opcodes(LOOKUPSWITCH, ('lookupswitch', 171))
+
+LABEL_KINDS = (BRANCH, TABLESWITCH, LOOKUPSWITCH)
+
+
+def descriptor_words(descriptor):
+    """Returns the number of local variable words taken by the parameters of a method *descriptor*."""
+    words = 0
+    i = 1
+    while descriptor[i] != ')':
+        if descriptor[i] in 'JD':
+            words += 2
+            i += 1
+            continue
+
+        words += 1
+        while descriptor[i] == '[':
+            i += 1
+        if descriptor[i] == 'L':
+            i = descriptor.index(';', i)
+        i += 1
+
+    return words
+
+
+class Label:
+    """A position in a method's code. Labels are compared by identity; names are only given to them when the
+    method is written out as Jasmin."""
+    __slots__ = ()
+
+
+class Instruction:
+    __slots__ = ('mnemonic', 'operands')
+
+    def __init__(self, mnemonic, *operands):
+        if mnemonic not in OPCODES:
+            raise ValueError('Unknown instruction "{}"'.format(mnemonic))
+
+        self.mnemonic = mnemonic
+        self.operands = operands
+
+    @property
+    def opcode(self):
+        return OPCODES[self.mnemonic][0]
+
+    @property
+    def kind(self):
+        return OPCODES[self.mnemonic][1]
+
+    def relabel(self, labels):
+        """Returns a copy of this instruction with its label operands replaced according to *labels*."""
+        kind = self.kind
+        if kind == BRANCH:
+            return Instruction(self.mnemonic, labels[self.operands[0]])
+        elif kind == TABLESWITCH:
+            low, high, targets, default = self.operands
+            return Instruction(self.mnemonic, low, high, tuple(labels[target] for target in targets), labels[default])
+        elif kind == LOOKUPSWITCH:
+            pairs, default = self.operands
+            return Instruction(self.mnemonic, tuple((key, labels[target]) for key, target in pairs), labels[default])
+        return self
+
+    def __repr__(self):
+        return ' '.join((self.mnemonic, *map(str, self.operands)))
+
+
+class Code:
+    """A sequence of instructions and labels that the code generator appends to."""
+    __slots__ = ('items', '_has_labels')
+
+    def __init__(self):
+        self.items = []
+        self._has_labels = False
+
+    def add(self, mnemonic, *operands):
+        self.items.append(Instruction(mnemonic, *operands))
+
+    def add_all(self, instructions):
+        """Appends each (mnemonic, *operands) tuple in *instructions*."""
+        for mnemonic, *operands in instructions:
+            self.items.append(Instruction(mnemonic, *operands))
+
+    def place(self, label):
+        self.items.append(label)
+        self._has_labels = True
+
+    def extend(self, other):
+        """Appends the contents of another Code. Labels in *other* are replaced by fresh ones, so the same fragment
+        can be pasted into a method more than once."""
+        if not other._has_labels:
+            self.items.extend(other.items)
+            return
+
+        labels = {item: Label() for item in other.items if isinstance(item, Label)}
+        for item in other.items:
+            if isinstance(item, Label):
+                self.items.append(labels[item])
+            else:
+                self.items.append(item.relabel(labels))
+        self._has_labels = True
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class ExceptionHandler:
+    __slots__ = ('catch_type', 'start', 'end', 'handler')
+
+    def __init__(self, catch_type, start, end, handler):
+        self.catch_type = catch_type
+        self.start = start
+        self.end = end
+        self.handler = handler
+
+
+class Field:
+    def __init__(self, access, name, descriptor, value=None):
+        self.access = tuple(access)
+        self.name = name
+        self.descriptor = descriptor
+        self.value = value
+
+
+class Method:
+    def __init__(self, access, name, descriptor, code=None, max_stack=None, max_locals=None):
+        self.access = tuple(access)
+        self.name = name
+        self.descriptor = descriptor
+        self.code = code if code is not None else Code()
+        self.handlers = []
+        self.max_stack = max_stack
+        self.max_locals = max_locals
+
+    @property
+    def is_static(self):
+        return 'static' in self.access
+
+    @property
+    def has_code(self):
+        return 'abstract' not in self.access and 'native' not in self.access
+
+
+class ClassDef:
+    """Everything needed to write out a single class, either as Jasmin text or as a class file."""
+
+    def __init__(self, name, super_name='java/lang/Object', access=('public',)):
+        self.name = name
+        self.super_name = super_name
+        self.access = tuple(access)
+        self.interfaces = []
+        self.fields = []
+        self.methods = []
+
+    def add_field(self, *args, **kwargs):
+        field = Field(*args, **kwargs)
+        self.fields.append(field)
+        return field
+
+    def add_method(self, *args, **kwargs):
+        method = Method(*args, **kwargs)
+        self.methods.append(method)
+        return method
+
+
+def access_flags(access):
+    flags = 0
+    for name in access:
+        flags |= ACCESS_FLAGS[name]
+    return flags
+
+
+def _jasmin_string(value):
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\t', '\\t')
+    return '"{}"'.format(escaped)
+
+
+def _jasmin_constant(value):
+    if isinstance(value, str):
+        return _jasmin_string(value)
+    return repr(value)
+
+
+def _jasmin_instruction(instruction, names):
+    kind = instruction.kind
+    mnemonic = instruction.mnemonic
+    operands = instruction.operands
+
+    if kind == NONE:
+        return mnemonic
+    elif kind == CONSTANT:
+        return '{} {}'.format(mnemonic, _jasmin_constant(operands[0]))
+    elif kind == FIELD:
+        return '{} {}/{} {}'.format(mnemonic, *operands)
+    elif kind in (METHOD, INTERFACE_METHOD):
+        owner, name, descriptor = operands
+        ret = '{} {}/{}{}'.format(mnemonic, owner, name, descriptor)
+        if kind == INTERFACE_METHOD:
+            ret += ' {}'.format(descriptor_words(descriptor) + 1)
+        return ret
+    elif kind == BRANCH:
+        return '{} {}'.format(mnemonic, names[operands[0]])
+    elif kind == TABLESWITCH:
+        low, high, targets, default = operands
+        return '\n'.join(('{} {} {}'.format(mnemonic, low, high), *(names[target] for target in targets),
+                          'default : {}'.format(names[default])))
+    elif kind == LOOKUPSWITCH:
+        pairs, default = operands
+        return '\n'.join((mnemonic, *('{} : {}'.format(key, names[target]) for key, target in pairs),
+                          'default : {}'.format(names[default])))
+    return ' '.join((mnemonic, *map(str, operands)))
+
+
+def _jasmin_method(method):
+    lines = ['.method {} {}{}'.format(' '.join(method.access), method.name, method.descriptor)]
+    if method.has_code:
+        names = {}
+        for item in method.code:
+            if isinstance(item, Label):
+                names[item] = 'L{}'.format(len(names))
+
+        if method.max_stack is not None:
+            lines.append('.limit stack {}'.format(method.max_stack))
+        if method.max_locals is not None:
+            lines.append('.limit locals {}'.format(method.max_locals))
+
+        for item in method.code:
+            if isinstance(item, Label):
+                lines.append('{}:'.format(names[item]))
+            else:
+                lines.append(_jasmin_instruction(item, names))
+
+        for handler in method.handlers:
+            lines.append('.catch {} from {} to {} using {}'.format(
+                handler.catch_type or 'all', names[handler.start], names[handler.end], names[handler.handler]))
+
+    lines.append('.end method')
+    return '\n'.join(lines)
+
+
+def to_jasmin(classdef):
+    """Writes *classdef* out as Jasmin assembly text."""
+    lines = ['.class {} {}'.format(' '.join(classdef.access), classdef.name),
+             '.super {}'.format(classdef.super_name)]
+    lines.extend('.implements {}'.format(interface) for interface in classdef.interfaces)
+
+    for field in classdef.fields:
+        line = '.field {} {} {}'.format(' '.join(field.access), field.name, field.descriptor)
+        if field.value is not None:
+            line += ' = {}'.format(_jasmin_constant(field.value))
+        lines.append(line)
+
+    lines.extend(_jasmin_method(method) for method in classdef.methods)
+
+    return '\n'.join(lines) + '\n'
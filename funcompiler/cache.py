@@ -0,0 +1,163 @@
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+_version = None
+
+
+def compiler_version():
+    """A hash of the compiler's own modules, so that classes cached by any other version are never used."""
+    global _version
+    if _version is None:
+        package = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(package)):
+            if name.endswith('.py'):
+                with open(os.path.join(package, name), 'rb') as infile:
+                    digest.update(name.encode('utf-8'))
+                    digest.update(infile.read())
+        _version = digest.hexdigest()
+    return _version
+
+
+class ClassCache:
+    """A directory of serialized classes, each stored under a hash of everything its code depends on, so that a
+    class whose inputs haven't changed is reused without being generated or assembled again. Once the entries take
+    more than *max_bytes*, the ones used least recently are removed. The number of hits, misses and evictions is
+    counted."""
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The total size of the entries, only worked out once something is stored.
+        self._size = None
+
+    def key(self, *parts):
+        """The key of the class generated from *parts*, which are turned into strings, by this compiler."""
+        digest = hashlib.sha256(compiler_version().encode('utf-8'))
+        for part in parts:
+            digest.update(b'\0')
+            digest.update(str(part).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entries(self):
+        """The (modification time, size, path) of every entry. Processes sharing the directory may remove entries
+        at any time, so one that has gone by the time it is looked at is left out."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get(self, key):
+        """The data stored under *key*, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as infile:
+                data = infile.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # The modification time records when an entry was last used, which is what eviction goes by.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process since it was read, which doesn't make what was read any less valid.
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Stores *data* under *key*, then evicts entries until the cache fits in max_bytes again."""
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+
+        path = self._path(key)
+        try:
+            self._size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+
+        # The entry is written to a file of its own first, so an entry is never seen half written.
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(data)
+        os.replace(temp, path)
+        self._size += len(data)
+
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                # Already evicted by another process.
+                pass
+            self._size -= size
+
+
+class MemoryClassCache(ClassCache):
+    """A ClassCache kept in memory rather than in a directory, for a process that compiles many modules in turn.
+    It can be shared by compilations running in different threads."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        # The entries, from the one used least recently to the one used most recently.
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size(self):
+        """The number of bytes stored."""
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = data
+            self._size += len(data)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
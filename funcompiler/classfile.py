@@ -0,0 +1,558 @@
+import struct
+
+from funcompiler.bytecode import (
+    OPCODES, NONE, LOCAL, BYTE, SHORT, CONSTANT, CLASS, FIELD, METHOD, INTERFACE_METHOD, BRANCH, IINC, NEWARRAY,
+    MULTIANEWARRAY, TABLESWITCH, Label, Instruction, ExceptionHandler, Method, ClassDef, access_flags,
+    descriptor_words
+)
+from funcompiler import frames
+
+MAGIC = 0xCAFEBABE
+MAJOR_VERSION = 49
+MINOR_VERSION = 0
+
+ACC_SUPER = 0x0020
+
+WIDE = 196
+
+ARRAY_TYPES = {
+    'boolean': 4,
+    'char': 5,
+    'float': 6,
+    'double': 7,
+    'byte': 8,
+    'short': 9,
+    'int': 10,
+    'long': 11
+}
+
+# Conditional branches paired with their negation, so that out of range branches can jump over a goto_w.
+_NEGATED_BRANCHES = {}
+for _a, _b in (('ifeq', 'ifne'), ('iflt', 'ifge'), ('ifgt', 'ifle'), ('if_icmpeq', 'if_icmpne'),
+               ('if_icmplt', 'if_icmpge'), ('if_icmpgt', 'if_icmple'), ('if_acmpeq', 'if_acmpne'),
+               ('ifnull', 'ifnonnull')):
+    _NEGATED_BRANCHES[_a] = _b
+    _NEGATED_BRANCHES[_b] = _a
+
+_WIDE_JUMPS = {'goto': 'goto_w', 'jsr': 'jsr_w'}
+
+
+class AssemblerError(Exception):
+    pass
+
+
+def _modified_utf8(value):
+    """Encodes *value* the way the JVM expects CONSTANT_Utf8 entries: NUL as two bytes and supplementary
+    characters as surrogate pairs."""
+    ret = bytearray()
+    for char in value:
+        code = ord(char)
+        if code > 0xFFFF:
+            code -= 0x10000
+            units = (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+        else:
+            units = (code,)
+
+        for unit in units:
+            if 0 < unit < 0x80:
+                ret.append(unit)
+            elif unit < 0x800:
+                ret += bytes((0xC0 | (unit >> 6), 0x80 | (unit & 0x3F)))
+            else:
+                ret += bytes((0xE0 | (unit >> 12), 0x80 | ((unit >> 6) & 0x3F), 0x80 | (unit & 0x3F)))
+
+    return bytes(ret)
+
+
+class ConstantPool:
+    """The constant pool of a single class. Entries are de-duplicated, and indices are handed out in insertion
+    order starting from 1."""
+
+    def __init__(self):
+        self._entries = []
+        self._indices = {}
+        self._count = 1
+
+    def _add(self, key, data, slots=1):
+        if key not in self._indices:
+            self._indices[key] = self._count
+            self._entries.append(data)
+            self._count += slots
+
+            if self._count > 0xFFFF:
+                raise AssemblerError('Constant pool overflow')
+
+        return self._indices[key]
+
+    def utf8(self, value):
+        encoded = _modified_utf8(value)
+        return self._add(('Utf8', value), struct.pack('>BH', 1, len(encoded)) + encoded)
+
+    def class_ref(self, name):
+        return self._add(('Class', name), struct.pack('>BH', 7, self.utf8(name)))
+
+    def string(self, value):
+        return self._add(('String', value), struct.pack('>BH', 8, self.utf8(value)))
+
+    def integer(self, value):
+        if not -2 ** 31 <= value < 2 ** 31:
+            raise AssemblerError('Integer constant out of range: {}'.format(value))
+        return self._add(('Integer', value), struct.pack('>Bi', 3, value))
+
+    def float(self, value):
+        packed = struct.pack('>f', value)
+        return self._add(('Float', packed), b'\x04' + packed)
+
+    def long(self, value):
+        return self._add(('Long', value), struct.pack('>Bq', 5, value), slots=2)
+
+    def double(self, value):
+        packed = struct.pack('>d', value)
+        return self._add(('Double', packed), b'\x06' + packed, slots=2)
+
+    def name_and_type(self, name, descriptor):
+        return self._add(('NameAndType', name, descriptor),
+                         struct.pack('>BHH', 12, self.utf8(name), self.utf8(descriptor)))
+
+    def _member(self, tag, owner, name, descriptor):
+        return self._add((tag, owner, name, descriptor),
+                         struct.pack('>BHH', tag, self.class_ref(owner), self.name_and_type(name, descriptor)))
+
+    def field_ref(self, owner, name, descriptor):
+        return self._member(9, owner, name, descriptor)
+
+    def method_ref(self, owner, name, descriptor):
+        return self._member(10, owner, name, descriptor)
+
+    def interface_method_ref(self, owner, name, descriptor):
+        return self._member(11, owner, name, descriptor)
+
+    def __len__(self):
+        return self._count
+
+    def to_bytes(self):
+        return struct.pack('>H', self._count) + b''.join(self._entries)
+
+
+def _field_bytes(field, pool):
+    attributes = []
+    if field.value is not None:
+        attributes.append(struct.pack('>HIH', pool.utf8('ConstantValue'), 2,
+                                      _constant_index(pool, field.value, field.descriptor)))
+
+    return struct.pack('>HHHH', access_flags(field.access), pool.utf8(field.name), pool.utf8(field.descriptor),
+                       len(attributes)) + b''.join(attributes)
+
+
+def _method_bytes(method, pool):
+    attributes = []
+    if method.has_code:
+        code, labels = _assemble(method.code, pool)
+
+        handlers = b''.join(struct.pack('>HHHH', _label_offset(labels, handler.start),
+                                        _label_offset(labels, handler.end), _label_offset(labels, handler.handler),
+                                        pool.class_ref(handler.catch_type) if handler.catch_type else 0)
+                            for handler in method.handlers)
+
+        # Jasmin defaults the stack limit to a single word when none is given.
+        max_stack = 1 if method.max_stack is None else method.max_stack
+        max_locals = frames.max_locals(method) if method.max_locals is None else method.max_locals
+
+        body = struct.pack('>HHI', max_stack, max_locals, len(code)) + code + \
+            struct.pack('>H', len(method.handlers)) + handlers + struct.pack('>H', 0)
+        attributes.append(struct.pack('>HI', pool.utf8('Code'), len(body)) + body)
+
+    return struct.pack('>HHHH', access_flags(method.access), pool.utf8(method.name), pool.utf8(method.descriptor),
+                       len(attributes)) + b''.join(attributes)
+
+
+def to_bytes(classdef):
+    """Serializes *classdef* as a class file. The constant pool is filled in while the members are encoded, so it
+    is built last but placed before them."""
+    pool = ConstantPool()
+
+    this_class = pool.class_ref(classdef.name)
+    super_class = pool.class_ref(classdef.super_name)
+    interfaces = [pool.class_ref(interface) for interface in classdef.interfaces]
+    fields = [_field_bytes(field, pool) for field in classdef.fields]
+    methods = [_method_bytes(method, pool) for method in classdef.methods]
+
+    return b''.join((
+        struct.pack('>IHH', MAGIC, MINOR_VERSION, MAJOR_VERSION),
+        pool.to_bytes(),
+        struct.pack('>HHHH', access_flags(classdef.access) | ACC_SUPER, this_class, super_class, len(interfaces)),
+        b''.join(struct.pack('>H', interface) for interface in interfaces),
+        struct.pack('>H', len(fields)),
+        *fields,
+        struct.pack('>H', len(methods)),
+        *methods,
+        struct.pack('>H', 0)
+    ))
+
+
+def _constant_index(pool, value, descriptor=None):
+    if isinstance(value, str):
+        return pool.string(value)
+    elif isinstance(value, float):
+        return pool.double(value) if descriptor in (None, 'D') else pool.float(value)
+    elif descriptor == 'J':
+        return pool.long(value)
+    return pool.integer(value)
+
+
+def _instruction_size(instruction, offset, pool, wide):
+    """The number of bytes *instruction* will take when placed at *offset*."""
+    kind = instruction.kind
+    if kind == NONE:
+        return 1
+    elif kind == LOCAL:
+        return 4 if instruction.operands[0] > 0xFF else 2
+    elif kind == IINC:
+        index, const = instruction.operands
+        return 6 if index > 0xFF or not -128 <= const < 128 else 3
+    elif kind in (BYTE, NEWARRAY):
+        return 2
+    elif kind in (SHORT, CLASS, FIELD, METHOD):
+        return 3
+    elif kind == CONSTANT:
+        if instruction.mnemonic == 'ldc' and _ldc_index(instruction, pool) <= 0xFF:
+            return 2
+        return 3
+    elif kind == INTERFACE_METHOD:
+        return 5
+    elif kind == MULTIANEWARRAY:
+        return 4
+    elif kind == BRANCH:
+        if instruction.mnemonic in ('goto_w', 'jsr_w'):
+            return 5
+        elif wide:
+            # Conditional branches become "if<not cond> +8; goto_w target".
+            return 5 if instruction.mnemonic in _WIDE_JUMPS else 8
+        return 3
+
+    padding = 3 - offset % 4
+    if kind == TABLESWITCH:
+        return 1 + padding + 12 + 4 * len(instruction.operands[2])
+    return 1 + padding + 8 + 8 * len(instruction.operands[0])
+
+
+def _ldc_index(instruction, pool):
+    value = instruction.operands[0]
+    if instruction.mnemonic == 'ldc2_w':
+        return pool.double(value) if isinstance(value, float) else pool.long(value)
+    elif isinstance(value, float):
+        return pool.float(value)
+    return _constant_index(pool, value)
+
+
+def _assemble(code, pool):
+    """Lays out *code*, resolving labels to offsets. Branches that cannot reach their label with a 16-bit offset
+    are widened, which may move other labels, so the layout is repeated until it is stable."""
+    wide = set()
+
+    while True:
+        offsets = []
+        labels = {}
+        offset = 0
+        for i, instruction in enumerate(code):
+            offsets.append(offset)
+            if isinstance(instruction, Label):
+                labels[instruction] = offset
+            else:
+                offset += _instruction_size(instruction, offset, pool, i in wide)
+
+        widened = False
+        for i, instruction in enumerate(code):
+            if isinstance(instruction, Instruction) and instruction.kind == BRANCH and i not in wide \
+                    and instruction.mnemonic not in ('goto_w', 'jsr_w'):
+                target = _label_offset(labels, instruction.operands[0])
+                if not -0x8000 <= target - offsets[i] < 0x8000:
+                    wide.add(i)
+                    widened = True
+
+        if not widened:
+            break
+
+    if offset > 0xFFFF:
+        raise AssemblerError('Method code is too large ({} bytes)'.format(offset))
+
+    out = bytearray()
+    for i, instruction in enumerate(code):
+        if isinstance(instruction, Instruction):
+            _encode(instruction, offsets[i], labels, pool, i in wide, out)
+
+    return bytes(out), labels
+
+
+def _label_offset(labels, label):
+    if label not in labels:
+        raise AssemblerError('Branch to a label that was never placed')
+    return labels[label]
+
+
+def _encode(instruction, offset, labels, pool, wide, out):
+    kind = instruction.kind
+    opcode = instruction.opcode
+    operands = instruction.operands
+
+    if kind == NONE:
+        out.append(opcode)
+    elif kind == LOCAL:
+        if operands[0] > 0xFF:
+            out += struct.pack('>BBH', WIDE, opcode, operands[0])
+        else:
+            out += struct.pack('>BB', opcode, operands[0])
+    elif kind == IINC:
+        index, const = operands
+        if index > 0xFF or not -128 <= const < 128:
+            out += struct.pack('>BBHh', WIDE, opcode, index, const)
+        else:
+            out += struct.pack('>BBb', opcode, index, const)
+    elif kind == BYTE:
+        out += struct.pack('>Bb', opcode, operands[0])
+    elif kind == SHORT:
+        out += struct.pack('>Bh', opcode, operands[0])
+    elif kind == NEWARRAY:
+        out += struct.pack('>BB', opcode, ARRAY_TYPES[operands[0]])
+    elif kind == CONSTANT:
+        index = _ldc_index(instruction, pool)
+        if instruction.mnemonic == 'ldc' and index <= 0xFF:
+            out += struct.pack('>BB', opcode, index)
+        else:
+            out += struct.pack('>BH', OPCODES['ldc_w'][0] if instruction.mnemonic == 'ldc' else opcode, index)
+    elif kind == CLASS:
+        out += struct.pack('>BH', opcode, pool.class_ref(operands[0]))
+    elif kind == FIELD:
+        out += struct.pack('>BH', opcode, pool.field_ref(*operands))
+    elif kind == METHOD:
+        out += struct.pack('>BH', opcode, pool.method_ref(*operands))
+    elif kind == INTERFACE_METHOD:
+        owner, name, descriptor = operands
+        out += struct.pack('>BHBB', opcode, pool.interface_method_ref(owner, name, descriptor),
+                           descriptor_words(descriptor) + 1, 0)
+    elif kind == MULTIANEWARRAY:
+        out += struct.pack('>BHB', opcode, pool.class_ref(operands[0]), operands[1])
+    elif kind == BRANCH:
+        target = _label_offset(labels, operands[0])
+        if instruction.mnemonic in ('goto_w', 'jsr_w'):
+            out += struct.pack('>Bi', opcode, target - offset)
+        elif wide and instruction.mnemonic in _WIDE_JUMPS:
+            out += struct.pack('>Bi', OPCODES[_WIDE_JUMPS[instruction.mnemonic]][0], target - offset)
+        elif wide:
+            out += struct.pack('>BhBi', OPCODES[_NEGATED_BRANCHES[instruction.mnemonic]][0], 8,
+                               OPCODES['goto_w'][0], target - offset - 3)
+        else:
+            out += struct.pack('>Bh', opcode, target - offset)
+    else:
+        out.append(opcode)
+        out += bytes(3 - offset % 4)
+        if kind == TABLESWITCH:
+            low, high, targets, default = operands
+            out += struct.pack('>iii', _label_offset(labels, default) - offset, low, high)
+            for target in targets:
+                out += struct.pack('>i', _label_offset(labels, target) - offset)
+        else:
+            pairs, default = operands
+            out += struct.pack('>ii', _label_offset(labels, default) - offset, len(pairs))
+            for key, target in sorted(pairs):
+                out += struct.pack('>ii', key, _label_offset(labels, target) - offset)
+
+
+def _tokenize(line):
+    """Splits a line of Jasmin into whitespace-separated tokens, keeping quoted strings whole and dropping
+    comments. As in Jasmin, a ";" only starts a comment at the beginning of a token, since descriptors contain
+    them."""
+    tokens = []
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if char.isspace():
+            i += 1
+        elif char == ';':
+            break
+        elif char == '"':
+            value = []
+            i += 1
+            while line[i] != '"':
+                if line[i] == '\\':
+                    i += 1
+                    value.append({'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}.get(line[i], line[i]))
+                else:
+                    value.append(line[i])
+                i += 1
+            tokens.append(_String(''.join(value)))
+            i += 1
+        else:
+            start = i
+            while i < len(line) and not line[i].isspace():
+                i += 1
+            tokens.append(line[start:i])
+
+    return tokens
+
+
+class _String(str):
+    """A token that was written as a quoted string literal."""
+
+
+def _number(token):
+    try:
+        return int(token, 0)
+    except ValueError:
+        return float(token)
+
+
+def _split_member(spec):
+    """Splits "owner/name" or "owner.name" into its owner class and member name."""
+    separator = max(spec.rfind('/'), spec.rfind('.'))
+    if separator < 0:
+        raise AssemblerError('Expected a qualified member name, got "{}"'.format(spec))
+    return spec[:separator], spec[separator + 1:]
+
+
+def _split_method(spec):
+    paren = spec.index('(')
+    owner, name = _split_member(spec[:paren])
+    return owner, name, spec[paren:]
+
+
+class _Parser:
+    def __init__(self, text):
+        self._lines = iter(text.split('\n'))
+        self.classfile = None
+        self._method = None
+        self._labels = {}
+
+    def _label(self, name):
+        if name not in self._labels:
+            self._labels[name] = Label()
+        return self._labels[name]
+
+    def parse(self):
+        for line in self._lines:
+            tokens = _tokenize(line)
+            if not tokens:
+                continue
+
+            if tokens[0].startswith('.'):
+                self._directive(tokens)
+                continue
+
+            if tokens[0].endswith(':') and not isinstance(tokens[0], _String):
+                self._require_method().code.place(self._label(tokens[0][:-1]))
+                tokens = tokens[1:]
+                if not tokens:
+                    continue
+
+            self._require_method().code.add(*self._instruction(tokens))
+
+        if self.classfile is None:
+            raise AssemblerError('No .class directive found')
+
+        return self.classfile
+
+    def _require_method(self):
+        if self._method is None:
+            raise AssemblerError('Instruction outside of a method')
+        return self._method
+
+    def _directive(self, tokens):
+        directive = tokens[0]
+        if directive in ('.class', '.interface'):
+            access = tokens[1:-1]
+            if directive == '.interface':
+                access += ['interface', 'abstract']
+            self.classfile = ClassDef(tokens[-1], access=access)
+        elif directive == '.super':
+            self.classfile.super_name = tokens[1]
+        elif directive == '.implements':
+            self.classfile.interfaces.append(tokens[1])
+        elif directive == '.field':
+            value = None
+            if '=' in tokens:
+                equals = tokens.index('=')
+                value = tokens[equals + 1]
+                value = value if isinstance(value, _String) else _number(value)
+                tokens = tokens[:equals]
+            self.classfile.add_field(tokens[1:-2], tokens[-2], tokens[-1], value)
+        elif directive == '.method':
+            paren = tokens[-1].index('(')
+            self._method = Method(tokens[1:-1], tokens[-1][:paren], tokens[-1][paren:])
+            self._labels = {}
+        elif directive == '.end':
+            self.classfile.methods.append(self._require_method())
+            self._method = None
+        elif directive == '.limit':
+            if tokens[1] == 'stack':
+                self._require_method().max_stack = int(tokens[2])
+            else:
+                self._require_method().max_locals = int(tokens[2])
+        elif directive == '.catch':
+            # .catch <class> from <label> to <label> using <label>
+            catch_type = None if tokens[1] == 'all' else tokens[1]
+            self._require_method().handlers.append(ExceptionHandler(
+                catch_type, self._label(tokens[3]), self._label(tokens[5]), self._label(tokens[7])))
+        elif directive in ('.source', '.throws', '.line', '.var', '.bytecode'):
+            pass
+        else:
+            raise AssemblerError('Unknown directive "{}"'.format(directive))
+
+    def _instruction(self, tokens):
+        mnemonic, args = tokens[0], tokens[1:]
+        if mnemonic not in OPCODES:
+            raise AssemblerError('Unknown instruction "{}"'.format(mnemonic))
+
+        kind = OPCODES[mnemonic][1]
+        if kind == NONE:
+            return (mnemonic,)
+        elif kind in (LOCAL, BYTE, SHORT):
+            return (mnemonic, int(args[0], 0))
+        elif kind == IINC:
+            return (mnemonic, int(args[0], 0), int(args[1], 0))
+        elif kind == CONSTANT:
+            value = args[0]
+            return (mnemonic, value if isinstance(value, _String) else _number(value))
+        elif kind in (CLASS, NEWARRAY):
+            return (mnemonic, args[0])
+        elif kind == MULTIANEWARRAY:
+            return (mnemonic, args[0], int(args[1]))
+        elif kind == FIELD:
+            return (mnemonic, *_split_member(args[0]), args[1])
+        elif kind in (METHOD, INTERFACE_METHOD):
+            return (mnemonic, *_split_method(args[0]))
+        elif kind == BRANCH:
+            return (mnemonic, self._label(args[0]))
+        elif kind == TABLESWITCH:
+            low = int(args[0])
+            targets, default = self._switch_cases(keyed=False)
+            return (mnemonic, low, low + len(targets) - 1, tuple(targets), default)
+        else:
+            pairs, default = self._switch_cases(keyed=True)
+            return (mnemonic, tuple(pairs), default)
+
+    def _switch_cases(self, keyed):
+        """Reads the case lines following a tableswitch or lookupswitch, up to and including the default."""
+        cases = []
+        for line in self._lines:
+            tokens = [token for token in _tokenize(line.replace(':', ' : ')) if token != ':']
+            if not tokens:
+                continue
+            elif tokens[0] == 'default':
+                return cases, self._label(tokens[1])
+            elif keyed:
+                cases.append((int(tokens[0]), self._label(tokens[1])))
+            else:
+                cases.append(self._label(tokens[0]))
+
+        raise AssemblerError('Unterminated switch')
+
+
+def parse_jasmin(text):
+    """Parses Jasmin assembly *text* describing a single class into a ClassDef."""
+    return _Parser(text).parse()
+
+
+def assemble(text):
+    """Assembles Jasmin *text* straight into the bytes of a .class file, returning (class name, bytes)."""
+    classdef = parse_jasmin(text)
+    return classdef.name, to_bytes(classdef)
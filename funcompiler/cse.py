@@ -0,0 +1,112 @@
+from funcompiler.expression import (
+    Expr, Terminal, Identifier, Operator, Grouping, UnaryOperator, BinaryOperator, Lists, FunctionApplication
+)
+from funcompiler import util
+
+# The nodes worth keeping in a local. Anything smaller is as cheap to push again as to load.
+_SHAREABLE = (UnaryOperator, BinaryOperator, Lists, FunctionApplication)
+
+
+class CommonSubexpressions:
+    """The subexpressions that occur more than once in the expression compiled into a single method. The first
+    time each is emitted its value is saved in a local, from *first_local* upwards, and later occurrences load
+    it from there. Every expression is pure and evaluated strictly, so the saved value is always there by the
+    time it is needed.
+
+    Nodes are numbered so that two get the same number exactly when they are equal under Expr.__eq__, except
+    that groupings are transparent. Numbering from the leaves up means each node is hashed only once."""
+
+    def __init__(self, expr, first_local):
+        self._keys = {}
+        self._numbers = {}
+        self._next_local = first_local
+        # The (local, descriptor, primitive type or None) each common subexpression has been saved in.
+        self._locals = {}
+
+        self._number(expr)
+        self._common = set()
+        self._count(expr, set())
+
+    def _number(self, expr):
+        if isinstance(expr, Grouping):
+            number = self._number(expr.expr)
+        else:
+            if isinstance(expr, Terminal):
+                key = (expr.__class__, expr.key)
+            elif isinstance(expr, Identifier):
+                key = (expr.__class__, expr.value)
+            else:
+                key = [expr.__class__]
+                for child in expr._children.values():
+                    if isinstance(child, Expr):
+                        key.append(self._number(child))
+                    elif type(child) is tuple:
+                        key.append(tuple(self._number(item) for item in child))
+                    elif isinstance(child, Operator):
+                        key.append(child.value)
+                    else:
+                        # Types have no equality of their own, so nodes holding them are never shared.
+                        key.append(id(child))
+                key = tuple(key)
+            number = self._keys.setdefault(key, len(self._keys))
+            self._numbers[id(expr)] = (expr, number)
+
+        return number
+
+    def _count(self, expr, seen):
+        """Finds the shareable nodes that occur more than once, in the order they are evaluated. Nothing inside
+        a repeated node is visited, as it will be loaded whole."""
+        if isinstance(expr, _SHAREABLE):
+            number = self._numbers[id(expr)][1]
+            if number in seen:
+                self._common.add(number)
+                return
+            seen.add(number)
+
+        if isinstance(expr, FunctionApplication):
+            # Only whole applications are shared, as a saturated call never emits the partial applications
+            # along its spine.
+            func, args = expr._spine()
+            children = [func, *args]
+        else:
+            children = []
+            for child in expr._children.values():
+                if isinstance(child, Expr):
+                    children.append(child)
+                elif type(child) is tuple:
+                    children.extend(child)
+
+        for child in children:
+            self._count(child, seen)
+
+    def is_common(self, expr):
+        entry = self._numbers.get(id(expr))
+        return entry is not None and entry[1] in self._common
+
+    def load(self, expr, code, typ):
+        """Pushes the saved value of *expr*, as a primitive of type *typ*, or boxed if it is None. Returns False,
+        adding nothing, if it hasn't been saved yet."""
+        entry = self._locals.get(self._numbers[id(expr)][1])
+        if entry is None:
+            return False
+
+        local, descriptor, saved = entry
+        code.add_all(util.load(descriptor, local))
+        if typ is None or not util.is_primitive(typ) or saved is None or type(saved) is not type(typ):
+            if saved is not None:
+                code.add_all(util.box(saved))
+            if typ is not None:
+                code.add_all(util.unbox(typ))
+        return True
+
+    def store(self, expr, code, typ):
+        """Saves a copy of the value of *expr* on top of the stack, a primitive of type *typ* or boxed if it is
+        None, in a new local."""
+        saved = typ if typ is not None and util.is_primitive(typ) else None
+        descriptor = util.descriptor(saved) if saved is not None else 'Ljava/lang/Object;'
+
+        code.add('dup2' if descriptor == 'D' else 'dup')
+        code.add_all(util.store(descriptor, self._next_local))
+
+        self._locals[self._numbers[id(expr)][1]] = (self._next_local, descriptor, saved)
+        self._next_local += 2 if descriptor == 'D' else 1
@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+
+from funcompiler.cache import MemoryClassCache
+from funcompiler.driver import BACKENDS
+from funcompiler.funast import Scope
+from funcompiler.parser import Parser, ParseError
+
+# JSON-RPC error codes; the last one is the Language Server Protocol's.
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+COMPILE_ERROR = -32000
+REQUEST_CANCELLED = -32800
+
+# The longest request read, in bytes.
+_LIMIT = 16 * 1024 * 1024
+
+
+class RequestError(Exception):
+    """Raised to answer a request with a JSON-RPC error."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Daemon:
+    """A compiler that stays running, answering JSON-RPC 2.0 requests sent as one JSON object per line:
+
+        compile   {"source": text or "path": file, "output": directory, "format": "jasmin" | "class" | "jar",
+                   "fold": true, "unbox": true, "function_methods": false}
+                  -> {"module": name, "files": [names written], "cached": bool, "hits": n, "misses": n, "seconds": s}
+        cancel    {"id": id of a compile request} -> whether it was still running
+        stats     {} -> the requests served and the state of both caches
+        shutdown  {} -> null, and no more requests are read
+
+    Every compilation has a Scope of its own and writes into a directory of its own, so requests running at the
+    same time can't see each other's declarations or files. Only once it has finished are its files moved into the
+    output directory, each replacing the file there in one step, so a failed or cancelled compilation leaves the
+    output as it was.
+
+    Kept between requests are everything imported and the serialized runtime, the class generated for each
+    declaration, and the files written for each source and options compiled before, so that a module compiled
+    again unchanged isn't even parsed. Both caches drop what was used least recently to stay within half of
+    *max_bytes* each. Compilations run on *workers* threads, while requests, including cancellations, keep being
+    read."""
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, workers=1):
+        self.classes = MemoryClassCache(max_bytes // 2)
+        self.modules = MemoryClassCache(max_bytes // 2)
+        self.requests = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        # The task and cancellation flag of each compile request still running, by id.
+        self._running = {}
+        self._shutdown = None
+
+    def close(self):
+        """Waits for the compilations still running, stopping them before they write anything."""
+        for _, cancelled in self._running.values():
+            cancelled.set()
+        self._executor.shutdown(wait=True)
+
+    async def serve(self, reader, writer):
+        """Answers the requests read from *reader*, one a line, until it ends or the daemon is shut down. Each
+        answer is written to *writer* as soon as it is ready, so they may not come in the order asked."""
+        lock = asyncio.Lock()
+        tasks = set()
+        if self._shutdown is None:
+            self._shutdown = asyncio.Event()
+
+        async def respond(response):
+            async with lock:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        stop = asyncio.ensure_future(self._shutdown.wait())
+        try:
+            while True:
+                read = asyncio.ensure_future(reader.readline())
+                await asyncio.wait((read, stop), return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    read.cancel()
+                    break
+                try:
+                    line = read.result()
+                except ValueError:
+                    # Longer than the reader's limit, so where the next request starts is lost.
+                    await respond(self._error(None, INVALID_REQUEST, 'Request too long'))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(self._answer(line, respond))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            stop.cancel()
+            writer.close()
+
+    async def _answer(self, line, respond):
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            await respond(self._error(None, PARSE_ERROR, str(error)))
+            return
+
+        ident = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or \
+                    not isinstance(request.get('method'), str):
+                raise RequestError(INVALID_REQUEST, 'Not a JSON-RPC 2.0 request')
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise RequestError(INVALID_PARAMS, 'Parameters must be named')
+
+            method = self._methods.get(request['method'])
+            if method is None:
+                raise RequestError(METHOD_NOT_FOUND, 'No method {!r}'.format(request['method']))
+            self.requests += 1
+            result = await method(self, ident, params)
+        except RequestError as error:
+            response = self._error(ident, error.code, str(error))
+        except asyncio.CancelledError:
+            response = self._error(ident, REQUEST_CANCELLED, 'Cancelled')
+        except Exception as error:
+            # Anything else is a fault in the daemon, but the request is still answered, so the client isn't left
+            # waiting.
+            response = self._error(ident, INTERNAL_ERROR, '{}: {}'.format(type(error).__name__, error))
+        else:
+            response = {'jsonrpc': '2.0', 'id': ident, 'result': result}
+
+        # Notifications, which have no id, aren't answered.
+        if ident is not None:
+            await respond(response)
+
+    @staticmethod
+    def _error(ident, code, message):
+        return {'jsonrpc': '2.0', 'id': ident, 'error': {'code': code, 'message': message}}
+
+    async def _compile(self, ident, params):
+        if ('source' in params) == ('path' in params):
+            raise RequestError(INVALID_PARAMS, 'Give either a source or a path')
+        if not isinstance(params.get('output'), str):
+            raise RequestError(INVALID_PARAMS, 'No output directory')
+        if params.get('format', 'jasmin') not in BACKENDS:
+            raise RequestError(INVALID_PARAMS, 'Unknown format {!r}'.format(params.get('format')))
+
+        cancelled = threading.Event()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self.compile, params, cancelled)
+        if isinstance(ident, (str, int)):
+            self._running[ident] = (asyncio.current_task(), cancelled)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # A compilation that has started can't be stopped part way through, but it won't write anything.
+            cancelled.set()
+            raise
+        except Cancelled:
+            raise asyncio.CancelledError()
+        finally:
+            self._running.pop(ident, None)
+
+    async def _cancel(self, ident, params):
+        running = self._running.get(params.get('id'))
+        if running is None:
+            return False
+        task, cancelled = running
+        cancelled.set()
+        task.cancel()
+        return True
+
+    async def _stats(self, ident, params):
+        return {
+            'requests': self.requests,
+            'running': len(self._running),
+            'classes': self._cache_stats(self.classes),
+            'modules': self._cache_stats(self.modules)
+        }
+
+    @staticmethod
+    def _cache_stats(cache):
+        return {'entries': len(cache), 'bytes': cache.size, 'hits': cache.hits, 'misses': cache.misses,
+                'evictions': cache.evictions}
+
+    async def _stop(self, ident, params):
+        self._shutdown.set()
+
+    _methods = {
+        'compile': _compile,
+        'cancel': _cancel,
+        'stats': _stats,
+        'shutdown': _stop
+    }
+
+    def compile(self, params, cancelled=None):
+        """Compiles the module described by *params*, as taken by the compile method, and returns its result.
+        Stops before writing anything once *cancelled*, a threading.Event, is set."""
+        cancelled = cancelled or threading.Event()
+        start = time.perf_counter()
+        options = (params.get('format', 'jasmin'), bool(params.get('fold', True)), bool(params.get('unbox', True)),
+                   bool(params.get('function_methods', False)))
+        try:
+            if 'path' in params:
+                with open(params['path'], 'rb') as infile:
+                    source = infile.read()
+            else:
+                source = params['source'].encode('utf-8')
+            os.makedirs(params['output'], exist_ok=True)
+        except (OSError, AttributeError) as error:
+            raise RequestError(INVALID_PARAMS, str(error))
+
+        key = self.modules.key(source, *options)
+        data = self.modules.get(key)
+        result = {'cached': data is not None, 'hits': 0, 'misses': 0}
+        if data is None:
+            module, files = self._build(source, options, params['output'], cancelled, result)
+            data = pickle.dumps((module, files))
+            self.modules.put(key, data)
+        module, files = pickle.loads(data)
+
+        if cancelled.is_set():
+            raise Cancelled()
+        for name, contents in files:
+            fd, temp = tempfile.mkstemp(suffix='.tmp', dir=params['output'])
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(contents)
+            os.replace(temp, os.path.join(params['output'], name))
+
+        result.update(module=module, files=[name for name, _ in files], seconds=time.perf_counter() - start)
+        return result
+
+    def _build(self, source, options, output, cancelled, result):
+        """Compiles *source* in a session of its own, returning the module's name and the (name, contents) of
+        each file written."""
+        backend, fold, unbox, function_methods = options
+        with tempfile.TemporaryDirectory(prefix='.session-', dir=output) as directory:
+            scope = Scope(backend=BACKENDS[backend](directory), unbox=unbox, fold=fold, cache=self.classes,
+                          function_classes=not function_methods)
+            hits, misses = self.classes.hits, self.classes.misses
+            try:
+                module = Parser(scope).parse(source)
+                if cancelled.is_set():
+                    raise Cancelled()
+                module.emit(scope)
+            except (ParseError, AssertionError) as error:
+                raise RequestError(COMPILE_ERROR, str(error) or type(error).__name__)
+            except Cancelled:
+                raise
+            except Exception as error:
+                # A fault in the compiler itself, which still only fails this request.
+                raise RequestError(COMPILE_ERROR, 'internal error: {}: {}'.format(type(error).__name__, error))
+
+            # With several workers these are shared, so only roughly this compilation's.
+            result.update(hits=self.classes.hits - hits, misses=self.classes.misses - misses)
+            files = []
+            for name in sorted(os.listdir(directory)):
+                with open(os.path.join(directory, name), 'rb') as infile:
+                    files.append((name, infile.read()))
+        return module.id.value, files
+
+
+class _Output:
+    """Writes answers to a binary file, such as stdout, which unlike a pipe may be a regular file."""
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+
+    def write(self, data):
+        self.outfile.write(data)
+
+    async def drain(self):
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.flush()
+
+
+async def _stdin():
+    reader = asyncio.StreamReader(limit=_LIMIT)
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    return reader
+
+
+async def serve(daemon, socket=None):
+    """Serves requests on stdin and stdout, or to every connection made to the Unix *socket*, until shut down."""
+    if socket is None:
+        await daemon.serve(await _stdin(), _Output(sys.stdout.buffer))
+        return
+
+    daemon._shutdown = asyncio.Event()
+    server = await asyncio.start_unix_server(daemon.serve, socket, limit=_LIMIT)
+    try:
+        await daemon._shutdown.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        os.remove(socket)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='funcompiler.daemon',
+                                     description='Answers compile requests, sent as JSON-RPC, until shut down.')
+    parser.add_argument('--socket', metavar='PATH', help='listen on a Unix socket rather than stdin')
+    parser.add_argument('--memory', type=int, default=128, metavar='MB',
+                        help='the most memory, in megabytes, that cached classes and modules take')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='the number of modules compiled at once')
+    options = parser.parse_args(argv)
+
+    daemon = Daemon(options.memory * 1024 * 1024, options.jobs)
+    try:
+        asyncio.run(serve(daemon, options.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
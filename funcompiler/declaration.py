@@ -1,11 +1,123 @@
+import functools
+
 from funcompiler.funast import ASTNode
 from funcompiler.childcount import Exactly, GreaterOrEqual
 from funcompiler.expression import Identifier, Expr, Constr, Type
 
-from funcompiler.funtype import Function, Data
+from funcompiler.funtype import Function, Data, type_key
+from funcompiler.bytecode import ClassDef, Code, Label
+from funcompiler.cse import CommonSubexpressions
+from funcompiler import runtime
 from funcompiler import util
 
-from copy import deepcopy
+
+def _identifiers(expr):
+    """The names of every identifier used in *expr*."""
+    names = set()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Identifier):
+            names.add(node.value)
+        for child in node._children.values():
+            if isinstance(child, Expr):
+                stack.append(child)
+            elif type(child) is tuple:
+                stack.extend(item for item in child if isinstance(item, Expr))
+    return names
+
+
+def _from_array(code, i):
+    """Pushes the i-th argument of enter(), from the array it takes."""
+    code.add('aload_1')
+    code.add_all(util.push_int(i))
+    code.add('aaload')
+
+
+def _from_args(code, i):
+    """Pushes the i-th argument of apply()."""
+    code.add_all(util.load(runtime.OBJECT, i + 1))
+
+
+def table_name(module):
+    return '{}Functions'.format(module)
+
+
+def function_table(scope, module, functions):
+    """The class of the values of the FunctionDeclarations in *functions* when their bodies are static methods of
+    the class of *module*. There is one instance for each function, made in the static initializer and kept in a
+    static field named after it, which knows the function's index, arity and name. Entering an instance switches
+    on its index to call the function's method, so a single class serves every function of the module."""
+    name = table_name(module)
+    descriptor = 'L{};'.format(name)
+    classdef = ClassDef(name, 'AbstractFunction', access=('public', 'final'))
+    classdef.add_field(('private', 'final'), 'index', 'I')
+    classdef.add_field(('private', 'final'), 'name', 'Ljava/lang/String;')
+
+    init = classdef.add_method(('private',), '<init>', '(IILjava/lang/String;)V')
+    init.code.add('aload_0')
+    init.code.add('iload_2')
+    init.code.add('invokenonvirtual', 'AbstractFunction', '<init>', '(I)V')
+    init.code.add('aload_0')
+    init.code.add('iload_1')
+    init.code.add('putfield', name, 'index', 'I')
+    init.code.add('aload_0')
+    init.code.add('aload_3')
+    init.code.add('putfield', name, 'name', 'Ljava/lang/String;')
+    init.code.add('return')
+
+    clinit = classdef.add_method(('static',), '<clinit>', '()V')
+    for index, function in enumerate(functions):
+        classdef.add_field(('public', 'static', 'final'), function.id.value, descriptor)
+        clinit.code.add('new', name)
+        clinit.code.add('dup')
+        clinit.code.add_all(util.push_int(index))
+        clinit.code.add_all(util.push_int(len(function.params)))
+        clinit.code.add('ldc', '{}Function with bound parameters: '.format(function.id.value))
+        clinit.code.add('invokespecial', name, '<init>', '(IILjava/lang/String;)V')
+        clinit.code.add('putstatic', name, function.id.value, descriptor)
+    clinit.code.add('return')
+
+    tostring = classdef.add_method(('public',), 'toString', '()Ljava/lang/String;')
+    tostring.code.add('aload_0')
+    tostring.code.add('getfield', name, 'name', 'Ljava/lang/String;')
+    tostring.code.add('areturn')
+
+    # Every index is a case, so the last one is also the default.
+    enter = classdef.add_method(('public',), 'enter', runtime.ENTER_DESCRIPTOR).code
+    labels = tuple(Label() for function in functions)
+    enter.add('aload_0')
+    enter.add('getfield', name, 'index', 'I')
+    enter.add('tableswitch', 0, len(functions) - 1, labels, labels[-1])
+    for function, label in zip(functions, labels):
+        enter.place(label)
+        function._call_invoke(scope, enter, _from_array)
+
+    # As with function classes, applying a function to exactly as many arguments as it takes skips the array.
+    # Instances of any other arity are left to AbstractFunction.
+    for count in range(1, runtime.MAX_APPLY_ARGS + 1):
+        cases = [(index, Label()) for index, function in enumerate(functions) if len(function.params) == count]
+        if not cases:
+            continue
+
+        apply = classdef.add_method(('public',), 'apply', runtime.apply_descriptor(count)).code
+        default = Label()
+        apply.add('aload_0')
+        apply.add('getfield', name, 'index', 'I')
+        apply.add('lookupswitch', tuple(cases), default)
+        for index, label in cases:
+            apply.place(label)
+            functions[index]._call_invoke(scope, apply, _from_args)
+
+        apply.place(default)
+        apply.add('aload_0')
+        for i in range(count):
+            _from_args(apply, i)
+        apply.add('invokenonvirtual', 'AbstractFunction', 'apply', runtime.apply_descriptor(count))
+        apply.add('areturn')
+
+    return classdef
+
 
 class Declaration(ASTNode):
     def __init__(self, scope, *args, **kwargs):
@@ -21,6 +133,9 @@ class FunctionDeclaration(Declaration):
     def __init__(self, scope, *args, **kwargs):
         super().__init__(scope, *args, **kwargs)
 
+        if scope.folder is not None:
+            self._children['expr'] = scope.folder.fold(self.expr, scope, {param.value for param in self.params})
+
         types = Function.infer_types(self.params, self.expr, scope)
         
         param_types = []
@@ -30,218 +145,211 @@ class FunctionDeclaration(Declaration):
         fun_type = Function(param_types, types[self.expr])
 
         scope.add_identifier_type(self.id.value, fun_type)
-        scope.add_identifier(self.id.value, fun_type, 1)
+        scope.add_identifier(self.id.value, fun_type)
+        scope.add_declaration(self.id.value, self)
 
-    def _header(self):
-        """Defines the class, its fields and constructor."""
-        return_str = """
-        .class public {name}Function
-        .super AbstractFunction"""
-
-        for param_num in range(len(self.params[:-1])):
-            return_str += """
-            .field private param_{param_num} Ljava/lang/Object;
-            """.format(param_num=param_num)
-
-        return_str += """
-        .method public <init>()V
-            .limit stack 2
-            aload_0
-            invokenonvirtual AbstractFunction/<init>()V
-
-            aload_0
-            bipush {param_count}
-            putfield AbstractFunction.remaining_params I
-            return
-        .end method"""
-
-        return return_str
-
-    def _tostring(self):
-        """Defines the function's toString() method."""
-        return_str = """
-        .method public toString()Ljava/lang/String;
-        .limit locals 2
-        .limit stack 4
-
-        {create}
-        ldc "{name}Function with bound parameters: "
-        {append}
-        """.format(name=self.id.value, create=util.create_stringbuilder(), append=util.add_to_stringbuilder())
-        
-        for param_num in range(len(self.params[:-1])):
-            return_str += """
-            aload_0
-            getfield {name}Function.param_{param_num} Ljava/lang/Object;
-            dup
-            ifnull skip{param_num}
-            
-            ldc "("
-            {append}
-            invokevirtual java/lang/Object.toString()Ljava/lang/String;
-            {append}
-            ldc ") "
-            {append}
-            goto after{param_num}
-
-            skip{param_num}:
-            pop
-            after{param_num}:
-
-            """.format(param_num=param_num, name=self.id.value, append=util.add_to_stringbuilder())
-
-        return_str += """
-        aload_1
-        invokevirtual java/lang/Object.toString()Ljava/lang/String;
-        areturn
-        .end method
-        """
-
-        return return_str
-
-    def _param_application(self):
-        return_str = ""
-        for param_num in range(len(self.params[:-1])):
-            return_str += """
-            .method public set_{param_num}(Ljava/lang/Object;)V
-                ; Increment the param_number.
-                ; We assume that each set_ will only be called once, at the correct times.
-                .limit locals 2
-                .limit stack 4
-                aload_0
-                getfield AbstractFunction.param_number I
-                iconst_1
-                iadd
-                aload_0
-                swap
-                putfield AbstractFunction.param_number I
-
-                ; And decrement the remaining_params, so we know when we're done.
-                aload_0
-                getfield AbstractFunction.remaining_params I
-                iconst_1
-                isub
-                aload_0
-                swap
-                putfield AbstractFunction.remaining_params I
-
-                ; Set the param_[param_num] variable to the argument passed.
-                aload_0
-                aload_1
-                putfield {name}Function.param_{param_num} Ljava/lang/Object;
-                return
-            .end method
-                
-            .method private apply_{param_num}(Ljava/lang/Object;)Ljava/lang/Object;
-            .limit stack 4
-            .limit locals 2
-                ; Create a new copy of this Function, and set the value passed on it.
-                new {name}Function
-                dup
-                invokespecial {name}Function.<init>()V
-            """.format(name=self.id.value, param_num=param_num)
-
-            # Fill in all of the previously set parameters from *this* Function instance.
-            for i in range(param_num):
-                return_str += """
-                dup
-                aload_0
-                getfield {name}Function.param_{i} Ljava/lang/Object;
-                invokevirtual {name}Function.set_{i}(Ljava/lang/Object;)V
-                """.format(name=self.id.value, i=i)
-
-            return_str += """
-            dup
-            aload_1
-            invokevirtual {name}Function.set_{param_num}(Ljava/lang/Object;)V
-            areturn
-            .end method
-            """.format(name=self.id.value, param_num=param_num)
-
-        return return_str
-
-    def _emit(self, scope):
+        # Saturated calls go straight to a static method taking every parameter, so its signature is fixed here,
+        # where later declarations can already see it.
         if self.params:
-            scope.add_identifier(self.id.value, """
-            new {name}Function
-            dup
-            invokespecial {name}Function.<init>()V
-            """.format(name=self.id.value), 2)
-
-            return_str = self._header()
-            return_str += self._tostring()
-            return_str += self._param_application()
-
-            # We need to have the parameters "in-scope", so we copy the global scope and add
-            # the code to get each of the parameters to it.
-            function_scope = deepcopy(scope)
-
-            for i, param in enumerate(self.params[:-1]):
-                function_scope.add_identifier_type(param.value, scope.get_identifier_type(self.id.value).progression[i])
-                function_scope.add_identifier(param.value, '''
-                aload_0
-                getfield {name}Function.param_{i} Ljava/lang/Object;
-                '''.format(name=self.id.value, i=i), 1)
-
-            function_scope.add_identifier_type(self.params[-1].value, scope.get_identifier_type(self.id.value).progression[-2])
-            function_scope.add_identifier(self.params[-1].value, 'aload_1', 1)
-
-            function_scope.get_reset_stack()
-            return_str += """
-            .method private apply_{param_num}(Ljava/lang/Object;)Ljava/lang/Object;
-            .limit locals 2
-            .limit stack {stacklimit}
-                {expr}
-                areturn
-            .end method
-            """.format(param_num=(len(self.params) - 1), expr=self.expr.emit(function_scope), stacklimit=function_scope.get_reset_stack() + 10)
-
-            # Top-level apply that dispatches the appropriate apply() based on state.
-            return_str += """
-            .method public apply(Ljava/lang/Object;)Ljava/lang/Object;
-                .limit locals 2
-                .limit stack 4
-                aload_0
-                getfield {name}Function.param_number I
-            """
-
-            # Loop through each possible param number and check if its right, then jump
-            # to the appropriate dispatch.
-            for param_num in range(len(self.params)):
-                return_str += """
-                dup
-                bipush {param_num}
-                if_icmpeq apply_{param_num}
-                """.format(param_num=param_num)
-
-            # Add all of the dispatches with labels.
-            for param_num in range(len(self.params)):
-                return_str += """
-                apply_{param_num}:
-                aload_0
-                aload_1
-                invokevirtual {name}Function.apply_{param_num}(Ljava/lang/Object;)Ljava/lang/Object;
-                areturn
-                """.format(name=self.id.value, param_num=param_num)
-
-            return_str += """
-            .end method
-            """
-
-            return return_str.format(name=self.id.value, param_count=len(self.params))
+            self._descriptor = '({}){}'.format(''.join(util.descriptor(typ, scope.unbox) for typ in param_types),
+                                               util.descriptor(types[self.expr], scope.unbox))
+            self._add_static(scope)
+
+    def _add_static(self, scope):
+        """Registers the static method holding the function's body: invoke() on its own class, or a method named
+        after it on the module class if functions don't have classes of their own."""
+        if scope.function_classes or scope.module_class is None:
+            owner, name = self.class_name, 'invoke'
         else:
-            expr_scope = deepcopy(scope)
-            expr = self.expr.emit(expr_scope)
+            owner, name = scope.module_class.name, self.id.value
+        scope.add_static_function(self.id.value, owner, name, self._descriptor, len(self.params))
 
-            scope.add_identifier('{}'.format(self.id.value), expr, expr_scope.get_reset_stack())
-            scope.add_identifier_type('{}'.format(self.id.value), self.expr.get_type(expr_scope))
-            return ''
+    @property
+    def class_name(self):
+        return '{}Function'.format(self.id.value)
 
-    def _emit_target(self):
-        if self.params:
-            return '{}Function.j'.format(self.id.value)
+    def _header(self):
+        """Defines the class and its constructor, which records the function's arity."""
+        classdef = ClassDef(self.class_name, 'AbstractFunction')
+
+        init = classdef.add_method(('public',), '<init>', '()V')
+        init.code.add('aload_0')
+        init.code.add_all(util.push_int(len(self.params)))
+        init.code.add('invokenonvirtual', 'AbstractFunction', '<init>', '(I)V')
+        init.code.add('return')
+
+        return classdef
+
+    @property
+    def _instance_descriptor(self):
+        return 'L{};'.format(self.class_name)
+
+    def _instance(self, classdef, scope):
+        """Defines the field holding the function's one instance, made when the class is initialized. It comes
+        before any other constant, so that it is already there if classes initializing each other refer back."""
+        classdef.add_field(('public', 'static', 'final'), 'INSTANCE', self._instance_descriptor)
+
+        code = Code()
+        code.add('new', self.class_name)
+        code.add('dup')
+        code.add('invokespecial', self.class_name, '<init>', '()V')
+        code.add('putstatic', self.class_name, 'INSTANCE', self._instance_descriptor)
+        scope.initialize(code)
+
+    def _tostring(self, classdef):
+        """Defines the function's toString() method. Bound parameters are added by PartialApplication."""
+        code = classdef.add_method(('public',), 'toString', '()Ljava/lang/String;').code
+        code.add('ldc', '{}Function with bound parameters: '.format(self.id.value))
+        code.add('areturn')
+
+    def _call_invoke(self, scope, code, load_arg):
+        """Calls the function's static method with every argument, where *load_arg(code, i)* pushes the boxed
+        i-th argument, and boxes the result."""
+        static = scope.get_static_function(self.id.value)
+        param_descriptors, return_descriptor = util.parse_descriptor(self._descriptor)
+        for i, param_descriptor in enumerate(param_descriptors):
+            load_arg(code, i)
+            code.add_all(util.unbox(util.descriptor_type(param_descriptor)))
+
+        code.add('invokestatic', static.owner, static.name, static.descriptor)
+        code.add_all(util.box(util.descriptor_type(return_descriptor)))
+        code.add('areturn')
+
+    def _entry_points(self, scope, classdef):
+        """Defines enter(), taking the arguments as an array, and, if there are few enough parameters, the apply()
+        taking exactly as many arguments as there are, which skips both the array and the arity check."""
+        enter = classdef.add_method(('public',), 'enter', runtime.ENTER_DESCRIPTOR)
+        self._call_invoke(scope, enter.code, _from_array)
+
+        if len(self.params) <= runtime.MAX_APPLY_ARGS:
+            apply = classdef.add_method(('public',), 'apply', runtime.apply_descriptor(len(self.params)))
+            self._call_invoke(scope, apply.code, _from_args)
+
+    def _invoke(self, scope, classdef):
+        """The body of the function, as a static method of *classdef* taking all of the parameters at once.
+        Parameters and the result are primitives where their types allow it."""
+        static = scope.get_static_function(self.id.value)
+        param_descriptors, return_descriptor = util.parse_descriptor(self._descriptor)
+        fun_type = scope.get_identifier_type(self.id.value)
+
+        # We need to have the parameters "in-scope", so we make a child of the global scope and add
+        # the code to get each of the parameters to it.
+        function_scope = scope.child()
+        local = 0
+        for param, param_type, param_descriptor in zip(self.params, fun_type.progression, param_descriptors):
+            primitive = util.descriptor_type(param_descriptor)
+            param_code = Code()
+            param_code.add_all(util.load(param_descriptor, local))
+
+            function_scope.add_identifier_type(param.value, param_type)
+            if primitive is None:
+                function_scope.add_identifier(param.value, param_code)
+            else:
+                boxed_code = Code()
+                boxed_code.add_all(util.load(param_descriptor, local))
+                boxed_code.add_all(util.box(primitive))
+                function_scope.add_identifier(param.value, boxed_code, param_code)
+
+            local += 2 if param_descriptor == 'D' else 1
+
+        function_scope.common = CommonSubexpressions(self.expr, local)
+        invoke = classdef.add_method(('public', 'static'), static.name, self._descriptor)
+
+        result = util.descriptor_type(return_descriptor)
+        if result is None:
+            self.expr.emit(function_scope, invoke.code)
         else:
-            return ''
+            self.expr.emit_unboxed(function_scope, invoke.code, result)
+        invoke.code.add_all(util.return_value(return_descriptor))
+
+    def _class(self, scope):
+        # Constants used in the function's body are kept in its own class, so that it can be cached on its own.
+        classdef = self._header()
+        class_scope = scope.child()
+        class_scope.start_class(classdef)
+        self._instance(classdef, class_scope)
+        self._tostring(classdef)
+        self._entry_points(class_scope, classdef)
+        self._invoke(class_scope, classdef)
+        class_scope.finish_class()
+        return classdef
+
+    def _dependencies(self, scope):
+        """Everything the function's class depends on besides the compiler: the declaration itself, its type, and
+        how each identifier used in its body, other than the parameters, is compiled."""
+        dependencies = [str(self), type_key(scope.get_identifier_type(self.id.value)), self._descriptor]
+        params = {param.value for param in self.params}
+        for identifier in sorted(_identifiers(self.expr) - params):
+            dependencies.append('{} = {}'.format(identifier, scope.binding(identifier)))
+        return dependencies
+
+    def _emit(self, scope, code):
+        if self.params and not scope.function_classes:
+            # The function's value is its instance of the module's function table.
+            table = table_name(scope.module_class.name)
+            instance = Code()
+            instance.add('getstatic', table, self.id.value, 'L{};'.format(table))
+            scope.add_identifier(self.id.value, instance)
+            scope.add_declaration(self.id.value, self)
+            self._add_static(scope)
+
+            self._invoke(scope, scope.module_class)
+        elif self.params:
+            # Function objects have no state, so one instance is shared.
+            instance = Code()
+            instance.add('getstatic', self.class_name, 'INSTANCE', self._instance_descriptor)
+            scope.add_identifier(self.id.value, instance)
+            scope.add_declaration(self.id.value, self)
+            self._add_static(scope)
+
+            scope.write_class(self.class_name, self._dependencies(scope), functools.partial(self._class, scope))
+        else:
+            expr_scope = scope.child()
+            expr_scope.common = CommonSubexpressions(self.expr, 0)
+            self._constant(expr_scope, scope.module_class)
+            scope.add_identifier_type('{}'.format(self.id.value), self.expr.get_type(expr_scope))
+
+    def _add_field(self, scope, classdef):
+        """Defines a static field on *classdef* to hold the value of this parameterless declaration, and binds the
+        declaration to a call of the static method returning it, which _constant() adds. The module does this
+        before emitting any declaration, so parameterless declarations can be used before they are declared."""
+        names = {field.name for field in classdef.fields}
+        name = self.id.value
+        count = 1
+        while name in names:
+            # Identifiers can't contain '$', so this can't clash with another declaration.
+            name = '{}${}'.format(self.id.value, count)
+            count += 1
+
+        classdef.add_field(('private', 'static'), name, 'Ljava/lang/Object;')
+        self._field = name
+
+        value = Code()
+        value.add('invokestatic', classdef.name, '{}$get'.format(name), '()Ljava/lang/Object;')
+        scope.add_identifier(self.id.value, value)
+        scope.add_declaration(self.id.value, self)
+
+    def _constant(self, scope, classdef):
+        """Defines the static method returning the value of this parameterless declaration, working it out the
+        first time it is needed. The method is synchronized, so threads can't both see the field empty and work
+        the value out twice, and the value written is seen by every thread that reads it later. Returns the method."""
+        name = self._field
+        accessor = classdef.add_method(('public', 'static', 'synchronized'), '{}$get'.format(name),
+                                       '()Ljava/lang/Object;')
+        code = accessor.code
+        done = scope.label
+
+        code.add('getstatic', classdef.name, name, 'Ljava/lang/Object;')
+        code.add('dup')
+        code.add('ifnonnull', done)
+        code.add('pop')
+        self.expr.emit(scope, code)
+        code.add('dup')
+        code.add('putstatic', classdef.name, name, 'Ljava/lang/Object;')
+        code.place(done)
+        code.add('areturn')
+
+        return accessor
 
 
 class DataTypeDeclaration(Declaration):
@@ -250,12 +358,57 @@ class DataTypeDeclaration(Declaration):
         'constrs': (GreaterOrEqual(1), Constr)
     }
 
-    def _emit(self, scope):
+    @property
+    def class_name(self):
+        return '{}Data'.format(self.id.value)
+
+    def _class(self):
+        """Defines the class of the data type's values. There is one instance for each constructor, made once in
+        the static initializer and kept in a static field named after it, so values can be compared by
+        reference. Each also has its constructor's name, which is what toString() gives, and its index as a tag."""
+        descriptor = 'L{};'.format(self.class_name)
+        classdef = ClassDef(self.class_name, access=('public', 'final'))
+        classdef.add_field(('public', 'final'), 'tag', 'I')
+        classdef.add_field(('private', 'final'), 'name', 'Ljava/lang/String;')
+
+        init = classdef.add_method(('private',), '<init>', '(ILjava/lang/String;)V')
+        init.code.add('aload_0')
+        init.code.add('invokenonvirtual', 'java/lang/Object', '<init>', '()V')
+        init.code.add('aload_0')
+        init.code.add('iload_1')
+        init.code.add('putfield', self.class_name, 'tag', 'I')
+        init.code.add('aload_0')
+        init.code.add('aload_2')
+        init.code.add('putfield', self.class_name, 'name', 'Ljava/lang/String;')
+        init.code.add('return')
+
+        clinit = classdef.add_method(('static',), '<clinit>', '()V')
+        for tag, constr in enumerate(self.constrs):
+            classdef.add_field(('public', 'static', 'final'), constr.id.value, descriptor)
+            clinit.code.add('new', self.class_name)
+            clinit.code.add('dup')
+            clinit.code.add_all(util.push_int(tag))
+            clinit.code.add('ldc', constr.id.value)
+            clinit.code.add('invokespecial', self.class_name, '<init>', '(ILjava/lang/String;)V')
+            clinit.code.add('putstatic', self.class_name, constr.id.value, descriptor)
+        clinit.code.add('return')
+
+        tostring = classdef.add_method(('public',), 'toString', '()Ljava/lang/String;')
+        tostring.code.add('aload_0')
+        tostring.code.add('getfield', self.class_name, 'name', 'Ljava/lang/String;')
+        tostring.code.add('areturn')
+
+        return classdef
+
+    def _emit(self, scope, code):
+        descriptor = 'L{};'.format(self.class_name)
         for constr in self.constrs:
-            scope.add_identifier(constr.id.value, 'ldc "{}"'.format(constr.id.value), 1)
+            constr_code = Code()
+            constr_code.add('getstatic', self.class_name, constr.id.value, descriptor)
+            scope.add_identifier(constr.id.value, constr_code)
             scope.set_definite_identifier_type(constr.id.value, Data(self.id.value))
 
-        return ''
+        scope.write_class(self.class_name, [str(self)], self._class)
 
 class TypeDeclaration(Declaration):
     required_children = {
@@ -263,6 +416,5 @@ class TypeDeclaration(Declaration):
         'type': (Exactly(1), Type)
     }
 
-    def _emit(self, scope):
+    def _emit(self, scope, code):
         scope.set_definite_identifier_type(self.id.value, self.type.to_funtype())
-        return ''
@@ -0,0 +1,131 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+from funcompiler.backend import JasminBackend, ClassFileBackend, JarBackend
+from funcompiler.cache import ClassCache
+from funcompiler.funast import Scope
+from funcompiler.parser import Parser, ParseError
+
+BACKENDS = {
+    'jasmin': JasminBackend,
+    'class': ClassFileBackend,
+    'jar': JarBackend
+}
+
+# The extension of source files found in directories given on the command line.
+SOURCE_EXTENSION = '.fun'
+
+
+def sources(paths):
+    """The source files named by *paths*, where a directory stands for every source file below it, in order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                subdirectories.sort()
+                for name in sorted(files):
+                    if name.endswith(SOURCE_EXTENSION):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def compile_file(path, options, executor=None):
+    """Compiles the module in the file at *path* into options.output. Other modules may declare classes of the
+    same names, such as fFunction, so unless it is a jar, which holds them itself, the module is written into a
+    directory of its own there, named after it. Returns a dict of what was done and how long it took, with an
+    'error' if the module couldn't be compiled."""
+    cache = ClassCache(options.cache) if options.cache else None
+    scope = Scope(backend=BACKENDS[options.format](options.output), unbox=not options.no_unbox,
+                  fold=not options.no_fold, cache=cache, executor=executor,
+                  function_classes=not options.function_methods)
+    parser = Parser(scope)
+    result = {'path': path}
+
+    try:
+        module = parser.parse_file(path)
+        if options.format != 'jar':
+            scope.backend.directory = os.path.join(options.output, module.id.value)
+            os.makedirs(scope.backend.directory, exist_ok=True)
+        result.update(module=module.id.value, tokens=parser.tokens, bytes=parser.bytes, parse=parser.seconds,
+                      declare=parser.declare_seconds)
+
+        start = time.perf_counter()
+        module.emit(scope)
+        result['emit'] = time.perf_counter() - start
+    except (OSError, ParseError, AssertionError) as error:
+        result['error'] = str(error) or type(error).__name__
+    except Exception as error:
+        # A fault in the compiler itself, which still only fails this module.
+        result['error'] = 'internal error: {}: {}'.format(type(error).__name__, error)
+
+    if cache is not None:
+        result.update(hits=cache.hits, misses=cache.misses)
+    return result
+
+
+def _report(result, out):
+    if 'error' in result:
+        print('{}: error: {}'.format(result['path'], result['error']), file=out)
+        return
+
+    line = '{path}: {module} parsed in {parse_ms:.1f} ms ({tokens} tokens, {rate:.2f} MB/s), ' \
+           'declarations made in {declare_ms:.1f} ms, compiled in {emit_ms:.1f} ms'
+    line = line.format(parse_ms=result['parse'] * 1000, declare_ms=result['declare'] * 1000,
+                       emit_ms=result['emit'] * 1000,
+                       rate=result['bytes'] / result['parse'] / 1e6 if result['parse'] else 0.0, **result)
+    if 'hits' in result:
+        line += ', {hits} cached, {misses} generated'.format(**result)
+    print(line, file=out)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(prog='funcompiler', description='Compiles modules to classes for the JVM.')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='a source file, or a directory of {} files'.format(SOURCE_EXTENSION))
+    parser.add_argument('-o', '--output', default='.',
+                        help="the directory to write each module's jar, or a directory of its classes, to")
+    parser.add_argument('-f', '--format', choices=sorted(BACKENDS), default='jasmin',
+                        help='what to write: Jasmin source, class files, or a jar for each module')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='the number of worker processes; a single file has its declarations spread over them')
+    parser.add_argument('--cache', metavar='DIRECTORY', help='reuse classes generated before, kept in DIRECTORY')
+    parser.add_argument('--function-methods', action='store_true',
+                        help='compile functions to static methods of the module class, not a class each')
+    parser.add_argument('--no-fold', action='store_true', help="don't work out constant expressions")
+    parser.add_argument('--no-unbox', action='store_true', help='keep every value as an object')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report errors')
+    return parser
+
+
+def main(argv=None, out=None):
+    """Compiles every module named on the command line in this one process, or across options.jobs worker
+    processes, and reports the time each took. Returns the exit status."""
+    options = argument_parser().parse_args(argv)
+    out = out if out is not None else sys.stdout
+    paths = list(sources(options.inputs))
+    os.makedirs(options.output, exist_ok=True)
+
+    start = time.perf_counter()
+    if options.jobs <= 1:
+        results = [compile_file(path, options) for path in paths]
+    elif len(paths) == 1:
+        with concurrent.futures.ProcessPoolExecutor(options.jobs) as executor:
+            results = [compile_file(paths[0], options, executor)]
+    else:
+        # Each worker keeps its warm state, such as the serialized runtime, from one module to the next.
+        with concurrent.futures.ProcessPoolExecutor(options.jobs) as executor:
+            results = list(executor.map(compile_file, paths, [options] * len(paths)))
+    seconds = time.perf_counter() - start
+
+    failed = 0
+    for result in results:
+        failed += 'error' in result
+        if not options.quiet or 'error' in result:
+            _report(result, out)
+
+    if not options.quiet:
+        print('{} of {} modules compiled in {:.2f} s'.format(len(results) - failed, len(results), seconds), file=out)
+    return 1 if failed else 0
@@ -0,0 +1,317 @@
+import decimal
+import math
+
+from funcompiler import funtype
+from funcompiler.expression import (
+    Identifier, Int, Double, Char, Bool, Constr, Operator, UnaryOperator, BinaryOperator, Grouping,
+    Lists, FunctionApplication, TypeSpecification
+)
+from funcompiler.declaration import FunctionDeclaration, DataTypeDeclaration
+from funcompiler.fold import constant_type, value
+from funcompiler.funtype import Function
+
+
+class EvaluationError(Exception):
+    """Raised where the compiled module would throw, with the message of the JVM's exception."""
+
+
+def _int_div(a, b):
+    if b == 0:
+        raise EvaluationError('java.lang.ArithmeticException: / by zero')
+    return Operator.constant_operators['/'][funtype.Int](a, b)
+
+
+def _double_div(a, b):
+    # Unlike a constant folded at compile time, the result may be infinite or NaN, as on the JVM.
+    if b != 0:
+        return a / b
+    if a == 0 or math.isnan(a):
+        return math.nan
+    return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def _chr_double(a):
+    # d2i makes NaN 0, and clamps anything else to the range of an int.
+    return chr((0 if math.isnan(a) else int(max(-2 ** 31, min(2 ** 31 - 1, a)))) & 0xFFFF)
+
+
+# The operators, as Python functions of the operands for each operand type. They are those used for constant
+# folding, besides those giving a result where folding would leave it to run time. Data values are compared by
+# identity, as the bytecode does.
+OPERATORS = {
+    symbol: dict(functions) for symbol, functions in Operator.constant_operators.items()
+}
+OPERATORS['/'] = {funtype.Int: _int_div, funtype.Double: _double_div}
+OPERATORS['chr'][funtype.Double] = _chr_double
+OPERATORS['=='][funtype.Data] = lambda a, b: a is b
+
+
+# The Python type of the values of each primitive type, and the class they are boxed in on the JVM.
+_primitives = {
+    funtype.Int: (int, 'java.lang.Integer'),
+    funtype.Double: (float, 'java.lang.Double'),
+    funtype.Char: (str, 'java.lang.Character'),
+    funtype.Bool: (bool, 'java.lang.Boolean')
+}
+_boxes = dict(_primitives.values())
+
+
+def java_double(number):
+    """*number* written as Java's Double.toString() writes it, with the fewest digits that give it back."""
+    if math.isnan(number):
+        return 'NaN'
+    elif math.isinf(number):
+        return 'Infinity' if number > 0 else '-Infinity'
+    elif number == 0:
+        return '-0.0' if math.copysign(1.0, number) < 0 else '0.0'
+
+    sign, digits, exponent = decimal.Decimal(repr(number)).normalize().as_tuple()
+    digits = ''.join(map(str, digits))
+    # The number is 0.digits times 10 to the power of point.
+    point = len(digits) + exponent
+    if 1e-3 <= abs(number) < 1e7:
+        if point <= 0:
+            text = '0.' + '0' * -point + digits
+        elif point >= len(digits):
+            text = digits + '0' * (point - len(digits)) + '.0'
+        else:
+            text = digits[:point] + '.' + digits[point:]
+    else:
+        text = '{}.{}E{}'.format(digits[0], digits[1:] or '0', point - 1)
+    return '-' + text if sign else text
+
+
+class DataValue:
+    """The value of a data constructor. There is one for each constructor, so values compare by identity."""
+
+    __slots__ = ('name', 'tag')
+
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '<{}>'.format(self.name)
+
+
+class FunctionValue:
+    """A function, with the arguments bound to it so far. It is entered once it has as many as it takes, and
+    shown as the generated classes show it: the function's description, then each bound argument."""
+
+    __slots__ = ('name', 'arity', 'enter', 'bound')
+
+    def __init__(self, name, arity, enter, bound=()):
+        self.name = name
+        self.arity = arity
+        self.enter = enter
+        self.bound = bound
+
+    def apply(self, args):
+        """Applies the function to *args*, however many it takes, as AbstractFunction.apply() does."""
+        args = self.bound + tuple(args)
+        if len(args) < self.arity:
+            return FunctionValue(self.name, self.arity, self.enter, args)
+
+        result = self.enter(args[:self.arity])
+        if len(args) > self.arity:
+            return apply(result, args[self.arity:])
+        return result
+
+    def __str__(self):
+        return '{}Function with bound parameters: {}'.format(
+                self.name, ''.join('({}) '.format(to_string(arg)) for arg in self.bound))
+
+
+def apply(function, args):
+    if not isinstance(function, FunctionValue):
+        raise EvaluationError('java.lang.ClassCastException: {} is not a function'.format(to_string(function)))
+    return function.apply(args)
+
+
+def to_string(result):
+    """The text that printing *result* on the JVM gives."""
+    if isinstance(result, bool):
+        return 'true' if result else 'false'
+    elif isinstance(result, float):
+        return java_double(result)
+    elif isinstance(result, tuple):
+        return '[{}]'.format(', '.join(to_string(item) for item in result))
+    return str(result)
+
+
+class Evaluator:
+    """Works out the values of a module's expressions in Python, with the same results as the compiled module:
+    functions curry as their classes do, and operators behave as their bytecode does. Lists are tuples, data
+    values are DataValues and functions are FunctionValues; other values are Python's own.
+
+    Each expression is first compiled into a closure taking the values of the parameters in scope, by looking up
+    its kind of node in a table. A function's body is compiled once, when the function is first used, so calling
+    it again only runs closures. Parameterless declarations are worked out once, when first used, as the module
+    class does."""
+
+    def __init__(self, module, scope):
+        self.module = module
+        self.scope = scope
+        self._declarations = {}
+        self._values = {}
+        for decl in module.decls:
+            if isinstance(decl, FunctionDeclaration):
+                self._declarations[decl.id.value] = decl
+            elif isinstance(decl, DataTypeDeclaration):
+                for tag, constr in enumerate(decl.constrs):
+                    self._values[constr.id.value] = DataValue(constr.id.value, tag)
+
+    def evaluate(self, expr=None):
+        """The value of *expr*, by default the module's own expression, folded and typed as the module is."""
+        if expr is None:
+            expr = self.module.expr
+            if self.scope.folder is not None:
+                expr = self.scope.folder.fold(expr, self.scope)
+            Function.infer_types([], expr, self.scope, lenient=True)
+
+        try:
+            return self.compile(expr, {})(())
+        except RecursionError:
+            raise EvaluationError('java.lang.StackOverflowError') from None
+
+    def output(self):
+        """What running the compiled module prints, without the line break."""
+        return to_string(self.evaluate())
+
+    def compile(self, expr, params):
+        """A function of the values of the parameters, given in the order of *params*, a dict of the index of
+        each, returning the value of *expr*."""
+        return self._compilers[type(expr)](self, expr, params)
+
+    def _terminal(self, expr, params):
+        constant = value(expr)
+        return lambda env: constant
+
+    def _identifier(self, expr, params):
+        name = expr.value
+        if name in params:
+            index = params[name]
+            return lambda env: env[index]
+        return lambda env: self._global(name)
+
+    def _global(self, name):
+        if name in self._values:
+            return self._values[name]
+
+        decl = self._declarations.get(name)
+        if decl is None:
+            raise EvaluationError('Unknown identifier {!r}'.format(name))
+        if decl.params:
+            result = self._function(decl)
+        else:
+            # As with the static field holding it, a value that failed is worked out again the next time.
+            result = self.compile(decl.expr, {})(())
+        self._values[name] = result
+        return result
+
+    def _function(self, decl):
+        """The FunctionValue of *decl*, whose body is compiled the first time it is entered. Arguments of a
+        primitive type are checked on the way in, as they are unboxed by the compiled function."""
+        name = decl.id.value
+        checks = []
+        for i, typ in enumerate(self.scope.get_identifier_type(name).progression[:len(decl.params)]):
+            if type(typ) in _primitives:
+                checks.append((i, *_primitives[type(typ)]))
+        body = None
+
+        def enter(args):
+            nonlocal body
+            for i, python_type, box in checks:
+                if type(args[i]) is not python_type:
+                    raise EvaluationError('java.lang.ClassCastException: {} cannot be cast to {}'.format(
+                            _boxes.get(type(args[i]), type(args[i]).__name__), box))
+            if body is None:
+                body = self.compile(decl.expr, {param.value: i for i, param in enumerate(decl.params)})
+            return body(args)
+
+        return FunctionValue(name, len(decl.params), enter)
+
+    def _constr(self, expr, params):
+        return self._identifier(expr.id, params)
+
+    def _inner(self, expr, params):
+        return self.compile(expr.expr, params)
+
+    def _operator(self, op, operands, params):
+        """Compiles *op* applied to *operands*, picking its Python function by the operands' type."""
+        compiled = [self.compile(operand, params) for operand in operands]
+        functions = OPERATORS[op.value]
+        try:
+            typ = operands[0].get_type(self.scope)
+        except (KeyError, AssertionError, NotImplementedError):
+            typ = None
+        fn = functions.get(type(typ))
+
+        if fn is None:
+            # Left to the type of the operands' values, where inference couldn't tell.
+            def fn(*values):
+                result = values[0]
+                kind = funtype.Data if isinstance(result, DataValue) else constant_type(result)
+                if kind not in functions:
+                    raise EvaluationError('No operator {} for {}'.format(op.value, to_string(result)))
+                return functions[kind](*values)
+
+        if len(compiled) == 1:
+            operand, = compiled
+            return lambda env: fn(operand(env))
+        left, right = compiled
+        return lambda env: fn(left(env), right(env))
+
+    def _unary(self, expr, params):
+        return self._operator(expr.op, (expr.expr,), params)
+
+    def _binary(self, expr, params):
+        return self._operator(expr.op, (expr.expr1, expr.expr2), params)
+
+    def _list(self, expr, params):
+        items = [self.compile(item, params) for item in expr.exprs]
+        return lambda env: tuple(item(env) for item in items)
+
+    def _application(self, expr, params):
+        func, args = expr._spine()
+        args = [self.compile(arg, params) for arg in args]
+
+        decl = None
+        if isinstance(func, Identifier) and func.value not in params:
+            decl = self._declarations.get(func.value)
+        if decl is not None and decl.params and len(args) >= len(decl.params):
+            # A saturated call to a declared function enters it directly, as the static call does.
+            name, arity = func.value, len(decl.params)
+            now, rest = args[:arity], args[arity:]
+
+            def call(env):
+                result = self._global(name).enter(tuple(arg(env) for arg in now))
+                return apply(result, [arg(env) for arg in rest]) if rest else result
+            return call
+
+        function = self.compile(func, params)
+        return lambda env: apply(function(env), [arg(env) for arg in args])
+
+    # How to compile each kind of node.
+    _compilers = {
+        Int: _terminal,
+        Double: _terminal,
+        Char: _terminal,
+        Bool: _terminal,
+        Identifier: _identifier,
+        Constr: _constr,
+        Grouping: _inner,
+        TypeSpecification: _inner,
+        UnaryOperator: _unary,
+        BinaryOperator: _binary,
+        Lists: _list,
+        FunctionApplication: _application
+    }
+
+
+def evaluate(module, scope):
+    """The value of *module*, built in *scope*, worked out without compiling it."""
+    return Evaluator(module, scope).evaluate()
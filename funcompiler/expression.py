@@ -1,21 +1,119 @@
+import math
+import operator
 import string
 
-from funcompiler.funast import ASTNode
+from funcompiler.funast import ASTNode, CompileError
 from funcompiler.childcount import Exactly, GreaterOrEqual
 from funcompiler import funtype
+from funcompiler import runtime
 from funcompiler import util
 
+def _int32(value):
+    """Wraps *value* around to a 32-bit int, as the JVM's int arithmetic does."""
+    return (value + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+def _int_div(a, b):
+    if b == 0:
+        return None
+    quotient = abs(a) // abs(b)
+    return _int32(quotient if (a < 0) == (b < 0) else -quotient)
+
+def _double_div(a, b):
+    return a / b if b != 0 else None
+
+def _d2i(value):
+    return max(-2 ** 31, min(2 ** 31 - 1, int(value)))
+
 class Expr(ASTNode):
+    # Overridden by nodes that can compute their value as a primitive, without boxing it.
+    _emit_unboxed = None
+    # Overridden by boolean nodes that can jump on their value without pushing it.
+    _emit_branch = None
+
     def get_type(self, scope):
+        """The type of this expression. Inference fills in scope.types for every node it sees, so this is normally
+        a lookup; other nodes have it worked out by _get_type() once, and then remembered."""
+        typ = scope.types.get(self)
+        if typ is None:
+            typ = self._get_type(scope)
+            scope.types[self] = typ
+        return typ
+
+    def _get_type(self, scope):
         raise NotImplementedError
 
-    def infer_types(self, types, scope):
-        """Modify the *types* dictionary to narrow down the possible types of parameters.
-        This default implementation can gain no additional information, so just returns what was given."""
-        return types
+    def emit(self, scope, code):
+        """Appends the instructions for this expression to *code*. Subexpressions that scope.common has seen
+        before in the same method are loaded from the local they were saved in the first time."""
+        common = scope.common
+        if common is None or not common.is_common(self):
+            return super().emit(scope, code)
+
+        if not common.load(self, code, None):
+            self._emit(scope, code)
+            common.store(self, code, None)
+        return code
+
+    def emit_unboxed(self, scope, code, typ=None):
+        """Appends instructions leaving the value of this expression on the stack as a primitive of type *typ*
+        (by default its own type). Nodes without an _emit_unboxed() are emitted boxed and then unboxed."""
+        common = scope.common
+        if common is None or not common.is_common(self):
+            self._emit_primitive(scope, code, typ)
+            return
+
+        if typ is None:
+            typ = self.get_type(scope)
+        if not common.load(self, code, typ):
+            self._emit_primitive(scope, code, typ)
+            common.store(self, code, typ)
+
+    def _emit_primitive(self, scope, code, typ):
+        if self._emit_unboxed is not None:
+            own_type = self.get_type(scope)
+            if typ is None or type(own_type) is type(typ):
+                self._emit_unboxed(scope, code)
+                return
+
+        if typ is None:
+            typ = self.get_type(scope)
+
+        self._emit(scope, code)
+        code.add_all(util.unbox(typ))
+
+    def emit_branch(self, scope, code, label, when=True):
+        """Appends instructions that jump to *label* if the value of this Bool expression is *when*, and carry on
+        otherwise. Nodes without an _emit_branch() push their value and test it."""
+        common = scope.common
+        if self._emit_branch is not None and (common is None or not common.is_common(self)):
+            self._emit_branch(scope, code, label, when)
+        else:
+            self.emit_unboxed(scope, code, funtype.Bool())
+            code.add('ifne' if when else 'ifeq', label)
+
+    def _emit_boolean(self, scope, code):
+        """Pushes 1 or 0 for the value of this Bool expression, by branching on it."""
+        false_label, done = scope.label, scope.label
+        self._emit_branch(scope, code, false_label, False)
+        code.add('iconst_1')
+        code.add('goto', done)
+        code.place(false_label)
+        code.add('iconst_0')
+        code.place(done)
+
+    def is_constant(self, scope):
+        """Whether this expression always has the same value, and working it out can neither fail nor have any
+        effect, so it can be done once for the whole module. Such values are kept in static fields."""
+        return False
+
+    def infer(self, inference, scope):
+        """Adds the constraints on the type of this expression to *inference*, and returns its type variable.
+        This default implementation knows nothing about the type."""
+        return inference.record(self, inference.variable())
 
     def __eq__(self, other):
-        return self.__class__ == other.__class__ and set(self._children.values()) == set(other._children.values())
+        """Structural equality: the same kind of node, with equal children in the same order."""
+        return self.__class__ is other.__class__ and tuple(self._children.values()) == tuple(other._children.values())
 
     def __hash__(self):
         return hash((self.__class__, *self._children.values()))
@@ -32,18 +130,33 @@ class Terminal(Expr):
     def value(self):
         return self._value
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         raise NotImplementedError
 
-    def infer_types(self, types, scope):
-        types[self] = self.get_type(scope)
-        return types
+    def _emit(self, scope, code):
+        # The boxed object is made once, when the module is loaded.
+        code.extend(scope.constant(self._box))
+
+    def _box(self, scope, code):
+        self._emit_unboxed(scope, code)
+        code.add_all(util.box(self._get_type(scope)))
+
+    def is_constant(self, scope):
+        return True
+
+    def infer(self, inference, scope):
+        return inference.record(self, inference.instantiate(self._get_type(scope)))
+
+    @property
+    def key(self):
+        """What tells this constant apart from others of the same kind."""
+        return self.value
 
     def __eq__(self, other):
-        return self.value == other.value
+        return self.__class__ is other.__class__ and self.key == other.key
 
     def __hash__(self):
-        return hash(self.value)
+        return hash((self.__class__, self.key))
 
 class Identifier(Expr):
     _children = {}
@@ -55,20 +168,42 @@ class Identifier(Expr):
 
         self._value = value
 
-    def _emit(self, scope):
-        return scope.get_allocate_identifier(self.value)
+    def _emit(self, scope, code):
+        code.extend(scope.get_identifier(self.value))
+
+    def infer(self, inference, scope):
+        if self.value in inference.env:
+            return inference.record(self, inference.env[self.value])
+
+        try:
+            typ = scope.get_identifier_type(self.value)
+        except KeyError:
+            return super().infer(inference, scope)
+        return inference.record(self, inference.instantiate(typ))
+
+    def is_constant(self, scope):
+        # Functions are constants, but parameterless declarations are worked out when first used, as they may fail.
+        declaration = scope.get_declaration(self.value)
+        return declaration is not None and len(declaration.params) > 0
+
+    def _emit_primitive(self, scope, code, typ):
+        unboxed = scope.get_unboxed_identifier(self.value)
+        if unboxed is not None and (typ is None or type(self.get_type(scope)) is type(typ)):
+            code.extend(unboxed)
+        else:
+            super()._emit_primitive(scope, code, typ)
 
     def __eq__(self, other):
-        return self.value == other.value
+        return self.__class__ is other.__class__ and self.value == other.value
 
     def __hash__(self):
-        return hash(self.value)
+        return hash((self.__class__, self.value))
 
     @property
     def value(self):
         return self._value
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         return scope.get_identifier_type(self.value)
 
 class Type(ASTNode):
@@ -91,7 +226,7 @@ class NamedType(Type):
     }
 
     def to_funtype(self):
-        return self.named_types[self.id.value]
+        return self.named_types[self.id.value]()
 
     @property
     def value(self):
@@ -102,6 +237,9 @@ class ListType(Type):
         'type': (Exactly(1), Type)
     }
 
+    def to_funtype(self):
+        return funtype.List(self.type.to_funtype())
+
 class FunctionType(Type):
     required_children = {
         'param_type': (Exactly(1), Type),
@@ -109,88 +247,104 @@ class FunctionType(Type):
     }
 
     def to_funtype(self):
-        return funtype.Function([self.param_type.to_funtype()], [self.return_type.to_funtype()])
+        return funtype.Function([self.param_type.to_funtype()], self.return_type.to_funtype())
 
 class Operator(ASTNode):
     _children = {}
 
-    # Mapping from operators to (integer, double) bytecode versions
+    # The boolean operators, as (comparison, branch if true, branch if false) for each operand type. The
+    # comparison takes the operands, as primitives where the type has one, and leaves what the branch tests.
     boolean_operators = {
             '<': {
-                    funtype.Int: '''
-                    invokevirtual java/lang/Integer.compareTo(Ljava/lang/Integer;)I
-                    iflt true_return
-                    goto false_return''',
-                    funtype.Double: '''
-                    invokevirtual java/lang/Double.compareTo(Ljava/lang/Double;)I
-                    iflt true_return
-                    goto false_return
-                    '''
-                },
+                funtype.Int: ((), 'if_icmplt', 'if_icmpge'),
+                funtype.Double: ((('dcmpg',),), 'iflt', 'ifge')
+            },
             '<=': {
-                   funtype.Int: '''
-                   invokevirtual java/lang/Integer.compareTo(Ljava/lang/Integer;)I
-                   ifle true_return
-                   goto false_return
-                   ''',
-                   funtype.Double: '''
-                   invokevirtual java/lang/Double.compareTo(Ljava/lang/Double;)I
-                   ifle true_return
-                   goto false_return
-                   '''
-                   },
-            '==': {funtype.Int: '''
-                   invokevirtual java/lang/Integer.compareTo(Ljava/lang/Integer;)I
-                   ifeq true_return
-                   goto false_return
-                   ''',
-                   funtype.Double: '''
-                   invokevirtual java/lang/Double.compareTo(Ljava/lang/Double;)I
-                   ifeq true_return
-                   goto false_return
-                   ''',
-                   funtype.Data: '''
-                   invokevirtual java/lang/Object.equals(Ljava/lang/Object;)Z
-                   ifeq false_return
-                   goto true_return
-                   '''
-                   },
-            'not': {funtype.Bool: '''
-                   invokevirtual java/lang/Boolean.booleanValue()Z
-                   ifeq true_return
-                   goto false_return
-                   '''
-                   }
+                funtype.Int: ((), 'if_icmple', 'if_icmpgt'),
+                funtype.Double: ((('dcmpg',),), 'ifle', 'ifgt')
+            },
+            '==': {
+                funtype.Int: ((), 'if_icmpeq', 'if_icmpne'),
+                funtype.Double: ((('dcmpl',),), 'ifeq', 'ifne'),
+                funtype.Data: ((), 'if_acmpeq', 'if_acmpne')
+            },
+            'not': {
+                funtype.Bool: ((), 'ifeq', 'ifne')
+            }
     }
 
+    # Mapping from the numeric operators to their bytecode, for each operand type.
     numeric_operators = {
             '+': {
-                funtype.Int: 'iadd',
-                funtype.Double: 'dadd'
+                funtype.Int: (('iadd',),),
+                funtype.Double: (('dadd',),)
             },
             '*': {
-                funtype.Int: 'imul', 
-                funtype.Double: 'dmul'
+                funtype.Int: (('imul',),),
+                funtype.Double: (('dmul',),)
             },
             '-': {
-                funtype.Int: 'isub',
-                funtype.Double: 'dsub'
+                funtype.Int: (('isub',),),
+                funtype.Double: (('dsub',),)
             },
             '/': {
-                funtype.Int: 'idiv',
-                funtype.Double: 'ddiv'
+                funtype.Int: (('idiv',),),
+                funtype.Double: (('ddiv',),)
             },
             'chr': {
-                funtype.Int: 'i2c' + util.char_to_Character(),
-                funtype.Double: 'd2i\ni2c' + util.char_to_Character()
+                funtype.Int: (('i2c',),),
+                funtype.Double: (('d2i',), ('i2c',))
             },
             'ord': {
-                funtype.Char: util.int_to_integer()
+                funtype.Char: ()
             }
     }
 
     operators = {**boolean_operators, **numeric_operators}
 
+    # Python versions of the operators, for working out constant expressions at compile time. Each gives the same
+    # result as the bytecode above, or None where the result is only known at run time.
+    constant_operators = {
+            '<': {
+                funtype.Int: operator.lt,
+                funtype.Double: operator.lt
+            },
+            '<=': {
+                funtype.Int: operator.le,
+                funtype.Double: operator.le
+            },
+            '==': {
+                funtype.Int: operator.eq,
+                funtype.Double: operator.eq
+            },
+            'not': {
+                funtype.Bool: operator.not_
+            },
+            '+': {
+                funtype.Int: lambda a, b: _int32(a + b),
+                funtype.Double: operator.add
+            },
+            '*': {
+                funtype.Int: lambda a, b: _int32(a * b),
+                funtype.Double: operator.mul
+            },
+            '-': {
+                funtype.Int: lambda a, b: _int32(a - b),
+                funtype.Double: operator.sub
+            },
+            '/': {
+                funtype.Int: _int_div,
+                funtype.Double: _double_div
+            },
+            'chr': {
+                funtype.Int: lambda a: chr(a & 0xFFFF),
+                funtype.Double: lambda a: chr(_d2i(a) & 0xFFFF)
+            },
+            'ord': {
+                funtype.Char: ord
+            }
+    }
+
     def __init__(self, value):
         if value in self.operators:
             self._value = value
@@ -201,112 +355,125 @@ class Operator(ASTNode):
     def value(self):
         return self._value
 
+    @property
+    def is_boolean(self):
+        return self.value in self.boolean_operators
+
     def __eq__(self, other):
-        return self.value == other.value
+        return self.__class__ is other.__class__ and self.value == other.value
 
     def __hash__(self):
         return hash(self.value)
 
     def get_type(self, expr1_type):
-        if self.value in self.numeric_operators:
-            return expr1_type
-        elif self.value in self.boolean_operators:
-            return funtype.Bool()
-        elif self.value == 'ord':
+        if self.value == 'ord':
             return funtype.Int()
         elif self.value == 'chr':
+            return funtype.Char()
+        elif self.value in self.numeric_operators:
+            return expr1_type
+        elif self.value in self.boolean_operators:
             return funtype.Bool()
         else:
             raise AssertionError
 
+    def fold(self, operand_type, *values):
+        """Applies this operator to constant operands of type *operand_type*, returning the result as a Python
+        value, or None if it can't be worked out at compile time."""
+        fn = self.constant_operators[self.value].get(operand_type)
+        if fn is None:
+            return None
+
+        result = fn(*values)
+        if isinstance(result, float) and not math.isfinite(result):
+            return None
+        return result
+
+    def _case(self, table, typ):
+        """This operator's entry in *table* for operands of type *typ*."""
+        try:
+            return table[self.value][type(typ)]
+        except KeyError:
+            raise CompileError('No operator {} for {}'.format(self.value, typ)) from None
+
     def make_fn(self, value):
         if value in self.operators:
             return value
         else:
             raise AssertionError
 
-    def infer_unary(self, expr, types, scope):
-        self_mapping = {
-            'ord': funtype.Int(),
-            'chr': funtype.Char(),
-            'not': funtype.Bool()
-        }
-
-        expr_mapping = {
-            'ord': funtype.Char(),
-            'chr': funtype.Int(),
-            'not': funtype.Bool()
-        }
-       
-        types[self] = self_mapping[self.value]
-        types[expr] = expr_mapping[self.value]
-        expr.infer_types(types, scope)
-
-    def infer_binary(self, expr1, expr2, types, scope):
-        expr1.infer_types(types, scope)
-        expr2.infer_types(types, scope)
-
-        if self.value in ('<', '<=', '=='):
-            types[self] = funtype.Bool()
-        else:
-            types[self] = types[expr1]
-            types[self] = types[expr2]
-
-        types[expr1] = types[expr2]
-        types[expr2] = types[expr1]
-
-        types[expr1] = funtype.Double()
-        types[expr2] = funtype.Double()
-            
-        return types
-
-    def emit(self, expr_type, binary, scope):
-        op = self.operators[self.value][type(expr_type)]
-
-        if self.value in self.numeric_operators:
-            if binary:
-                if isinstance(expr_type, funtype.Int):
-                    return """
-                    {toint}
-                    swap
-                    {toint}
-                    swap
-                    {op}
-                    {tointeger}
-                    """.format(toint=util.integer_to_int(), op=op, tointeger=util.int_to_integer())
-                else:
-                    scope.allocate_stack(2)
-                    return """
-                    {todouble}
-                    dup2_x1
-                    pop2
-                    {todouble}
-                    dup2_x2
-                    pop2
-                    {op}
-                    {toDouble}
-                    """.format(todouble=util.Double_to_double(), op=op, toDouble=util.double_to_Double())
+    def infer_unary(self, expr, inference, scope):
+        """Constrains the operand of a unary operator, and returns the type variable of the result."""
+        operand, result = {
+            'ord': (funtype.Char, funtype.Int),
+            'chr': (funtype.Int, funtype.Char),
+            'not': (funtype.Bool, funtype.Bool)
+        }[self.value]
+
+        inference.equate(expr.infer(inference, scope), inference.instantiate(operand()))
+        return inference.instantiate(result())
+
+    def infer_binary(self, expr1, expr2, inference, scope):
+        # Both operands have the same type, which is taken to be Double if nothing else decides it.
+        operand = inference.variable(default=funtype.Double)
+        inference.equate(operand, expr1.infer(inference, scope))
+        inference.equate(operand, expr2.infer(inference, scope))
+
+        if self.value in self.boolean_operators:
+            return inference.instantiate(funtype.Bool())
+        return operand
+
+    def emit(self, expr_type, binary, scope, code):
+        """Appends this numeric operator applied to boxed operands, leaving a boxed result."""
+        op = self._case(self.numeric_operators, expr_type)
+
+        if binary:
+            if isinstance(expr_type, funtype.Int):
+                code.add_all(util.integer_to_int())
+                code.add('swap')
+                code.add_all(util.integer_to_int())
+                code.add('swap')
+                code.add_all(op)
+                code.add_all(util.int_to_integer())
             else:
-                conversion = {
-                    funtype.Char: util.Character_to_char(),
-                    funtype.Int: util.integer_to_int(),
-                    funtype.Double: util.Double_to_double()
-                }
-                return conversion[type(expr_type)] + op
+                code.add_all(util.Double_to_double())
+                code.add('dup2_x1')
+                code.add('pop2')
+                code.add_all(util.Double_to_double())
+                code.add('dup2_x2')
+                code.add('pop2')
+                code.add_all(op)
+                code.add_all(util.double_to_Double())
         else:
-            return """
-            {comparison}
-            true_return:
-            iconst_1
-            goto done
-            
-            false_return:
-            iconst_0
-            goto done
-
-            done:
-            invokestatic java/lang/Boolean.valueOf(Z)Ljava/lang/Boolean;
-            """.format(comparison=op)
+            conversion = {
+                funtype.Char: util.Character_to_char(),
+                funtype.Int: util.integer_to_int(),
+                funtype.Double: util.Double_to_double()
+            }
+            code.add_all(conversion[type(expr_type)])
+            code.add_all(op)
+            code.add_all(util.box(self.get_type(expr_type)))
+
+    def emit_unboxed(self, exprs, scope, code):
+        """Appends this numeric operator applied to *exprs*, leaving a primitive result. The operands are unboxed
+        as well, so nested arithmetic stays on primitives."""
+        expr_type = exprs[0].get_type(scope)
+        for expr in exprs:
+            expr.emit_unboxed(scope, code, expr_type)
+        code.add_all(self._case(self.numeric_operators, expr_type))
+
+    def emit_branch(self, exprs, scope, code, label, when):
+        """Appends this boolean operator applied to *exprs*, jumping to *label* if the result is *when*."""
+        expr_type = exprs[0].get_type(scope)
+        comparison, if_true, if_false = self._case(self.boolean_operators, expr_type)
+
+        for expr in exprs:
+            if util.is_primitive(expr_type):
+                expr.emit_unboxed(scope, code, expr_type)
+            else:
+                expr.emit(scope, code)
+        code.add_all(comparison)
+        code.add(if_true if when else if_false, label)
 
 class UnaryOperator(Expr):
     required_children = {
@@ -314,19 +481,28 @@ class UnaryOperator(Expr):
         'expr': (Exactly(1), Expr)
     }
 
-    def infer_types(self, types, scope):
-        self.op.infer_unary(self.expr, types)
-        types[self] = types[self.op]
+    def infer(self, inference, scope):
+        return inference.record(self, self.op.infer_unary(self.expr, inference, scope))
+
+    def _emit(self, scope, code):
+        if scope.unbox or self.op.is_boolean:
+            self._emit_unboxed(scope, code)
+            code.add_all(util.box(self.get_type(scope)))
+        else:
+            self.expr.emit(scope, code)
+            self.op.emit(self.expr.get_type(scope), False, scope, code)
 
-        return types
+    def _emit_unboxed(self, scope, code):
+        if self.op.is_boolean:
+            self._emit_boolean(scope, code)
+        else:
+            self.op.emit_unboxed((self.expr,), scope, code)
 
-    def _emit(self, scope):
-        return """
-        {expr}
-        {op}
-        """.format(expr=self.expr.emit(scope), op=self.op.emit(self.expr.get_type(scope), False, scope))
+    def _emit_branch(self, scope, code, label, when):
+        # The only boolean unary operator is 'not', which just inverts the branch on its operand.
+        self.expr.emit_branch(scope, code, label, not when)
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         return self.op.get_type(self.expr.get_type(scope))
 
 class BinaryOperator(Expr):
@@ -336,61 +512,80 @@ class BinaryOperator(Expr):
         'expr2': (Exactly(1), Expr)
     }
 
-    def _emit(self, scope):
-        return """
-        {expr1}
-        {expr2}
-        {op}
-        """.format(expr1=self.expr1.emit(scope), expr2=self.expr2.emit(scope), op=self.op.emit(self.expr1.get_type(scope), True, scope))
+    def _emit(self, scope, code):
+        if scope.unbox or self.op.is_boolean:
+            self._emit_unboxed(scope, code)
+            code.add_all(util.box(self.get_type(scope)))
+        else:
+            self.expr1.emit(scope, code)
+            self.expr2.emit(scope, code)
+            self.op.emit(self.expr1.get_type(scope), True, scope, code)
+
+    def _emit_unboxed(self, scope, code):
+        if self.op.is_boolean:
+            self._emit_boolean(scope, code)
+        else:
+            self.op.emit_unboxed((self.expr1, self.expr2), scope, code)
 
-    def get_type(self, scope):
-        return self.op.get_type(self.expr1.get_type(scope))
+    def _emit_branch(self, scope, code, label, when):
+        self.op.emit_branch((self.expr1, self.expr2), scope, code, label, when)
 
-    def infer_types(self, types, scope):
-        self.op.infer_binary(self.expr1, self.expr2, types, scope)
-        types[self] = types[self.op]
+    def _get_type(self, scope):
+        return self.op.get_type(self.expr1.get_type(scope))
 
-        return types
+    def infer(self, inference, scope):
+        return inference.record(self, self.op.infer_binary(self.expr1, self.expr2, inference, scope))
 
 class Lists(Expr):
     required_children = {
         'exprs': (GreaterOrEqual(1), Expr)
     }
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         return funtype.List(self.exprs[0].get_type(scope))
 
-    def _narrow_types(self, types, typ):
-        for expr in exprs:
-            if types[expr] < typ:
-                raise AssertionError
-            elif expr not in types or types[expr] > typ:
-                types[expr] = typ
-
-    def infer_types(self, types, scope):
-        for expr in exprs:
-            if expr in types:
-                self._narrow_types(types, types[expr])
-
-        return types
-
-    def _emit(self, scope):
-        scope.allocate_stack(4)
-        return_str = """
-        new java/util/LinkedList
-        dup
-        invokenonvirtual java/util/LinkedList/<init>()V
-        """
-
+    def infer(self, inference, scope):
+        inner = inference.variable()
         for expr in self.exprs:
-            return_str += """
-            dup
-            {expr}
-            invokevirtual java/util/LinkedList.add(Ljava/lang/Object;)Z
-            pop
-            """.format(expr=expr.emit(scope))
+            inference.equate(inner, expr.infer(inference, scope))
+
+        return inference.record(self, inference.list(inner))
 
-        return return_str
+    def _emit(self, scope, code):
+        # Lists of constants are built once, when the module is loaded.
+        if self.is_constant(scope):
+            code.extend(scope.constant(self._build))
+        else:
+            self._build(scope, code)
+
+    def is_constant(self, scope):
+        return all(expr.is_constant(scope) for expr in self.exprs)
+
+    def _build(self, scope, code):
+        """Appends the instructions building the list: a packed array if its elements have a primitive type,
+        and a chain of cons cells otherwise."""
+        inner_type = self.get_type(scope).inner_type
+        if type(inner_type) in runtime.PRIMITIVE_LISTS:
+            name, descriptor, array_type = runtime.PRIMITIVE_LISTS[type(inner_type)]
+            code.add('new', name)
+            code.add('dup')
+            code.add_all(util.push_int(len(self.exprs)))
+            code.add('newarray', array_type)
+            for i, expr in enumerate(self.exprs):
+                code.add('dup')
+                code.add_all(util.push_int(i))
+                expr.emit_unboxed(scope, code, inner_type)
+                code.add_all(util.array_store(descriptor))
+            code.add('invokespecial', name, '<init>', '([{})V'.format(descriptor))
+        else:
+            # Built from the end, so each cell is made with the rest of the list already there.
+            code.add('aconst_null')
+            for expr in reversed(self.exprs):
+                code.add('new', runtime.CONS)
+                code.add('dup_x1')
+                code.add('swap')
+                expr.emit(scope, code)
+                code.add('invokespecial', runtime.CONS, '<init>', runtime.CONS_INIT_DESCRIPTOR)
 
 
 class Grouping(Expr):
@@ -398,75 +593,108 @@ class Grouping(Expr):
         'expr': (Exactly(1), Expr)
     }
 
+    def infer(self, inference, scope):
+        return inference.record(self, self.expr.infer(inference, scope))
+
+    def _emit(self, scope, code):
+        self.expr.emit(scope, code)
+
+    def _emit_unboxed(self, scope, code):
+        self.expr.emit_unboxed(scope, code, self.get_type(scope))
+
+    def _emit_branch(self, scope, code, label, when):
+        self.expr.emit_branch(scope, code, label, when)
+
+    def _get_type(self, scope):
+        return self.expr.get_type(scope)
+
+    def is_constant(self, scope):
+        return self.expr.is_constant(scope)
+
 class TypeSpecification(Expr):
     required_children = {
         'expr': (Exactly(1), Expr),
         'type': (Exactly(1), Type)
     }
 
-    def _emit(self, scope):
-        return self.expr.emit(scope)
+    def _emit(self, scope, code):
+        self.expr.emit(scope, code)
+
+    def _emit_unboxed(self, scope, code):
+        self.expr.emit_unboxed(scope, code, self.get_type(scope))
 
-    def get_type(self):
+    def _get_type(self, scope):
         return self.type.to_funtype()
 
+    def infer(self, inference, scope):
+        var = self.expr.infer(inference, scope)
+        inference.equate(var, inference.instantiate(self.type.to_funtype()))
+        return inference.record(self, var)
+
 
 class Int(Terminal):
     make_fn = int
-    def _emit(self, scope):
-        scope.allocate_stack(1)
-        return 'ldc {}'.format(self.value) + util.int_to_integer()
 
-    def get_type(self, scope):
+    def _emit_unboxed(self, scope, code):
+        code.add_all(util.push_int(self.value))
+
+    def _get_type(self, scope):
         return funtype.Int()
 
 class Double(Terminal):
     make_fn = float
 
-    def get_type(self, scope):
+    @property
+    def key(self):
+        # 0.0 and -0.0 are equal as numbers, but not as constants.
+        return self.value, math.copysign(1, self.value)
+
+    def _get_type(self, scope):
         return funtype.Double()
 
-    def _emit(self, scope):
-        scope.allocate_stack(2)
-        return 'ldc2_w {}'.format(self.value) + util.double_to_Double()
+    def _emit_unboxed(self, scope, code):
+        if self.value in (0.0, 1.0) and str(self.value)[0] != '-':
+            code.add('dconst_{}'.format(int(self.value)))
+        else:
+            code.add('ldc2_w', self.value)
 
 class Char(Terminal):
     make_fn = lambda self, x: x
     values = tuple(string.printable)
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         return funtype.Char()
 
-    def _emit(self, scope):
-        scope.allocate_stack(1)
-        return 'bipush {}'.format(ord(self.value)) + util.char_to_Character()
+    def _emit_unboxed(self, scope, code):
+        code.add_all(util.push_int(ord(self.value)))
 
 class Constr(Expr):
     required_children = {
         'id': (Exactly(1), Identifier)
     }
 
-    def _emit(self, scope):
-        scope.allocate_stack(1)
-        return scope.get_identifier(self.id.value)
+    def _emit(self, scope, code):
+        code.extend(scope.get_identifier(self.id.value))
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         return scope.get_identifier_type(self.id.value)
 
+    def infer(self, inference, scope):
+        return inference.record(self, self.id.infer(inference, scope))
+
 class Bool(Terminal):
     values = ('True', 'False')
     make_fn = lambda self, x: x
 
-    def get_type(self, scope):
+    def _get_type(self, scope):
         return funtype.Bool()
 
-    def _emit(self, scope):
-        scope.allocate_stack(1)
-        val = 1 if self.value == 'True' else 0
-        return '''
-        iconst_{val}
-        invokestatic java/lang/Boolean.valueOf(Z)Ljava/lang/Boolean;
-        '''.format(val=val)
+    def _emit_unboxed(self, scope, code):
+        code.add('iconst_1' if self.value == 'True' else 'iconst_0')
+
+    def _emit_branch(self, scope, code, label, when):
+        if (self.value == 'True') == when:
+            code.add('goto', label)
 
 class FunctionApplication(Expr):
     required_children = {
@@ -474,15 +702,103 @@ class FunctionApplication(Expr):
         'expr': (Exactly(1), Expr)
     }
 
-    def _emit(self, scope):
-        scope.allocate_stack(1)
-        return """
-        {func}
-        checkcast AbstractFunction
-        dup
-        {expr}
-        invokevirtual AbstractFunction.apply(Ljava/lang/Object;)Ljava/lang/Object;
-        """.format(func=self.func.emit(scope), expr=self.expr.emit(scope))
-        
-    def get_type(self, scope):
+    def _spine(self):
+        """The function at the head of a chain of applications, and the arguments applied to it in order."""
+        args = []
+        node = self
+        while isinstance(node, FunctionApplication):
+            args.append(node.expr)
+            node = node.func
+        return node, args[::-1]
+
+    def _static_call(self, scope):
+        """The static function this is a saturated call to, if any, with the arguments it takes and any left
+        over to apply to its result."""
+        func, args = self._spine()
+        if isinstance(func, Identifier):
+            static = scope.get_static_function(func.value)
+            if static is not None and len(args) >= static.arity:
+                return static, args[:static.arity], args[static.arity:]
+        return None, None, None
+
+    def _emit_static(self, static, args, scope, code):
+        """Pushes every argument, in the form its parameter is declared with, then calls the static method."""
+        param_descriptors, return_descriptor = util.parse_descriptor(static.descriptor)
+        for arg, param_descriptor in zip(args, param_descriptors):
+            primitive = util.descriptor_type(param_descriptor)
+            if primitive is None:
+                arg.emit(scope, code)
+            else:
+                arg.emit_unboxed(scope, code, primitive)
+
+        code.add('invokestatic', static.owner, static.name, static.descriptor)
+        return util.descriptor_type(return_descriptor)
+
+    def _apply(self, args, scope, code):
+        """Applies the function on top of the stack to *args*, as many at a time as the runtime allows."""
+        for start in range(0, len(args), runtime.MAX_APPLY_ARGS):
+            chunk = args[start:start + runtime.MAX_APPLY_ARGS]
+            code.add('checkcast', 'AbstractFunction')
+            for arg in chunk:
+                arg.emit(scope, code)
+            code.add('invokevirtual', 'AbstractFunction', 'apply', runtime.apply_descriptor(len(chunk)))
+
+    def is_constant(self, scope):
+        # Partial applications of functions to constants are constant, but calls with every argument may fail.
+        func, args = self._spine()
+        if not isinstance(func, Identifier) or not func.is_constant(scope):
+            return False
+        return len(args) < len(scope.get_declaration(func.value).params) and all(
+                arg.is_constant(scope) for arg in args)
+
+    def _emit(self, scope, code):
+        if self.is_constant(scope):
+            code.extend(scope.constant(self._emit_call))
+        else:
+            self._emit_call(scope, code)
+
+    def _emit_call(self, scope, code):
+        static, args, rest = self._static_call(scope)
+        if static is not None:
+            code.add_all(util.box(self._emit_static(static, args, scope, code)))
+            self._apply(rest, scope, code)
+            return
+
+        func, args = self._spine()
+        func.emit(scope, code)
+        self._apply(args, scope, code)
+
+    def _emit_primitive(self, scope, code, typ):
+        static, args, rest = self._static_call(scope)
+        if static is not None and not rest:
+            if typ is None:
+                typ = self.get_type(scope)
+            result = self._emit_static(static, args, scope, code)
+            if type(result) is not type(typ):
+                code.add_all(util.box(result))
+                code.add_all(util.unbox(typ))
+            return
+
+        super()._emit_primitive(scope, code, typ)
+
+    def _get_type(self, scope):
         return self.func.get_type(scope).apply(self.expr.get_type(scope))
+
+    def infer(self, inference, scope):
+        func = self.func.infer(inference, scope)
+        result = inference.variable()
+        if inference.lenient and self._declared_argument(inference, scope):
+            param = inference.variable()
+            inference.equate(func, inference.arrow(param, result))
+            inference.equate_argument(param, self.expr.infer(inference, scope))
+        else:
+            inference.equate(func, inference.arrow(self.expr.infer(inference, scope), result))
+        return inference.record(self, result)
+
+    def _declared_argument(self, inference, scope):
+        """Whether this applies a declared function to one of the parameters it is declared with."""
+        func, args = self._spine()
+        if not isinstance(func, Identifier) or func.value in inference.env:
+            return False
+        declaration = scope.get_declaration(func.value)
+        return declaration is not None and len(args) <= len(declaration.params)
@@ -0,0 +1,156 @@
+from funcompiler.expression import (
+    Expr, Terminal, Identifier, Int, Double, Char, Bool, Constr, UnaryOperator, BinaryOperator, Grouping,
+    TypeSpecification, FunctionApplication
+)
+from funcompiler import funtype
+
+# The type of each kind of constant, as the Python values it is worked out with. Bools come first, as they are
+# ints as well.
+_constant_types = ((bool, funtype.Bool), (int, funtype.Int), (float, funtype.Double), (str, funtype.Char))
+
+
+class NotConstant(Exception):
+    """Raised when evaluating an expression whose value is only known at run time."""
+
+
+def value(terminal):
+    """The Python value of the constant *terminal*."""
+    return terminal.value == 'True' if isinstance(terminal, Bool) else terminal.value
+
+
+def terminal(constant):
+    """A new terminal holding the Python value *constant*."""
+    if isinstance(constant, bool):
+        return Bool('True' if constant else 'False')
+    return {int: Int, float: Double, str: Char}[type(constant)](constant)
+
+
+def constant_type(constant):
+    for python_type, typ in _constant_types:
+        if isinstance(constant, python_type):
+            return typ
+
+
+def size(expr, limit):
+    """The number of nodes in *expr*, counting no further than just past *limit*."""
+    count = 0
+    stack = [expr]
+    while stack and count <= limit:
+        node = stack.pop()
+        count += 1
+        for child in node._children.values():
+            if isinstance(child, Expr):
+                stack.append(child)
+            elif type(child) is tuple:
+                stack.extend(item for item in child if isinstance(item, Expr))
+    return count
+
+
+class ConstantFolder:
+    """Works out the closed parts of expressions at compile time, replacing each with a single terminal. Calls
+    with constant arguments to declared functions are evaluated too, by substituting the arguments into the body,
+    as long as the body has at most *max_size* nodes and the call takes at most *max_steps* nodes to evaluate."""
+
+    def __init__(self, max_size=64, max_steps=512):
+        self.max_size = max_size
+        self.max_steps = max_steps
+
+    def fold(self, expr, scope, bound=()):
+        """Returns *expr* with its constant subexpressions folded. Identifiers in *bound*, such as parameters,
+        are never constant. Nodes that don't change are returned as they are, so their types are kept."""
+        if isinstance(expr, (Terminal, Constr)):
+            return expr
+        elif isinstance(expr, Identifier):
+            if expr.value not in bound:
+                decl = scope.get_declaration(expr.value)
+                if decl is not None and not decl.params and isinstance(decl.expr, Terminal):
+                    return terminal(value(decl.expr))
+            return expr
+
+        children = {}
+        changed = False
+        for name, child in expr._children.items():
+            if isinstance(child, Expr):
+                children[name] = self.fold(child, scope, bound)
+                changed |= children[name] is not child
+            elif type(child) is tuple:
+                children[name] = tuple(self.fold(item, scope, bound) for item in child)
+                changed |= any(new is not old for new, old in zip(children[name], child))
+            else:
+                children[name] = child
+        if changed:
+            expr = type(expr)(**children)
+
+        if isinstance(expr, Grouping):
+            return expr.expr
+        elif isinstance(expr, TypeSpecification):
+            inner = expr.expr
+            if isinstance(inner, Terminal) and type(inner.get_type(scope)) is type(expr.type.to_funtype()):
+                return inner
+        elif isinstance(expr, (UnaryOperator, BinaryOperator, FunctionApplication)):
+            if isinstance(expr, FunctionApplication):
+                func, operands = expr._spine()
+                if not isinstance(func, Identifier) or func.value in bound:
+                    return expr
+            else:
+                operands = [child for child in children.values() if isinstance(child, Expr)]
+            if not all(isinstance(operand, Terminal) for operand in operands):
+                return expr
+
+            try:
+                return terminal(self._evaluate(expr, {}, scope, [self.max_steps]))
+            except NotConstant:
+                pass
+            except RecursionError:
+                # Calls nested deeper than Python allows are left for run time, like any other over the budget.
+                pass
+        return expr
+
+    def _evaluate(self, expr, env, scope, steps):
+        """The Python value of *expr*, with the parameters in *env* bound to constants. *steps* holds the number
+        of nodes that may still be visited, shared by every nested call."""
+        steps[0] -= 1
+        if steps[0] < 0:
+            raise NotConstant
+
+        if isinstance(expr, Terminal):
+            return value(expr)
+        elif isinstance(expr, Identifier):
+            if expr.value in env:
+                return env[expr.value]
+            decl = scope.get_declaration(expr.value)
+            if decl is not None and not decl.params and isinstance(decl.expr, Terminal):
+                return value(decl.expr)
+        elif isinstance(expr, (Grouping, TypeSpecification)):
+            return self._evaluate(expr.expr, env, scope, steps)
+        elif isinstance(expr, UnaryOperator):
+            return self._operator(expr.op, (expr.expr,), env, scope, steps)
+        elif isinstance(expr, BinaryOperator):
+            return self._operator(expr.op, (expr.expr1, expr.expr2), env, scope, steps)
+        elif isinstance(expr, FunctionApplication):
+            return self._call(expr, env, scope, steps)
+        raise NotConstant
+
+    def _operator(self, op, operands, env, scope, steps):
+        values = [self._evaluate(operand, env, scope, steps) for operand in operands]
+        types = {constant_type(operand) for operand in values}
+        if len(types) != 1:
+            raise NotConstant
+
+        result = op.fold(types.pop(), *values)
+        if result is None:
+            raise NotConstant
+        return result
+
+    def _call(self, expr, env, scope, steps):
+        """Beta-reduces a saturated call to a declared function."""
+        func, args = expr._spine()
+        if not isinstance(func, Identifier) or func.value in env:
+            raise NotConstant
+
+        decl = scope.get_declaration(func.value)
+        if decl is None or len(args) != len(decl.params) or size(decl.expr, self.max_size) > self.max_size:
+            raise NotConstant
+
+        values = [self._evaluate(arg, env, scope, steps) for arg in args]
+        return self._evaluate(decl.expr, {param.value: arg for param, arg in zip(decl.params, values)}, scope, steps)
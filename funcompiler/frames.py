@@ -0,0 +1,166 @@
+from funcompiler.bytecode import (
+    NONE, LOCAL, BYTE, SHORT, CONSTANT, CLASS, FIELD, METHOD, INTERFACE_METHOD, BRANCH, IINC, NEWARRAY,
+    MULTIANEWARRAY, TABLESWITCH, LOOKUPSWITCH, Label, Instruction, descriptor_words
+)
+
+# The change in stack depth, in words, for each instruction without operands.
+_NONE_EFFECTS = {'nop': 0, 'aconst_null': 1, 'arraylength': 0, 'monitorenter': -1, 'monitorexit': -1,
+                 'pop': -1, 'pop2': -2, 'dup': 1, 'dup_x1': 1, 'dup_x2': 1, 'dup2': 2, 'dup2_x1': 2, 'dup2_x2': 2,
+                 'swap': 0, 'lcmp': -3, 'fcmpl': -1, 'fcmpg': -1, 'dcmpl': -3, 'dcmpg': -3,
+                 'i2l': 1, 'i2f': 0, 'i2d': 1, 'l2i': -1, 'l2f': -1, 'l2d': 0, 'f2i': 0, 'f2l': 1, 'f2d': 1,
+                 'd2i': -1, 'd2l': 0, 'd2f': -1, 'i2b': 0, 'i2c': 0, 'i2s': 0,
+                 'ishl': -1, 'ishr': -1, 'iushr': -1, 'lshl': -1, 'lshr': -1, 'lushr': -1,
+                 'iand': -1, 'ior': -1, 'ixor': -1, 'land': -2, 'lor': -2, 'lxor': -2}
+_NONE_EFFECTS.update(('iconst_{}'.format(i), 1) for i in ('m1', 0, 1, 2, 3, 4, 5))
+_NONE_EFFECTS.update({'lconst_0': 2, 'lconst_1': 2, 'fconst_0': 1, 'fconst_1': 1, 'fconst_2': 1,
+                      'dconst_0': 2, 'dconst_1': 2})
+for _prefix in 'ilfda':
+    _width = 2 if _prefix in 'ld' else 1
+    for _i in range(4):
+        _NONE_EFFECTS['{}load_{}'.format(_prefix, _i)] = _width
+        _NONE_EFFECTS['{}store_{}'.format(_prefix, _i)] = -_width
+    if _prefix != 'a':
+        for _op in ('add', 'sub', 'mul', 'div', 'rem'):
+            _NONE_EFFECTS[_prefix + _op] = -_width
+        _NONE_EFFECTS[_prefix + 'neg'] = 0
+for _prefix in 'ilfdabcs':
+    _width = 2 if _prefix in 'ld' else 1
+    _NONE_EFFECTS[_prefix + 'aload'] = _width - 2
+    _NONE_EFFECTS[_prefix + 'astore'] = -2 - _width
+
+# Instructions after which execution never carries on to the next one.
+_TERMINAL = {'goto', 'goto_w', 'ireturn', 'lreturn', 'freturn', 'dreturn', 'areturn', 'return', 'athrow', 'ret',
+             'tableswitch', 'lookupswitch'}
+
+
+def _words(descriptor):
+    """The number of stack words a value with the field *descriptor* takes."""
+    if descriptor == 'V':
+        return 0
+    return 2 if descriptor in 'JD' else 1
+
+
+def stack_effect(instruction):
+    """The change in stack depth, in words, after running *instruction*."""
+    kind = instruction.kind
+    mnemonic = instruction.mnemonic
+    operands = instruction.operands
+
+    if kind == NONE:
+        return 0 if mnemonic in _TERMINAL else _NONE_EFFECTS[mnemonic]
+    elif kind == LOCAL:
+        width = 2 if mnemonic[0] in 'ld' else 1
+        return 0 if mnemonic == 'ret' else width if mnemonic.endswith('load') else -width
+    elif kind in (BYTE, SHORT):
+        return 1
+    elif kind == CONSTANT:
+        return 2 if mnemonic == 'ldc2_w' else 1
+    elif kind == CLASS:
+        return 1 if mnemonic == 'new' else 0
+    elif kind == FIELD:
+        width = _words(operands[2])
+        return {'getstatic': width, 'putstatic': -width, 'getfield': width - 1, 'putfield': -width - 1}[mnemonic]
+    elif kind in (METHOD, INTERFACE_METHOD):
+        descriptor = operands[2]
+        receiver = 0 if mnemonic == 'invokestatic' else 1
+        return _words(descriptor[descriptor.index(')') + 1:]) - descriptor_words(descriptor) - receiver
+    elif kind == BRANCH:
+        if mnemonic.startswith('if_'):
+            return -2
+        elif mnemonic.startswith('if'):
+            return -1
+        return 1 if mnemonic.startswith('jsr') else 0
+    elif kind in (IINC, NEWARRAY):
+        return 0
+    elif kind == MULTIANEWARRAY:
+        return 1 - operands[1]
+    elif kind in (TABLESWITCH, LOOKUPSWITCH):
+        return -1
+    raise ValueError('Unknown instruction kind "{}"'.format(kind))
+
+
+def _targets(instruction):
+    kind = instruction.kind
+    if kind == BRANCH:
+        return instruction.operands[:1]
+    elif kind == TABLESWITCH:
+        return (*instruction.operands[2], instruction.operands[3])
+    elif kind == LOOKUPSWITCH:
+        return (*(target for key, target in instruction.operands[0]), instruction.operands[1])
+    return ()
+
+
+def max_stack(method):
+    """The deepest the operand stack gets in *method*, found by following the stack depth along every path
+    through its code."""
+    items = method.code.items
+    positions = {item: i for i, item in enumerate(items) if isinstance(item, Label)}
+
+    depths = [None] * (len(items) + 1)
+    worklist = [(0, 0)]
+    for handler in method.handlers:
+        # Handlers start with just the exception on the stack.
+        worklist.append((positions[handler.handler], 1))
+
+    deepest = 0
+    while worklist:
+        i, depth = worklist.pop()
+
+        # Follow straight-line code until reaching somewhere already visited, or the end of the path.
+        while i < len(items):
+            if depths[i] is not None:
+                if depths[i] != depth:
+                    raise ValueError('Inconsistent stack depth in {}: {} and {}'.format(method.name, depths[i], depth))
+                break
+            depths[i] = depth
+
+            item = items[i]
+            i += 1
+            if isinstance(item, Label):
+                continue
+
+            depth += stack_effect(item)
+            if depth < 0:
+                raise ValueError('Stack underflow in {} at {}'.format(method.name, item))
+            deepest = max(deepest, depth)
+
+            for target in _targets(item):
+                worklist.append((positions[target], depth))
+            if item.mnemonic in _TERMINAL:
+                break
+
+    return deepest
+
+
+def max_locals(method):
+    """The number of local variable words *method* uses, including its parameters."""
+    words = descriptor_words(method.descriptor) + (0 if method.is_static else 1)
+
+    for instruction in method.code:
+        if not isinstance(instruction, Instruction):
+            continue
+
+        mnemonic = instruction.mnemonic
+        if instruction.kind in (LOCAL, IINC):
+            index = instruction.operands[0]
+        elif instruction.kind == NONE and mnemonic[-2:] in ('_0', '_1', '_2', '_3') and \
+                mnemonic[1:-2] in ('load', 'store'):
+            index = int(mnemonic[-1])
+        else:
+            continue
+
+        width = 2 if mnemonic[0] in 'ld' else 1
+        words = max(words, index + width)
+
+    return words
+
+
+def set_limits(classdef):
+    """Fills in the stack and local variable limits of every method in *classdef* that doesn't give them."""
+    for method in classdef.methods:
+        if not method.has_code:
+            continue
+        if method.max_stack is None:
+            method.max_stack = max_stack(method)
+        if method.max_locals is None:
+            method.max_locals = max_locals(method)
@@ -1,18 +1,221 @@
+import os
 import string
 import collections
+import collections.abc
+
+from funcompiler.backend import JasminBackend
+from funcompiler.bytecode import Code, Label
+from funcompiler.inference import TypeTable
+from funcompiler.funtype import type_key
+
+# A top-level function that can be called directly with all of its arguments, as the static method
+# owner.name with the given descriptor.
+StaticFunction = collections.namedtuple('StaticFunction', ('owner', 'name', 'descriptor', 'arity'))
+
+class CompileError(AssertionError):
+    """Raised for a module that parses but can't be compiled. It is an AssertionError, as that is what the
+    compiler has always raised for such modules."""
 
 class Scope:
-    def __init__(self):
-        self._identifiers = {}
-        self._label = 0
-        self._types = {}
-        self._stack = 0
+    def __init__(self, backend=None, unbox=True, fold=True, cache=None, executor=None, function_classes=True):
+        # Imported here, as the folder works on expression nodes, which are built on this module.
+        from funcompiler.fold import ConstantFolder
+
+        self.backend = backend if backend is not None else JasminBackend()
+        # Whether to use the inferred types to keep intermediate values as primitives, only boxing them where an
+        # object is really needed.
+        self.unbox = unbox
+        # Works out constant expressions at compile time. True uses the default budgets, False turns folding off,
+        # and a ConstantFolder gives budgets of its own.
+        self.folder = ConstantFolder() if fold is True else fold or None
+        # A ClassCache of classes generated before, or None to generate every class.
+        self.cache = cache
+        # A concurrent.futures.Executor to generate the classes of declarations on, or None to generate each one
+        # as it is declared. Classes put off until then are kept in order, shared with every child of this scope.
+        self.executor = executor
+        self._pending = []
+        # Whether each function has a class of its own. Otherwise function bodies are static methods of the module
+        # class, and every function value is an instance of one class for the whole module, so that far fewer
+        # classes are loaded.
+        self.function_classes = function_classes
+        # The ClassDef of the module being compiled, which holds the values of its parameterless declarations.
+        self.module_class = None
+        # The class being generated, which keeps the constants its methods use, with its static initializer and
+        # the name of the field holding each constant.
+        self._class = None
+        self._class_init = Code()
+        self._constants = {}
+        # The CommonSubexpressions of the method being generated, if it shares them.
+        self.common = None
+        self._identifiers = collections.ChainMap()
+        self._unboxed_identifiers = collections.ChainMap()
+        self._static_functions = collections.ChainMap()
+        self._declarations = collections.ChainMap()
+        self._types = collections.ChainMap()
+        # The type of each expression node, shared with every child of this scope.
+        self.types = TypeTable()
+
+    def child(self):
+        """A scope for the body of a declaration. Anything added to it hides, without changing, the bindings of
+        this scope, which are shared rather than copied."""
+        # Not copy.copy(), which would leave out what isn't pickled.
+        child = object.__new__(type(self))
+        child.__dict__.update(self.__dict__)
+        child._identifiers = self._identifiers.new_child()
+        child._unboxed_identifiers = self._unboxed_identifiers.new_child()
+        child._static_functions = self._static_functions.new_child()
+        child._declarations = self._declarations.new_child()
+        child._types = self._types.new_child()
+        return child
+
+    def start_module(self, classdef):
+        """Makes *classdef* the module class, which is also where constants are kept until another class is
+        started."""
+        self.module_class = classdef
+        self.start_class(classdef)
+
+    def start_class(self, classdef):
+        """Makes *classdef* the class that constants used from now on are kept in."""
+        self._class = classdef
+        self._class_init = Code()
+        self._constants = {}
+
+    def initialize(self, code):
+        """Appends *code* to the static initializer of the current class."""
+        self._class_init.extend(code)
+
+    def finish_class(self):
+        """Adds the static initializer, if it does anything, to the current class."""
+        if self._class_init.items:
+            init = self._class.add_method(('static',), '<clinit>', '()V')
+            init.code.extend(self._class_init)
+            init.code.add('return')
+
+    def constant(self, emit):
+        """Returns code loading a value that is worked out only once, when the current class is initialized.
+        *emit(scope, code)* appends the instructions working it out, which may not use anything local to the
+        method the value is used in. Constants worked out by the same instructions share one static field."""
+        # The initializer is a method of its own, so nothing is shared with the method using the constant.
+        # Constants used while working this one out are added to it first.
+        init_scope = self.child()
+        init_scope.common = None
+        code = Code()
+        emit(init_scope, code)
+        if self._class is None:
+            return code
+
+        if any(isinstance(item, Label) for item in code):
+            key = object()
+        else:
+            # Operands are compared by repr, so that 0.0 and -0.0 are told apart.
+            key = tuple((item.mnemonic, *map(repr, item.operands)) for item in code)
+
+        if key not in self._constants:
+            name = 'constant${}'.format(len(self._constants))
+            self._class.add_field(('public', 'static', 'final'), name, 'Ljava/lang/Object;')
+            code.add('putstatic', self._class.name, name, 'Ljava/lang/Object;')
+            self.initialize(code)
+            self._constants[key] = name
+
+        code = Code()
+        code.add('getstatic', self._class.name, self._constants[key], 'Ljava/lang/Object;')
+        return code
+
+    def __getstate__(self):
+        # Scopes are pickled to generate classes in other processes, which have no use for the executor or cache.
+        state = self.__dict__.copy()
+        state.update(cache=None, executor=None, _pending=[])
+        return state
+
+    def write_class(self, name, dependencies, build):
+        """Hands the class *name* to the backend. *build()* returns its ClassDef, and if there is a cache it is
+        only called when no class has been stored for the same *dependencies*, a list of everything else the
+        class's code depends on. With an executor, *build* must be picklable, and the class is only generated
+        by write_pending()."""
+        if self.cache is None and self.executor is None:
+            self.backend.write(build())
+            return
+
+        key = data = None
+        if self.cache is not None:
+            key = self.cache.key(type(self.backend).__name__, self.unbox, *dependencies)
+            data = self.cache.get(key)
+
+        if self.executor is not None:
+            self._pending.append((name, key, data, build))
+            return
+
+        if data is None:
+            data = self.backend.assemble(build())
+            self.cache.put(key, data)
+        self.backend.store(name, data)
+
+    def write_pending(self):
+        """Generates the classes put off by write_class() on the executor, then stores every one of them in the
+        order they were written, so the output doesn't depend on which finishes first."""
+        pending = list(self._pending)
+        del self._pending[:]
+        builds = [build for _, _, data, build in pending if data is None]
+
+        # Classes are sent in batches, so the scope they share is only pickled once for each batch.
+        size = max(1, len(builds) // (4 * (os.cpu_count() or 1)))
+        batches = [builds[i:i + size] for i in range(0, len(builds), size)]
+        results = iter([data for batch in self.executor.map(_assemble, [self.backend] * len(batches), batches)
+                        for data in batch])
+
+        for name, key, data, _ in pending:
+            if data is None:
+                data = next(results)
+                if key is not None:
+                    self.cache.put(key, data)
+            self.backend.store(name, data)
+
+    def binding(self, identifier):
+        """A string describing everything the code using *identifier* depends on: how it is pushed, the static
+        function it calls, and its type."""
+        typ = self._types.get(identifier)
+        declaration = self._declarations.get(identifier)
+        def code_key(code):
+            return tuple(map(repr, code)) if isinstance(code, Code) else code
+
+        return repr((
+            code_key(self._identifiers.get(identifier)),
+            code_key(self._unboxed_identifiers.get(identifier)),
+            self._static_functions.get(identifier),
+            type_key(typ[0]) if typ is not None else None,
+            len(declaration.params) if declaration is not None else None
+        ))
 
     def get_identifier(self, identifier):
-        return self._identifiers[identifier][0]
+        try:
+            return self._identifiers[identifier]
+        except KeyError:
+            raise CompileError('Undefined identifier {!r}'.format(identifier)) from None
+
+    def add_identifier(self, identifier, value, unboxed=None):
+        """Binds *identifier* to the code in *value*, which pushes it as an object. If the value is also available
+        as a primitive, *unboxed* is the code to push that instead. Rebinding an identifier hides any static
+        function or declaration of the same name."""
+        self._identifiers[identifier] = value
+        self._unboxed_identifiers[identifier] = unboxed
+        self._static_functions[identifier] = None
+        self._declarations[identifier] = None
+
+    def get_unboxed_identifier(self, identifier):
+        return self._unboxed_identifiers.get(identifier)
+
+    def add_static_function(self, identifier, owner, name, descriptor, arity):
+        self._static_functions[identifier] = StaticFunction(owner, name, descriptor, arity)
+
+    def get_static_function(self, identifier):
+        return self._static_functions.get(identifier)
 
-    def add_identifier(self, identifier, value, words=0):
-        self._identifiers[identifier] = (value, words)
+    def add_declaration(self, identifier, declaration):
+        """Makes the FunctionDeclaration *declaration* available to the constant folder as *identifier*."""
+        self._declarations[identifier] = declaration
+
+    def get_declaration(self, identifier):
+        return self._declarations.get(identifier)
 
     def add_identifier_type(self, identifier, typ):
         if identifier not in self._types or self._types[identifier][1] == False:
@@ -24,23 +227,14 @@ class Scope:
     def get_identifier_type(self, identifier):
         return self._types[identifier][0]
 
-    def allocate_stack(self, words):
-        self._stack += words
-
-    def get_allocate_identifier(self, identifier):
-        val, stack_words = self._identifiers[identifier]
-        self._stack += stack_words
-        return val
-
-    def get_reset_stack(self):
-        val = self._stack
-        self._stack = 0
-        return val
-
     @property
     def label(self):
-        self._label += 1
-        return self._label
+        """A fresh label for the method being generated."""
+        return Label()
+
+def _assemble(backend, builds):
+    """Generates and serializes the class made by each of *builds*, on a worker of an executor."""
+    return [backend.assemble(build()) for build in builds]
 
 class ASTNode:
     # Should be set in sub-classes to
@@ -61,7 +255,7 @@ class ASTNode:
             assert name in children, "Required child named \"{}\" was not present in \"{}\" node".format(name, self.__class__.__name__)
 
             val = children[name]
-            if isinstance(val, collections.Iterable):
+            if isinstance(val, collections.abc.Iterable):
                 val = tuple(val)
                 count = len(val)
                 for item in val:
@@ -78,8 +272,10 @@ class ASTNode:
         assert len(children) == 0
 
     def __getattr__(self, name):
-        if name in self._children:
-            return self._children[name]
+        # Unpickling looks up attributes before _children is set, which would otherwise end up back here.
+        children = self.__dict__.get('_children')
+        if children is not None and name in children:
+            return children[name]
         else:
             raise AttributeError
 
@@ -107,25 +303,15 @@ class ASTNode:
 
         return ret
 
-    def _emit(self, scope):
+    def _emit(self, scope, code):
         raise NotImplementedError
 
     def get_type(self):
         """Should be overridden in subclasses to return the type of the result."""
         raise NotImplementedError
 
-    def _emit_target(self):
-        """By default, emit to a return string. Can be overriden in subclasses to return a (non-empty) string indicating the
-        file name to write to. In this case, the empty string will be returned from emit()."""
-        return ''
-
-    def emit(self, scope):
-        """Emits the result of self._emit() to the self._emit_target()."""
-        emit_string = '\n'.join([line.strip() for line in self._emit(scope).split('\n') if line.strip()])
-
-        if self._emit_target():
-            with open(self._emit_target(), 'w') as outfile:
-                outfile.write(emit_string)
-            return ''
-        else:
-            return emit_string
+    def emit(self, scope, code):
+        """Appends the instructions for this node to *code*, and returns it. Nodes that generate a class of their own
+        hand it to scope.backend, which does the only serialization."""
+        self._emit(scope, code)
+        return code
@@ -1,7 +1,5 @@
 from functools import total_ordering
 
-import funcompiler.expression
-
 @total_ordering
 class Type:
     jvm_code = NotImplemented
@@ -29,6 +27,10 @@ class GenericType(Type):
     def __str__(self):
         return 't' + str(self._num)
 
+    @property
+    def num(self):
+        return self._num
+
 class Int(Type):
     jvm_code = 'I'
     wideness = 1
@@ -38,7 +40,7 @@ class Double(Type):
     wideness = 5
 
 class Bool(Type):
-    jvm_code = 'B'
+    jvm_code = 'Z'
     wideness = 5
 
 class Char(Type):
@@ -65,23 +67,6 @@ class List(Type):
     def inner_type(self):
         return self._inner_type
 
-class _ChangeTrackingDict(dict):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._modified = False
-
-    def __setitem__(self, key, value):
-        if key not in self or self[key] > value:
-            super().__setitem__(key, value)
-            self._modified = True
-
-    @property
-    def modified(self):
-        return self._modified
-
-    def reset(self):
-        self._modified = False
-
 class Function(Type):
     jvm_code = 'LAbstractFunction;'
 
@@ -101,19 +86,32 @@ class Function(Type):
             return Function(self._progression[1:-1], self._progression[-1])
 
     @classmethod
-    def infer_types(cls, args, expr, scope):
-        # To start, we assume that each of the arguments can be of any type.
-        types = _ChangeTrackingDict()
-        for i, arg in enumerate(args):
-            types[arg] = GenericType(i)
+    def infer_types(cls, args, expr, scope, lenient=False):
+        """Infers the types of the arguments to a function, and of its body *expr*. Returns the Inference, which
+        gives the type of each of them by indexing. The types of every node are also stored in scope.types. If
+        *lenient*, arguments that don't match the declared function they are passed to are let through."""
+        from funcompiler.inference import Inference
 
-        expr.infer_types(types, scope)
-        while types.modified:
-            types.reset()
-            expr.infer_types(types, scope)
+        inference = Inference(lenient)
+        for arg in args:
+            inference.env[arg.value] = inference.record(arg, inference.variable())
 
-        return types
+        expr.infer(inference, scope)
+        inference.solve()
+        inference.annotate(scope.types)
+
+        return inference
 
     @property
     def progression(self):
         return self._progression
+
+def type_key(typ):
+    """A string telling *typ* apart from every other type, which str() doesn't do for lists and data types."""
+    if isinstance(typ, Data):
+        return 'Data({})'.format(typ.identifier)
+    elif isinstance(typ, List):
+        return '[{}]'.format(type_key(typ.inner_type))
+    elif isinstance(typ, Function):
+        return '({})'.format(' -> '.join(map(type_key, typ.progression)))
+    return str(typ)
@@ -0,0 +1,352 @@
+import glob
+import os
+import subprocess
+import tempfile
+import threading
+
+from funcompiler import classfile
+from funcompiler import util
+from funcompiler.backend import ClassFileBackend
+from funcompiler.bytecode import ClassDef, ExceptionHandler, Label
+
+# The class that runs modules, one after another, in a JVM.
+RUNNER = 'FunRunner'
+
+STRING = 'Ljava/lang/String;'
+PRINT_STREAM = 'Ljava/io/PrintStream;'
+
+
+def runner_class():
+    """A class whose main() reads requests from stdin, one a line, each the class path of a compiled module and
+    the name of its main class separated by a tab. Every module is loaded by a class loader of its own, so modules
+    with classes of the same name don't clash, and nothing one leaves in its static fields is seen by the next.
+
+    While a module runs, System.out is captured. Then a line giving 'ok' or 'error' and the number of bytes
+    captured, separated by a tab, is written to the real stdout, followed by those bytes. If the module threw, its
+    stack trace comes after anything it printed."""
+    classdef = ClassDef(RUNNER, access=('public', 'final'))
+    method = classdef.add_method(('public', 'static'), 'main', '([Ljava/lang/String;)V')
+    code = method.code
+
+    # Locals: 1 the reader of requests, 2 the real stdout, 3 the captured bytes and 4 the stream capturing them,
+    # 5 the request, 6 where the tab is in it, 7 the module's class loader, 8 the status, 9 the class path
+    # entries and later the exception thrown, 10 their URLs and 11 the index into both.
+    code.add('new', 'java/io/BufferedReader')
+    code.add('dup')
+    code.add('new', 'java/io/InputStreamReader')
+    code.add('dup')
+    code.add('getstatic', 'java/lang/System', 'in', 'Ljava/io/InputStream;')
+    code.add('ldc', 'UTF-8')
+    code.add('invokenonvirtual', 'java/io/InputStreamReader', '<init>', '(Ljava/io/InputStream;{})V'.format(STRING))
+    code.add('invokenonvirtual', 'java/io/BufferedReader', '<init>', '(Ljava/io/Reader;)V')
+    code.add('astore_1')
+    code.add('getstatic', 'java/lang/System', 'out', PRINT_STREAM)
+    code.add('astore_2')
+    code.add('new', 'java/io/ByteArrayOutputStream')
+    code.add('dup')
+    code.add('invokenonvirtual', 'java/io/ByteArrayOutputStream', '<init>', '()V')
+    code.add('astore_3')
+    code.add('new', 'java/io/PrintStream')
+    code.add('dup')
+    code.add('aload_3')
+    code.add('iconst_1')
+    code.add('ldc', 'UTF-8')
+    code.add('invokenonvirtual', 'java/io/PrintStream', '<init>', '(Ljava/io/OutputStream;Z{})V'.format(STRING))
+    code.add('astore', 4)
+    code.add('aload', 4)
+    code.add('invokestatic', 'java/lang/System', 'setOut', '({})V'.format(PRINT_STREAM))
+
+    request, start, url, built, end, handler, unwrapped, report, closed, done = (Label() for _ in range(10))
+    method.handlers.append(ExceptionHandler('java/lang/Throwable', start, end, handler))
+
+    code.place(request)
+    code.add('aload_1')
+    code.add('invokevirtual', 'java/io/BufferedReader', 'readLine', '()' + STRING)
+    code.add('dup')
+    code.add('astore', 5)
+    code.add('ifnull', done)
+    code.add('aload', 5)
+    code.add_all(util.push_int(ord('\t')))
+    code.add('invokevirtual', 'java/lang/String', 'indexOf', '(I)I')
+    code.add('istore', 6)
+    code.add('aload_3')
+    code.add('invokevirtual', 'java/io/ByteArrayOutputStream', 'reset', '()V')
+    code.add('aconst_null')
+    code.add('astore', 7)
+    code.add('ldc', 'ok')
+    code.add('astore', 8)
+
+    # Make a URL of each class path entry.
+    code.place(start)
+    code.add('aload', 5)
+    code.add('iconst_0')
+    code.add('iload', 6)
+    code.add('invokevirtual', 'java/lang/String', 'substring', '(II)' + STRING)
+    code.add('getstatic', 'java/io/File', 'pathSeparator', STRING)
+    code.add('invokevirtual', 'java/lang/String', 'split', '({})[{}'.format(STRING, STRING))
+    code.add('astore', 9)
+    code.add('aload', 9)
+    code.add('arraylength')
+    code.add('anewarray', 'java/net/URL')
+    code.add('astore', 10)
+    code.add('iconst_0')
+    code.add('istore', 11)
+    code.place(url)
+    code.add('iload', 11)
+    code.add('aload', 10)
+    code.add('arraylength')
+    code.add('if_icmpge', built)
+    code.add('aload', 10)
+    code.add('iload', 11)
+    code.add('new', 'java/io/File')
+    code.add('dup')
+    code.add('aload', 9)
+    code.add('iload', 11)
+    code.add('aaload')
+    code.add('invokenonvirtual', 'java/io/File', '<init>', '({})V'.format(STRING))
+    code.add('invokevirtual', 'java/io/File', 'toURI', '()Ljava/net/URI;')
+    code.add('invokevirtual', 'java/net/URI', 'toURL', '()Ljava/net/URL;')
+    code.add('aastore')
+    code.add('iinc', 11, 1)
+    code.add('goto', url)
+
+    # Load the main class in a new class loader and call main(new String[0]) on it.
+    code.place(built)
+    code.add('new', 'java/net/URLClassLoader')
+    code.add('dup')
+    code.add('aload', 10)
+    code.add('invokenonvirtual', 'java/net/URLClassLoader', '<init>', '([Ljava/net/URL;)V')
+    code.add('astore', 7)
+    code.add('aload', 5)
+    code.add('iload', 6)
+    code.add('iconst_1')
+    code.add('iadd')
+    code.add('invokevirtual', 'java/lang/String', 'substring', '(I)' + STRING)
+    code.add('iconst_1')
+    code.add('aload', 7)
+    code.add('invokestatic', 'java/lang/Class', 'forName',
+             '({}ZLjava/lang/ClassLoader;)Ljava/lang/Class;'.format(STRING))
+    code.add('ldc', 'main')
+    code.add('iconst_1')
+    code.add('anewarray', 'java/lang/Class')
+    code.add('dup')
+    code.add('iconst_0')
+    code.add('ldc', '[Ljava.lang.String;')
+    code.add('invokestatic', 'java/lang/Class', 'forName', '({})Ljava/lang/Class;'.format(STRING))
+    code.add('aastore')
+    code.add('invokevirtual', 'java/lang/Class', 'getMethod',
+             '({}[Ljava/lang/Class;)Ljava/lang/reflect/Method;'.format(STRING))
+    code.add('aconst_null')
+    code.add('iconst_1')
+    code.add('anewarray', 'java/lang/Object')
+    code.add('dup')
+    code.add('iconst_0')
+    code.add('iconst_0')
+    code.add('anewarray', 'java/lang/String')
+    code.add('aastore')
+    code.add('invokevirtual', 'java/lang/reflect/Method', 'invoke',
+             '(Ljava/lang/Object;[Ljava/lang/Object;)Ljava/lang/Object;')
+    code.add('pop')
+    code.place(end)
+    code.add('goto', report)
+
+    # Report what the module threw, rather than the exception reflection wraps it in.
+    code.place(handler)
+    code.add('astore', 9)
+    code.add('ldc', 'error')
+    code.add('astore', 8)
+    code.add('aload', 9)
+    code.add('instanceof', 'java/lang/reflect/InvocationTargetException')
+    code.add('ifeq', unwrapped)
+    code.add('aload', 9)
+    code.add('invokevirtual', 'java/lang/Throwable', 'getCause', '()Ljava/lang/Throwable;')
+    code.add('astore', 9)
+    code.place(unwrapped)
+    code.add('aload', 9)
+    code.add('aload', 4)
+    code.add('invokevirtual', 'java/lang/Throwable', 'printStackTrace', '({})V'.format(PRINT_STREAM))
+
+    code.place(report)
+    code.add('aload', 7)
+    code.add('ifnull', closed)
+    code.add('aload', 7)
+    code.add('invokevirtual', 'java/net/URLClassLoader', 'close', '()V')
+    code.place(closed)
+    code.add('aload', 4)
+    code.add('invokevirtual', 'java/io/PrintStream', 'flush', '()V')
+    code.add('aload_2')
+    code.add('new', 'java/lang/StringBuilder')
+    code.add('dup')
+    code.add('invokenonvirtual', 'java/lang/StringBuilder', '<init>', '()V')
+    code.add('aload', 8)
+    code.add('invokevirtual', 'java/lang/StringBuilder', 'append', '({})Ljava/lang/StringBuilder;'.format(STRING))
+    code.add_all(util.push_int(ord('\t')))
+    code.add('invokevirtual', 'java/lang/StringBuilder', 'append', '(C)Ljava/lang/StringBuilder;')
+    code.add('aload_3')
+    code.add('invokevirtual', 'java/io/ByteArrayOutputStream', 'size', '()I')
+    code.add('invokevirtual', 'java/lang/StringBuilder', 'append', '(I)Ljava/lang/StringBuilder;')
+    code.add('invokevirtual', 'java/lang/StringBuilder', 'toString', '()' + STRING)
+    code.add('invokevirtual', 'java/io/PrintStream', 'println', '({})V'.format(STRING))
+    code.add('aload_3')
+    code.add('aload_2')
+    code.add('invokevirtual', 'java/io/ByteArrayOutputStream', 'writeTo', '(Ljava/io/OutputStream;)V')
+    code.add('aload_2')
+    code.add('invokevirtual', 'java/io/PrintStream', 'flush', '()V')
+    code.add('goto', request)
+
+    code.place(done)
+    code.add('return')
+
+    return classdef
+
+
+class RunError(Exception):
+    """Raised for a module that threw, or that the JVM died running, with what it printed first."""
+
+    def __init__(self, module, output):
+        super().__init__('{} failed:\n{}'.format(module, output))
+        self.module = module
+        self.output = output
+
+
+def compile_isolated(module, scope, root):
+    """Emits *module*, built in *scope*, into a new directory of its own below *root*, and returns the directory.
+    The backend of *scope* is pointed at the directory. Any Jasmin source it writes is assembled in process, so
+    the directory is ready to run without starting Jasmin's JVM."""
+    os.makedirs(root, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix=module.id.value + '-', dir=root)
+    scope.backend.directory = directory
+    module.emit(scope)
+
+    for path in glob.glob(os.path.join(directory, '*.j')):
+        with open(path, encoding='utf-8') as infile:
+            name, data = classfile.assemble(infile.read())
+        with open(os.path.join(directory, name + '.class'), 'wb') as outfile:
+            outfile.write(data)
+    return directory
+
+
+class BatchRunner:
+    """Runs compiled modules in one long-lived JVM, rather than starting a JVM for each, and passes back what
+    each printed. The JVM is started by the first run, and started again if it dies.
+
+    The runner class is written to *directory*, or to a temporary directory removed again by close(). A runner
+    is used from one thread at a time; a process that runs modules in parallel, such as a pytest-xdist worker,
+    has a runner of its own.
+
+    A module that takes longer than *timeout* seconds fails, and the JVM running it is killed, so the next
+    module is run in a new one. None lets modules run for as long as they take."""
+
+    def __init__(self, directory=None, java='java', timeout=60):
+        self._temporary = tempfile.TemporaryDirectory(prefix='funrunner-') if directory is None else None
+        self.directory = directory if directory is not None else self._temporary.name
+        self.java = java
+        self.timeout = timeout
+        self.runs = 0
+        self._process = None
+        ClassFileBackend(self.directory).write(runner_class())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self):
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen([self.java, '-cp', self.directory, RUNNER],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._process
+
+    @staticmethod
+    def _request(module, classpath):
+        entries = classpath.split(os.pathsep) if isinstance(classpath, str) else classpath
+        return '{}\t{}\n'.format(os.pathsep.join(os.path.abspath(entry) for entry in entries), module)
+
+    def _result(self, process, module):
+        """Reads the result of running *module*, returning (whether it succeeded, what it printed)."""
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        # Killing the JVM ends the read, as its output is then closed.
+        timer = threading.Timer(self.timeout, kill) if self.timeout is not None else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            header = process.stdout.readline()
+            if header:
+                status, size = header.decode('utf-8').split('\t')
+                output = process.stdout.read(int(size))
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out.is_set():
+            # Even where the result came in just in time, the JVM is gone.
+            process.wait()
+        if not header or len(output) < int(size):
+            process.wait()
+            if timed_out.is_set():
+                return False, '{} timed out after {} s'.format(module, self.timeout)
+            return False, 'The JVM exited with status {}'.format(process.returncode)
+        self.runs += 1
+        return status == 'ok', output.decode('utf-8')
+
+    def run(self, module, classpath):
+        """Runs the main class *module*, found on *classpath*: a directory or jar, a list of them, or a string of
+        them joined by os.pathsep. Returns what it printed, or raises RunError."""
+        process = self._start()
+        process.stdin.write(self._request(module, classpath).encode('utf-8'))
+        process.stdin.flush()
+        ok, output = self._result(process, module)
+        if not ok:
+            raise RunError(module, output)
+        return output
+
+    def run_all(self, modules):
+        """Runs each (module, classpath) of *modules* in turn, yielding (module, whether it succeeded, what it
+        printed) as soon as each has finished. Requests are sent on a thread of their own while the results are
+        read, so the JVM never waits for the next one."""
+        modules = list(modules)
+        process = self._start()
+
+        def send():
+            try:
+                for module, classpath in modules:
+                    process.stdin.write(self._request(module, classpath).encode('utf-8'))
+                    process.stdin.flush()
+            except BrokenPipeError:
+                pass
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        answered = 0
+        try:
+            for module, _ in modules:
+                ok, output = self._result(process, module)
+                answered += 1
+                yield module, ok, output
+                if process.poll() is not None:
+                    # The modules after the one the JVM died running are run again in a new one.
+                    yield from self.run_all(modules[answered:])
+                    return
+        finally:
+            if answered < len(modules) and process.poll() is None:
+                # Stopped early, so the results still to come would be read as those of the next run.
+                process.kill()
+                process.wait()
+            sender.join()
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+        if self._temporary is not None:
+            self._temporary.cleanup()
+            self._temporary = None
@@ -0,0 +1,231 @@
+import collections
+
+from funcompiler import funtype
+
+
+class TypeVariable:
+    """A node in a union-find forest of types. The root of each tree stands for the type of all of its nodes: it
+    is either still unknown, or bound to a funtype class with a type variable for each type inside it."""
+    __slots__ = ('parent', 'rank', 'constructor', 'args', 'name', 'default')
+
+    def __init__(self, constructor=None, args=(), name=None, default=None):
+        self.parent = self
+        self.rank = 0
+        self.constructor = constructor
+        self.args = args
+        self.name = name  # The identifier of a Data type.
+        self.default = default  # The type to use if nothing else is known, as numeric operands are Doubles.
+
+    def find(self):
+        root = self
+        while root.parent is not root:
+            root = root.parent
+
+        # Path compression, so that later finds are near constant time.
+        node = self
+        while node.parent is not root:
+            node.parent, node = root, node.parent
+
+        return root
+
+
+class TypeTable:
+    """The type of each expression node, keyed by identity. Inference fills it in once, so that looking up a
+    node's type doesn't have to work it out again from its children. Each node is kept alongside its type, so
+    its id can't be reused while it is in the table."""
+    __slots__ = ('_types',)
+
+    def __init__(self):
+        self._types = {}
+
+    def get(self, node):
+        entry = self._types.get(id(node))
+        return entry[1] if entry is not None else None
+
+    def __setitem__(self, node, typ):
+        self._types[id(node)] = (node, typ)
+
+    def __len__(self):
+        return len(self._types)
+
+    def __getstate__(self):
+        # Ids aren't kept by pickling, so the table is rebuilt from the nodes themselves.
+        return list(self._types.values())
+
+    def __setstate__(self, entries):
+        self._types = {id(node): (node, typ) for node, typ in entries}
+
+
+class Inference:
+    """Infers the types in an expression. Each node adds its constraints, equations between type variables, to a
+    worklist as it is visited. They are then solved in a single pass, unifying the variables' trees."""
+
+    def __init__(self, lenient=False):
+        # Parameters, and anything else bound while inferring, by identifier.
+        self.env = {}
+        # The number of constraints solved so far.
+        self.constraints = 0
+        # Whether an argument that doesn't match the parameter of the declared function it is passed to is let
+        # through, and kept in mismatches as the (parameter, argument) types, rather than failing.
+        self.lenient = lenient
+        self.mismatches = []
+        self._worklist = collections.deque()
+        self._arguments = []
+        self._nodes = {}
+        self._generics = {}
+        # Types without parameters are immutable, so one instance of each is shared.
+        self._constants = {}
+
+    def variable(self, default=None):
+        return TypeVariable(default=default)
+
+    def arrow(self, param, result):
+        """A function from *param* to *result*. Functions of several parameters are curried into chains of these."""
+        return TypeVariable(funtype.Function, (param, result))
+
+    def list(self, inner):
+        return TypeVariable(funtype.List, (inner,))
+
+    def instantiate(self, typ, generics=None):
+        """Returns a type variable for the funtype *typ*. Each GenericType in it becomes a fresh variable,
+        shared with other occurrences of the same GenericType in *generics*."""
+        if generics is None:
+            generics = {}
+
+        if isinstance(typ, funtype.GenericType):
+            if typ.num not in generics:
+                generics[typ.num] = self.variable()
+            return generics[typ.num]
+        elif isinstance(typ, funtype.Function):
+            *params, result = typ.progression
+            var = self.instantiate(result, generics)
+            for param in reversed(params):
+                var = self.arrow(self.instantiate(param, generics), var)
+            return var
+        elif isinstance(typ, funtype.List):
+            return self.list(self.instantiate(typ.inner_type, generics))
+        elif isinstance(typ, funtype.Data):
+            return TypeVariable(funtype.Data, name=typ.identifier)
+        return TypeVariable(type(typ))
+
+    def equate(self, var1, var2):
+        self._worklist.append((var1, var2))
+
+    def equate_argument(self, param, arg):
+        """Equates the type of an argument with that of the declared parameter it is passed as. When lenient,
+        this is only done once everything else is solved, and only if they can be unified."""
+        if self.lenient:
+            self._arguments.append((param, arg))
+        else:
+            self.equate(param, arg)
+
+    def record(self, node, var):
+        """Remembers that *var* is the type of *node*, and returns it."""
+        self._nodes[id(node)] = (node, var)
+        return var
+
+    def solve(self):
+        self._solve()
+        for param, arg in self._arguments:
+            if self._unifiable(param.find(), arg.find()):
+                self.equate(param, arg)
+                self._solve()
+            else:
+                self.mismatches.append((self.resolve(param), self.resolve(arg)))
+        self._arguments.clear()
+
+    def _solve(self):
+        worklist = self._worklist
+        while worklist:
+            var1, var2 = worklist.popleft()
+            self.constraints += 1
+            self._unify(var1.find(), var2.find())
+
+    def _unifiable(self, root1, root2):
+        """Whether the types of *root1* and *root2* have the same shape wherever both are known."""
+        if root1 is root2 or root1.constructor is None or root2.constructor is None:
+            return True
+        if root1.constructor is not root2.constructor or root1.name != root2.name:
+            return False
+        return all(self._unifiable(arg1.find(), arg2.find()) for arg1, arg2 in zip(root1.args, root2.args))
+
+    def _unify(self, root1, root2):
+        if root1 is root2:
+            return
+
+        if root1.constructor is not None and root2.constructor is not None:
+            if root1.constructor is not root2.constructor or root1.name != root2.name:
+                self._mismatch(root1, root2)
+
+            for arg1, arg2 in zip(root1.args, root2.args):
+                self._worklist.append((arg1, arg2))
+        elif self._occurs(root1, root2) or self._occurs(root2, root1):
+            # A type containing itself, such as that of x in x x, would have no end.
+            self._mismatch(root1, root2)
+
+        # Union by rank, keeping the trees shallow.
+        if root1.rank < root2.rank:
+            root1, root2 = root2, root1
+        root2.parent = root1
+        if root1.rank == root2.rank:
+            root1.rank += 1
+
+        if root1.default is None:
+            root1.default = root2.default
+        if root1.constructor is None:
+            root1.constructor, root1.args, root1.name = root2.constructor, root2.args, root2.name
+
+    def _occurs(self, root, var):
+        """Whether the unknown type *root* appears inside the type of *var*."""
+        if root.constructor is not None:
+            return False
+        stack = list(var.find().args)
+        while stack:
+            inner = stack.pop().find()
+            if inner is root:
+                return True
+            stack.extend(inner.args)
+        return False
+
+    def _mismatch(self, root1, root2):
+        # Imported here, as the scope keeps a TypeTable from this module.
+        from funcompiler.funast import CompileError
+        raise CompileError('Cannot unify {} with {}'.format(self.resolve(root1), self.resolve(root2)))
+
+    def resolve(self, var):
+        """The funtype that *var* has been inferred to be. Variables that are still unknown become GenericTypes,
+        numbered in the order they are first resolved."""
+        root = var.find()
+
+        if root.constructor is None:
+            if root.default is not None:
+                return root.default()
+            if root not in self._generics:
+                self._generics[root] = funtype.GenericType(len(self._generics))
+            return self._generics[root]
+        elif root.constructor is funtype.Function:
+            params = []
+            while root.constructor is funtype.Function:
+                param, result = root.args
+                params.append(self.resolve(param))
+                root = result.find()
+            return funtype.Function(params, self.resolve(root))
+        elif root.constructor is funtype.List:
+            return funtype.List(self.resolve(root.args[0]))
+        elif root.constructor is funtype.Data:
+            return funtype.Data(root.name)
+
+        if root.constructor not in self._constants:
+            self._constants[root.constructor] = root.constructor()
+        return self._constants[root.constructor]
+
+    def annotate(self, table):
+        """Stores the resolved type of every node seen in the TypeTable *table*."""
+        for node, var in self._nodes.values():
+            table[node] = self.resolve(var)
+
+    def __getitem__(self, node):
+        return self.resolve(self._nodes[id(node)][1])
+
+    def __contains__(self, node):
+        return id(node) in self._nodes
@@ -0,0 +1,86 @@
+import collections
+import re
+
+# A token's kind is 'int', 'double', 'char', 'name' for identifiers starting with a lower case letter, or 'Name'
+# for those starting with an upper case one. Keywords and symbols are their own kind. *offset* is where the token
+# starts in the source, for error messages.
+Token = collections.namedtuple('Token', ('kind', 'value', 'offset'))
+
+KEYWORDS = frozenset(('module', 'where', 'data', 'not', 'ord', 'chr', 'True', 'False'))
+
+# The pattern matching each kind of token, tried in order. Longer symbols come before their prefixes. Anything
+# else is an error.
+LEXEMES = (
+    ('double', rb'[0-9]+\.[0-9]+(?:[eE][+-]?[0-9]+)?'),
+    ('int', rb'[0-9]+'),
+    ('char', rb"'(?:\\.|[^\\'])'"),
+    ('name', rb'[A-Za-z][A-Za-z0-9_]*'),
+    ('symbol', rb'::|->|==|<=|[=<+\-*/()\[\]{},;|]'),
+    ('error', rb'.')
+)
+
+# Each match is one token, along with any space and comments before it. At the end of the source only the space
+# matches, and no group does.
+_lexeme = re.compile(rb'(?:\s+|--[^\n]*)*(?:' + b'|'.join(
+    b'(?P<' + kind.encode('ascii') + b'>' + pattern + b')' for kind, pattern in LEXEMES) + b')?', re.DOTALL)
+
+_escapes = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', "'": "'"}
+
+# Tokens are made directly as tuples, skipping the slower namedtuple constructor.
+_new_token = tuple.__new__
+
+
+class LexError(Exception):
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def _char(text):
+    value = text[1:-1].decode('ascii')
+    if value[0] == '\\':
+        if value[1] not in _escapes:
+            raise ValueError(value)
+        return _escapes[value[1]]
+    return value
+
+
+def tokenize(source):
+    """Yields the tokens of *source*, a bytes-like object such as an mmap, then a final token of kind 'end'. The
+    source is scanned once, with a single pattern matching every kind of token, and only the text of the token
+    being made is copied out of it."""
+    # The (kind, value) of each name and symbol, as they are decoded, so that a name used again is looked up
+    # rather than decoded again.
+    words = {}
+    for lexeme in _lexeme.finditer(source):
+        group = lexeme.lastgroup
+        if group is None:
+            break
+        text = lexeme.group(group)
+        offset = lexeme.start(group)
+
+        if group == 'name' or group == 'symbol':
+            word = words.get(text)
+            if word is None:
+                value = text.decode('ascii')
+                if group == 'symbol' or value in KEYWORDS:
+                    word = (value, value)
+                else:
+                    word = ('Name' if value[0].isupper() else 'name', value)
+                words[text] = word
+            kind, value = word
+        elif group == 'int':
+            kind, value = group, int(text)
+        elif group == 'double':
+            kind, value = group, float(text)
+        elif group == 'char':
+            try:
+                kind, value = group, _char(text)
+            except (UnicodeDecodeError, ValueError):
+                raise LexError('Invalid character literal {!r}'.format(text), offset)
+        else:
+            raise LexError('Unexpected character {!r}'.format(text), offset)
+
+        yield _new_token(Token, (kind, value, offset))
+
+    yield Token('end', None, len(source))
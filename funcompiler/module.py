@@ -1,11 +1,12 @@
+import functools
+
 from funcompiler.funast import ASTNode, Scope
 from funcompiler.childcount import Exactly, GreaterOrEqual
 from funcompiler.expression import Expr, Identifier
-from funcompiler.declaration import Declaration
-from funcompiler import util
-from funcompiler import funtype
-
-from itertools import product
+from funcompiler.declaration import Declaration, FunctionDeclaration, function_table, table_name
+from funcompiler.bytecode import ClassDef
+from funcompiler.cse import CommonSubexpressions
+from funcompiler.funtype import Function
 
 class Module(ASTNode):
     required_children = {
@@ -14,58 +15,59 @@ class Module(ASTNode):
         'decls': (GreaterOrEqual(0), Declaration)
     }
 
-    def _emit_target(self):
-        return '{}.j'.format(self.id.value)
-
-    def _emit(self, scope):
-        return_str = """
-        .class public {name}
-        .super java/lang/Object
-
-        .method public static module()Ljava/lang/Object;
-            {decls}
-            {expr}
-            areturn
-            .limit stack {stacklimit}
-        .end method
+    def _emit(self, scope, code):
+        classdef = ClassDef(self.id.value)
+        scope.start_module(classdef)
 
-        .method public static main([Ljava/lang/String;)V
-            getstatic java/lang/System/out Ljava/io/PrintStream;
-            invokestatic {name}.module()Ljava/lang/Object;
-            invokevirtual java/io/PrintStream/println(Ljava/lang/Object;)V
-            .limit stack 2
-            return
-        .end method
-        """
+        functions = [decl for decl in self.decls if isinstance(decl, FunctionDeclaration) and decl.params]
+        if not scope.function_classes:
+            # Saturated calls go to the static methods of this class, including calls to functions declared later.
+            for decl in functions:
+                decl._add_static(scope)
+        for decl in self.decls:
+            if isinstance(decl, FunctionDeclaration) and not decl.params:
+                decl._add_field(scope, classdef)
 
-        decls = '\n'.join(map(lambda x: x.emit(scope), self.decls))
-        expr = self.expr.emit(scope)
+        module = classdef.add_method(('public', 'static'), 'module', '()Ljava/lang/Object;')
+        for decl in self.decls:
+            decl.emit(scope, module.code)
 
-        stacklimit = scope.get_reset_stack()
-        
-        return return_str.format(name=self.id.value, conversion=util.integer_to_int(), decls=decls, expr=expr, stacklimit=stacklimit)
+        expr = self.expr
+        if scope.folder is not None:
+            expr = scope.folder.fold(expr, scope)
+        # Arguments that don't match the declared types of the function they are passed to have never been
+        # rejected here, so those are still compiled, as the types they have. Any other type error is reported.
+        Function.infer_types([], expr, scope, lenient=True)
+        expr_scope = scope.child()
+        expr_scope.common = CommonSubexpressions(expr, 0)
+        expr.emit(expr_scope, module.code)
+        module.code.add('areturn')
 
-    def emit(self, scope=Scope()):
-        super().emit(scope)
+        scope.finish_class()
+        if not scope.function_classes and functions:
+            dependencies = [self.id.value, *(repr(scope.get_static_function(decl.id.value)) for decl in functions)]
+            scope.write_class(table_name(self.id.value), dependencies,
+                              functools.partial(function_table, scope, self.id.value, functions))
+        if scope.executor is not None:
+            scope.write_pending()
 
-        abstract_fn_decl = """
-        .class public abstract AbstractFunction
-        .super java/lang/Object
-        .field protected param_number I
-        .field protected remaining_params I = 1
+        main = classdef.add_method(('public', 'static'), 'main', '([Ljava/lang/String;)V')
+        main.code.add('getstatic', 'java/lang/System', 'out', 'Ljava/io/PrintStream;')
+        main.code.add('invokestatic', self.id.value, 'module', '()Ljava/lang/Object;')
+        main.code.add('invokevirtual', 'java/io/PrintStream', 'println', '(Ljava/lang/Object;)V')
+        main.code.add('return')
 
-        .method public <init>()V
-            aload_0
-            invokenonvirtual java/lang/Object/<init>()V
-            return
-        .end method
-        
-        .method public abstract apply(Ljava/lang/Object;)Ljava/lang/Object;
-        .end method
-        """
+        scope.backend.write(classdef)
 
-        with open('AbstractFunction.j', 'w') as abstract_fn_file:
-            abstract_fn_file.write(abstract_fn_decl)
+    def emit(self, scope=None):
+        # Each module gets a fresh scope by default; a scope is filled in as the module is emitted, so sharing one
+        # would carry one module's identifiers and classes over into the next.
+        if scope is None:
+            scope = Scope()
+        scope.backend.start(self.id.value)
+        super().emit(scope, None)
+        scope.backend.write_runtime()
+        scope.backend.finish()
 
     def get_type(self):
         return self.expr.get_type()
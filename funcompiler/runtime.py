@@ -0,0 +1,338 @@
+from funcompiler.bytecode import ClassDef, Label
+from funcompiler import funtype
+from funcompiler import util
+
+# Functions can be applied to up to this many arguments in one call, through apply(Object, ...). Longer
+# applications are split into several calls.
+MAX_APPLY_ARGS = 4
+
+OBJECT = 'Ljava/lang/Object;'
+ENTER_DESCRIPTOR = '([Ljava/lang/Object;)Ljava/lang/Object;'
+
+# Lists of primitives are kept in an array of them. For each element type, the class holding the list, the
+# element's descriptor and the array type given to newarray.
+PRIMITIVE_LISTS = {
+    funtype.Int: ('IntList', 'I', 'int'),
+    funtype.Double: ('DoubleList', 'D', 'double'),
+    funtype.Char: ('CharList', 'C', 'char'),
+    funtype.Bool: ('BoolList', 'Z', 'boolean')
+}
+
+# Any other list is a chain of these cells, ending in null.
+CONS = 'Cons'
+CONS_INIT_DESCRIPTOR = '(LCons;Ljava/lang/Object;)V'
+
+
+def apply_descriptor(count):
+    """The descriptor of the apply() method taking *count* arguments."""
+    return '({}){}'.format(OBJECT * count, OBJECT)
+
+
+def _load_args(code, count, first=1):
+    for i in range(first, first + count):
+        code.add_all(util.load(OBJECT, i))
+
+
+def _new_array(code, count, first=1):
+    """Pushes a new Object[] holding the *count* arguments starting at local *first*."""
+    code.add_all(util.push_int(count))
+    code.add('anewarray', 'java/lang/Object')
+    for i in range(count):
+        code.add('dup')
+        code.add_all(util.push_int(i))
+        code.add_all(util.load(OBJECT, first + i))
+        code.add('aastore')
+
+
+def _apply(classdef, count):
+    """Applies the function to *count* arguments, whatever its arity. Exact calls enter the function, calls with
+    too few arguments build a partial application, and calls with too many apply the result to the rest."""
+    code = classdef.add_method(('public',), 'apply', apply_descriptor(count)).code
+
+    labels = [Label() for arity in range(count)]
+    partial = Label()
+
+    code.add('aload_0')
+    code.add('getfield', 'AbstractFunction', 'arity', 'I')
+    code.add('tableswitch', 1, count, tuple(labels), partial)
+
+    for arity, label in enumerate(labels[:-1], 1):
+        code.place(label)
+        code.add('aload_0')
+        _load_args(code, arity)
+        code.add('invokevirtual', 'AbstractFunction', 'apply', apply_descriptor(arity))
+        code.add('checkcast', 'AbstractFunction')
+        _load_args(code, count - arity, arity + 1)
+        code.add('invokevirtual', 'AbstractFunction', 'apply', apply_descriptor(count - arity))
+        code.add('areturn')
+
+    code.place(labels[-1])
+    code.add('aload_0')
+    _new_array(code, count)
+    code.add('invokevirtual', 'AbstractFunction', 'enter', ENTER_DESCRIPTOR)
+    code.add('areturn')
+
+    code.place(partial)
+    code.add('new', 'PartialApplication')
+    code.add('dup')
+    code.add('aload_0')
+    _new_array(code, count)
+    code.add('invokespecial', 'PartialApplication', '<init>', '(LAbstractFunction;[Ljava/lang/Object;)V')
+    code.add('areturn')
+
+
+def abstract_function():
+    """The base class of every function value. Each has an arity, the number of arguments it still needs, and is
+    entered with exactly that many in an array. Subclasses override the apply() taking their arity to skip the
+    array."""
+    classdef = ClassDef('AbstractFunction', access=('public', 'abstract'))
+    classdef.add_field(('protected',), 'arity', 'I')
+
+    init = classdef.add_method(('public',), '<init>', '(I)V')
+    init.code.add('aload_0')
+    init.code.add('invokenonvirtual', 'java/lang/Object', '<init>', '()V')
+    init.code.add('aload_0')
+    init.code.add('iload_1')
+    init.code.add('putfield', 'AbstractFunction', 'arity', 'I')
+    init.code.add('return')
+
+    classdef.add_method(('public', 'abstract'), 'enter', ENTER_DESCRIPTOR)
+
+    for count in range(1, MAX_APPLY_ARGS + 1):
+        _apply(classdef, count)
+
+    return classdef
+
+
+def partial_application():
+    """A function applied to fewer arguments than it needs. It keeps the function and the arguments bound so
+    far, and only copies them out once the rest arrive."""
+    classdef = ClassDef('PartialApplication', 'AbstractFunction')
+    classdef.add_field(('private',), 'function', 'LAbstractFunction;')
+    classdef.add_field(('private',), 'bound', '[Ljava/lang/Object;')
+
+    init = classdef.add_method(('public',), '<init>', '(LAbstractFunction;[Ljava/lang/Object;)V')
+    code = init.code
+    code.add('aload_0')
+    code.add('aload_1')
+    code.add('getfield', 'AbstractFunction', 'arity', 'I')
+    code.add('aload_2')
+    code.add('arraylength')
+    code.add('isub')
+    code.add('invokenonvirtual', 'AbstractFunction', '<init>', '(I)V')
+    code.add('aload_0')
+    code.add('aload_1')
+    code.add('putfield', 'PartialApplication', 'function', 'LAbstractFunction;')
+    code.add('aload_0')
+    code.add('aload_2')
+    code.add('putfield', 'PartialApplication', 'bound', '[Ljava/lang/Object;')
+    code.add('return')
+
+    # Enter the function with the bound arguments followed by the new ones.
+    code = classdef.add_method(('public',), 'enter', ENTER_DESCRIPTOR).code
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'function', 'LAbstractFunction;')
+    code.add('getfield', 'AbstractFunction', 'arity', 'I')
+    code.add('anewarray', 'java/lang/Object')
+    code.add('astore_2')
+
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'bound', '[Ljava/lang/Object;')
+    code.add('iconst_0')
+    code.add('aload_2')
+    code.add('iconst_0')
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'bound', '[Ljava/lang/Object;')
+    code.add('arraylength')
+    code.add('invokestatic', 'java/lang/System', 'arraycopy', '(Ljava/lang/Object;ILjava/lang/Object;II)V')
+
+    code.add('aload_1')
+    code.add('iconst_0')
+    code.add('aload_2')
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'bound', '[Ljava/lang/Object;')
+    code.add('arraylength')
+    code.add('aload_1')
+    code.add('arraylength')
+    code.add('invokestatic', 'java/lang/System', 'arraycopy', '(Ljava/lang/Object;ILjava/lang/Object;II)V')
+
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'function', 'LAbstractFunction;')
+    code.add('aload_2')
+    code.add('invokevirtual', 'AbstractFunction', 'enter', ENTER_DESCRIPTOR)
+    code.add('areturn')
+
+    # The function's own description, followed by "(argument) " for each bound argument.
+    code = classdef.add_method(('public',), 'toString', '()Ljava/lang/String;').code
+    loop, done = Label(), Label()
+
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'function', 'LAbstractFunction;')
+    code.add('invokevirtual', 'java/lang/Object', 'toString', '()Ljava/lang/String;')
+    code.add('new', 'java/lang/StringBuilder')
+    code.add('dup')
+    code.add('invokespecial', 'java/lang/StringBuilder', '<init>', '()V')
+    code.add('astore_1')
+    code.add_all(util.add_to_stringbuilder())
+
+    code.add('iconst_0')
+    code.add('istore_2')
+    code.place(loop)
+    code.add('iload_2')
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'bound', '[Ljava/lang/Object;')
+    code.add('arraylength')
+    code.add('if_icmpge', done)
+
+    code.add('ldc', '(')
+    code.add_all(util.add_to_stringbuilder())
+    code.add('aload_0')
+    code.add('getfield', 'PartialApplication', 'bound', '[Ljava/lang/Object;')
+    code.add('iload_2')
+    code.add('aaload')
+    code.add('invokevirtual', 'java/lang/Object', 'toString', '()Ljava/lang/String;')
+    code.add_all(util.add_to_stringbuilder())
+    code.add('ldc', ') ')
+    code.add_all(util.add_to_stringbuilder())
+    code.add('iinc', 2, 1)
+    code.add('goto', loop)
+
+    code.place(done)
+    code.add('aload_1')
+    code.add('invokevirtual', 'java/lang/Object', 'toString', '()Ljava/lang/String;')
+    code.add('areturn')
+
+    return classdef
+
+
+
+def _append(code, descriptor):
+    """Appends the value of type *descriptor* on top of the stack to the StringBuilder under it."""
+    code.add('invokevirtual', 'java/lang/StringBuilder', 'append', '({})Ljava/lang/StringBuilder;'.format(descriptor))
+
+
+def _start_list_string(code):
+    """Starts a toString() that lists the elements as "[a, b, c]", keeping the StringBuilder in local 1."""
+    code.add('new', 'java/lang/StringBuilder')
+    code.add('dup')
+    code.add('invokespecial', 'java/lang/StringBuilder', '<init>', '()V')
+    code.add('ldc', '[')
+    _append(code, 'Ljava/lang/String;')
+    code.add('astore_1')
+
+
+def _end_list_string(code):
+    code.add('aload_1')
+    code.add('ldc', ']')
+    _append(code, 'Ljava/lang/String;')
+    code.add('invokevirtual', 'java/lang/Object', 'toString', '()Ljava/lang/String;')
+    code.add('areturn')
+
+
+def primitive_list(typ):
+    """An immutable list of primitives of type *typ*, packed into an array."""
+    name, descriptor, array_type = PRIMITIVE_LISTS[type(typ)]
+    array = '[' + descriptor
+    classdef = ClassDef(name, access=('public', 'final'))
+    classdef.add_field(('private', 'final'), 'elements', array)
+
+    init = classdef.add_method(('public',), '<init>', '({})V'.format(array))
+    init.code.add('aload_0')
+    init.code.add('invokenonvirtual', 'java/lang/Object', '<init>', '()V')
+    init.code.add('aload_0')
+    init.code.add('aload_1')
+    init.code.add('putfield', name, 'elements', array)
+    init.code.add('return')
+
+    code = classdef.add_method(('public',), 'toString', '()Ljava/lang/String;').code
+    loop, first, done = Label(), Label(), Label()
+    _start_list_string(code)
+    code.add('iconst_0')
+    code.add('istore_2')
+
+    code.place(loop)
+    code.add('iload_2')
+    code.add('aload_0')
+    code.add('getfield', name, 'elements', array)
+    code.add('arraylength')
+    code.add('if_icmpge', done)
+
+    code.add('iload_2')
+    code.add('ifeq', first)
+    code.add('aload_1')
+    code.add('ldc', ', ')
+    _append(code, 'Ljava/lang/String;')
+    code.add('pop')
+    code.place(first)
+
+    code.add('aload_1')
+    code.add('aload_0')
+    code.add('getfield', name, 'elements', array)
+    code.add('iload_2')
+    code.add_all(util.array_load(descriptor))
+    _append(code, descriptor)
+    code.add('pop')
+    code.add('iinc', 2, 1)
+    code.add('goto', loop)
+
+    code.place(done)
+    _end_list_string(code)
+
+    return classdef
+
+
+def cons():
+    """An immutable list cell, holding one element and the rest of the list."""
+    classdef = ClassDef(CONS, access=('public', 'final'))
+    classdef.add_field(('private', 'final'), 'head', OBJECT)
+    classdef.add_field(('private', 'final'), 'tail', 'LCons;')
+
+    init = classdef.add_method(('public',), '<init>', CONS_INIT_DESCRIPTOR)
+    init.code.add('aload_0')
+    init.code.add('invokenonvirtual', 'java/lang/Object', '<init>', '()V')
+    init.code.add('aload_0')
+    init.code.add('aload_1')
+    init.code.add('putfield', CONS, 'tail', 'LCons;')
+    init.code.add('aload_0')
+    init.code.add('aload_2')
+    init.code.add('putfield', CONS, 'head', OBJECT)
+    init.code.add('return')
+
+    code = classdef.add_method(('public',), 'toString', '()Ljava/lang/String;').code
+    loop, first, done = Label(), Label(), Label()
+    _start_list_string(code)
+    code.add('aload_0')
+    code.add('astore_2')
+
+    code.place(loop)
+    code.add('aload_2')
+    code.add('ifnull', done)
+
+    code.add('aload_2')
+    code.add('aload_0')
+    code.add('if_acmpeq', first)
+    code.add('aload_1')
+    code.add('ldc', ', ')
+    _append(code, 'Ljava/lang/String;')
+    code.add('pop')
+    code.place(first)
+
+    code.add('aload_1')
+    code.add('aload_2')
+    code.add('getfield', CONS, 'head', OBJECT)
+    _append(code, OBJECT)
+    code.add('pop')
+    code.add('aload_2')
+    code.add('getfield', CONS, 'tail', 'LCons;')
+    code.add('astore_2')
+    code.add('goto', loop)
+
+    code.place(done)
+    _end_list_string(code)
+
+    return classdef
+
+
+def classes():
+    """Every class that generated code relies on, whatever the module."""
+    return [abstract_function(), partial_application(), *(primitive_list(typ()) for typ in PRIMITIVE_LISTS), cons()]
@@ -0,0 +1,10 @@
+import pytest
+
+from funcompiler.harness import BatchRunner
+
+
+@pytest.fixture(scope='session')
+def batch_runner(tmp_path_factory):
+    """The JVM that every test in this process runs modules in. Under pytest-xdist each worker has its own."""
+    with BatchRunner(str(tmp_path_factory.mktemp('runner'))) as runner:
+        yield runner
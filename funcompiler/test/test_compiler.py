@@ -1,31 +1,77 @@
-from funcompiler.funast import Scope
+from funcompiler.funast import Scope, CompileError
 from funcompiler.module import Module
 from funcompiler.expression import *
 from funcompiler.declaration import *
-
+from funcompiler.backend import Backend, ClassFileBackend, JarBackend, JasminBackend, runtime_jar
+from funcompiler.fold import ConstantFolder
+from funcompiler.cache import ClassCache
+from funcompiler.parser import Parser, ParseError
+from funcompiler.harness import BatchRunner, RunError, RUNNER, compile_isolated
+from funcompiler.evaluator import Evaluator, EvaluationError
+from funcompiler.bytecode import ClassDef, Code, Label
+from funcompiler import classfile, daemon, driver, frames, funtype, runtime
+
+import asyncio
+import concurrent.futures
+import glob
+import io
+import json
+import os
+import pytest
+import shutil
 import subprocess
+import threading
+import zipfile
+
+# Jasmin, which assembles the .j files written by default.
+JASMIN = os.environ.get("JASMIN_JAR", os.path.expanduser("~/jasmin-2.4/jasmin.jar"))
+
+# Set where Java and Jasmin are installed, as in CI, so that the tests needing them fail rather than skip.
+REQUIRE_JVM = bool(os.environ.get("FUNCOMPILER_REQUIRE_JVM"))
+
+def require(available, what):
+    """Skips the test unless *available*, or fails it if the tools are meant to be there."""
+    if not available:
+        (pytest.fail if REQUIRE_JVM else pytest.skip)("needs {}".format(what))
+
+# The JVM modules are run in, and the directory the test being run compiles into, set by _isolate().
+_runner = None
+_output = None
+
+@pytest.fixture(autouse=True)
+def _isolate(batch_runner, tmp_path):
+    global _runner, _output
+    _runner, _output = batch_runner, str(tmp_path / "modules")
+    yield
+    _output = None
 
-DELETE_ON_FAIL = False
+def run(module_name, classpath):
+    return _runner.run(module_name, classpath).strip()
 
-def run(module_name):
-    subprocess.run('java -jar jasmin.jar *.j', shell=True, check=True)
-    out = subprocess.check_output(['java', module_name])
+class CollectingBackend(Backend):
+    """Keeps the generated classes in memory, so the code can be inspected without a JVM."""
 
-    return out.decode('utf-8').strip()
+    def __init__(self):
+        super().__init__()
+        self.classes = {}
+
+    def write(self, classdef):
+        self.classes[classdef.name] = classdef
+
+    def write_runtime(self):
+        for classdef in runtime.classes():
+            self.write(classdef)
+
+def method_code(classdef, name):
+    return [item for method in classdef.methods if method.name == name for item in method.code]
 
 def check(module, expected_output, scope=None):
     """Checks the given Module AST against the expected output (converted to a string)."""
     if not scope:
         scope = Scope()
 
-    module.emit(scope)
-    try:
-        assert run(module.id.value).lower() == str(expected_output).lower()
-        subprocess.run('rm -f *.j *.class', shell=True)
-    except:
-        if DELETE_ON_FAIL:
-            subprocess.run('rm -f *.j *.class', shell=True)
-        raise
+    directory = compile_isolated(module, scope, _output)
+    assert run(module.id.value, directory).lower() == str(expected_output).lower()
 
 def test_int():
     # module IntTest = 42
@@ -587,3 +633,1039 @@ def test_data_inequality():
     )
 
     check(module, False, scope)
+
+def test_classfile_backend():
+    scope = Scope(backend=ClassFileBackend())
+
+    # module ClassFileTest = f 2 where { f x = x * 3 }
+    module = Module(
+            id=Identifier("ClassFileTest"),
+            expr=FunctionApplication(
+                func=Identifier("f"),
+                expr=Int(2)
+            ),
+            decls=[FunctionDeclaration(
+                scope,
+                id=Identifier("f"),
+                params=[Identifier("x")],
+                expr=BinaryOperator(
+                    expr1=Identifier("x"),
+                    op=Operator("*"),
+                    expr2=Int(3)
+                )
+            )]
+    )
+
+    check(module, 6, scope)
+
+def test_classfile_branches():
+    name, data = classfile.assemble("""
+    .class public Branches
+    .super java/lang/Object
+    .method public static f()I
+        .limit stack 1
+        iconst_0
+        ifeq done
+        iconst_1
+        ireturn
+        done:
+        iconst_2
+        ireturn
+    .end method
+    """)
+
+    assert name == 'Branches'
+    assert data[:4] == b'\xca\xfe\xba\xbe'
+    # iconst_0; ifeq +5; iconst_1; ireturn; iconst_2; ireturn
+    assert b'\x03\x99\x00\x05\x04\xac\x05\xac' in data
+
+def test_classfile_wide_branch():
+    name, data = classfile.assemble("""
+    .class public WideBranch
+    .super java/lang/Object
+    .method public static f()V
+        iconst_0
+        ifeq far
+        {}
+        far:
+        return
+    .end method
+    """.format('nop\n' * 40000))
+
+    # The conditional is inverted to hop over a goto_w that can reach the label.
+    assert b'\x03\x9a\x00\x08\xc8\x00\x00\x9c\x45' in data
+
+def test_code_fragment_labels():
+    fragment = Code()
+    label = Label()
+    fragment.add('goto', label)
+    fragment.place(label)
+
+    # Pasting the same fragment twice must not place the same label twice in one method.
+    code = Code()
+    code.extend(fragment)
+    code.extend(fragment)
+
+    first, second = code.items[1], code.items[3]
+    assert isinstance(first, Label) and isinstance(second, Label) and first is not second
+    assert code.items[0].operands[0] is first
+    assert code.items[2].operands[0] is second
+
+def test_unboxed_arithmetic():
+    # module UnboxedTest = (1 + 2) * (10 - 4) / 3
+    module = Module(
+            id=Identifier("UnboxedTest"),
+            expr=BinaryOperator(
+                expr1=BinaryOperator(
+                    expr1=BinaryOperator(expr1=Int(1), op=Operator("+"), expr2=Int(2)),
+                    op=Operator("*"),
+                    expr2=BinaryOperator(expr1=Int(10), op=Operator("-"), expr2=Int(4))
+                ),
+                op=Operator("/"),
+                expr2=Int(3)
+            )
+    )
+
+    backend = CollectingBackend()
+    module.emit(Scope(backend=backend, fold=False))
+
+    # The intermediate results stay as ints, and only the module's result is boxed.
+    code = method_code(backend.classes["UnboxedTest"], "module")
+    mnemonics = [item.mnemonic for item in code if not isinstance(item, Label)]
+    assert mnemonics.count("invokestatic") == 1
+    assert "checkcast" not in mnemonics
+
+    check(module, 6, Scope(fold=False))
+
+def test_static_call():
+    # module StaticCallTest = mul 2.0 5.0 + mul 1.0 3.0 where { mul x y = x * y }
+    def static_call_module(scope):
+        mul = lambda x, y: FunctionApplication(
+                func=FunctionApplication(func=Identifier("mul"), expr=Double(x)),
+                expr=Double(y)
+        )
+        return Module(
+                id=Identifier("StaticCallTest"),
+                expr=BinaryOperator(expr1=mul(2, 5), op=Operator("+"), expr2=mul(1, 3)),
+                decls=[FunctionDeclaration(
+                    scope,
+                    id=Identifier("mul"),
+                    params=[Identifier("x"), Identifier("y")],
+                    expr=BinaryOperator(expr1=Identifier("x"), op=Operator("*"), expr2=Identifier("y"))
+                )]
+        )
+
+    backend = CollectingBackend()
+    scope = Scope(backend=backend, fold=False)
+    static_call_module(scope).emit(scope)
+
+    # Saturated calls go straight to the static method, without building any function objects.
+    code = [item for item in method_code(backend.classes["StaticCallTest"], "module") if not isinstance(item, Label)]
+    assert [item.operands for item in code if item.mnemonic == "invokestatic"].count(
+            ("mulFunction", "invoke", "(DD)D")) == 2
+    assert "new" not in [item.mnemonic for item in code]
+
+    scope = Scope(fold=False)
+    check(static_call_module(scope), 13.0, scope)
+
+def test_function_entry_points():
+    # module EntryPointTest = mul 2.0 where { mul x y = x * y }
+    scope = Scope(backend=CollectingBackend())
+    module = Module(
+            id=Identifier("EntryPointTest"),
+            expr=FunctionApplication(func=Identifier("mul"), expr=Double(2)),
+            decls=[FunctionDeclaration(
+                scope,
+                id=Identifier("mul"),
+                params=[Identifier("x"), Identifier("y")],
+                expr=BinaryOperator(expr1=Identifier("x"), op=Operator("*"), expr2=Identifier("y"))
+            )]
+    )
+    module.emit(scope)
+    classes = scope.backend.classes
+
+    # Generic applications dispatch on the arity with a single tableswitch...
+    apply = [item.mnemonic for item in method_code(classes["AbstractFunction"], "apply") if not isinstance(item, Label)]
+    assert "tableswitch" in apply and "if_icmpeq" not in apply
+
+    # ...and a function applied to exactly its arity goes straight to invoke(), without copying itself.
+    mul = classes["mulFunction"]
+    assert [method.descriptor for method in mul.methods if method.name == "apply"] == [
+            "(Ljava/lang/Object;Ljava/lang/Object;)Ljava/lang/Object;"]
+    assert "new" not in [item.mnemonic for item in method_code(mul, "apply") if not isinstance(item, Label)]
+
+def test_higher_order_function():
+    scope = Scope()
+
+    # module HigherOrderTest = increment (add 1.0) 2.0 where { increment adder x = adder x ; add x y = x + y }
+    module = Module(
+            id=Identifier("HigherOrderTest"),
+            expr=FunctionApplication(
+                func=FunctionApplication(
+                    func=Identifier("increment"),
+                    expr=FunctionApplication(func=Identifier("add"), expr=Double(1))
+                ),
+                expr=Double(2)
+            ),
+            decls=[
+                FunctionDeclaration(
+                    scope,
+                    id=Identifier("increment"),
+                    params=[Identifier("adder"), Identifier("x")],
+                    expr=FunctionApplication(func=Identifier("adder"), expr=Identifier("x"))
+                ),
+                FunctionDeclaration(
+                    scope,
+                    id=Identifier("add"),
+                    params=[Identifier("x"), Identifier("y")],
+                    expr=BinaryOperator(expr1=Identifier("x"), op=Operator("+"), expr2=Identifier("y"))
+                )
+            ]
+    )
+
+    assert str(scope.get_identifier_type("increment")) == "t0 -> t1 -> t0 -> t1"
+    assert str(scope.get_identifier_type("add")) == "Double -> Double -> Double"
+
+    check(module, 3.0, scope)
+
+def test_inference_constraints():
+    # sum x = x + 1 + 1 + ... + 1, with two hundred additions.
+    expr = Identifier("x")
+    for i in range(200):
+        expr = BinaryOperator(expr1=expr, op=Operator("+"), expr2=Int(1))
+
+    types = funtype.Function.infer_types([Identifier("x")], expr, Scope())
+
+    assert isinstance(types[expr], funtype.Int)
+    # Two constraints per addition, solved once each, rather than a pass over the whole body per change.
+    assert types.constraints == 400
+
+def test_infinite_types():
+    # f x = x x and g x = [x] == x would give x a type containing itself, which is reported as any other mismatch.
+    for source in ["module M = 1 where { f x = x x }", "module M = 1 where { g x = [x] == x }"]:
+        with pytest.raises(CompileError, match="Cannot unify"):
+            Parser(Scope()).parse(source)
+
+def test_type_annotations():
+    # module AnnotatedTest = 1 + 2 + ... + 200
+    nodes = [Int(1)]
+    for i in range(2, 201):
+        nodes.append(BinaryOperator(expr1=nodes[-1], op=Operator("+"), expr2=Int(i)))
+
+    scope = Scope(backend=CollectingBackend(), fold=False)
+    Module(id=Identifier("AnnotatedTest"), expr=nodes[-1]).emit(scope)
+
+    # Every node's type was stored by inference, so none of them had to be worked out from its children.
+    assert all(isinstance(scope.types.get(node), funtype.Int) for node in nodes)
+
+def test_module_type_errors():
+    # Arguments that don't match the declared function they are passed to are still compiled, as they always were...
+    scope = Scope(backend=CollectingBackend())
+    module = Parser(scope).parse("module Lenient = add 3 where { add x y = x + y }")
+    types = funtype.Function.infer_types([], module.expr, scope, lenient=True)
+    assert [(str(param), str(arg)) for param, arg in types.mismatches] == [("Double", "Int")]
+    module.emit(scope)
+
+    # ...but any other type error in the module's expression is reported, rather than failing at run time.
+    for source in ["module Strict = 1 + 'a'", "module Strict = [1, 'a']",
+                   "module Strict = not (add 1 2) where { add x y = x + y }"]:
+        scope = Scope(backend=CollectingBackend())
+        with pytest.raises(CompileError, match="Cannot unify"):
+            Parser(scope).parse(source).emit(scope)
+
+def test_child_scope():
+    scope = Scope()
+    first, second = Code(), Code()
+    scope.add_identifier("x", first)
+    scope.add_static_function("f", "fFunction", "invoke", "(I)I", 1)
+
+    child = scope.child()
+    child.add_identifier("x", second)
+    child.add_identifier("f", second)
+
+    # Bindings in the child hide those of its parent, which are left alone.
+    assert child.get_identifier("x") is second and scope.get_identifier("x") is first
+    assert child.get_static_function("f") is None and scope.get_static_function("f").arity == 1
+
+def test_frame_limits():
+    # module FrameTest = not (2.0 < 3.0)
+    module = Module(
+            id=Identifier("FrameTest"),
+            expr=UnaryOperator(
+                op=Operator("not"),
+                expr=BinaryOperator(expr1=Double(2), op=Operator("<"), expr2=Double(3))
+            )
+    )
+
+    backend = CollectingBackend()
+    module.emit(Scope(backend=backend, fold=False))
+
+    # The comparison works on the doubles themselves, so the deepest point is the two of them, two words each.
+    method = next(method for method in backend.classes["FrameTest"].methods if method.name == "module")
+    assert frames.max_stack(method) == 4
+    assert frames.max_locals(method) == 0
+
+def test_constant_folding():
+    # module FoldTest = (3 * 2 + ord 'a') * scale 4 where { scale x = x * ten; ten = 10 }
+    scope = Scope(backend=CollectingBackend())
+    module = Module(
+            id=Identifier("FoldTest"),
+            expr=BinaryOperator(
+                expr1=Grouping(expr=BinaryOperator(
+                    expr1=BinaryOperator(expr1=Int(3), op=Operator("*"), expr2=Int(2)),
+                    op=Operator("+"),
+                    expr2=UnaryOperator(op=Operator("ord"), expr=Char("a"))
+                )),
+                op=Operator("*"),
+                expr2=FunctionApplication(func=Identifier("scale"), expr=Int(4))
+            ),
+            decls=[
+                FunctionDeclaration(scope, id=Identifier("ten"), expr=Int(10)),
+                FunctionDeclaration(
+                    scope,
+                    id=Identifier("scale"),
+                    params=[Identifier("x")],
+                    expr=BinaryOperator(expr1=Identifier("x"), op=Operator("*"), expr2=Identifier("ten"))
+                )
+            ]
+    )
+    module.emit(scope)
+
+    # The whole expression, call included, is worked out at compile time into one constant.
+    classdef = scope.backend.classes["FoldTest"]
+    code = [item for item in method_code(classdef, "module") if not isinstance(item, Label)]
+    assert [item.mnemonic for item in code] == ["getstatic", "areturn"]
+    assert ("sipush", 4120) in [(item.mnemonic, *item.operands) for item in method_code(classdef, "<clinit>")]
+
+    # With too small a budget the call is left for run time, though its argument-free parts are still folded.
+    scope = Scope(backend=CollectingBackend(), fold=ConstantFolder(max_size=2))
+    module = Module(
+            id=Identifier("FoldTest"),
+            expr=FunctionApplication(func=Identifier("scale"), expr=Int(4)),
+            decls=[FunctionDeclaration(
+                scope,
+                id=Identifier("scale"),
+                params=[Identifier("x")],
+                expr=BinaryOperator(
+                    expr1=Identifier("x"),
+                    op=Operator("*"),
+                    expr2=BinaryOperator(expr1=Int(2), op=Operator("+"), expr2=Int(3))
+                )
+            )]
+    )
+    module.emit(scope)
+    code = [item for item in method_code(scope.backend.classes["FoldTest"], "module") if not isinstance(item, Label)]
+    assert ("scaleFunction", "invoke") in [item.operands[:2] for item in code]
+    assert "iadd" not in [item.mnemonic for item in method_code(scope.backend.classes["scaleFunction"], "invoke")]
+
+    # Folding gives the same results as the bytecode, including int overflow and truncating division.
+    check(Module(
+            id=Identifier("FoldOverflowTest"),
+            expr=BinaryOperator(
+                expr1=BinaryOperator(expr1=Int(2147483647), op=Operator("+"), expr2=Int(1)),
+                op=Operator("/"),
+                expr2=Int(-3)
+            )
+    ), 715827882)
+
+def test_constant_applicative_form():
+    # module CafTest = x + x where { x = 3 * 4 }
+    def caf_module(scope):
+        return Module(
+                id=Identifier("CafTest"),
+                expr=BinaryOperator(expr1=Identifier("x"), op=Operator("+"), expr2=Identifier("x")),
+                decls=[FunctionDeclaration(
+                    scope,
+                    id=Identifier("x"),
+                    expr=BinaryOperator(expr1=Int(3), op=Operator("*"), expr2=Int(4))
+                )]
+        )
+
+    # Folding would turn x into a constant, so it is kept as a computation here.
+    scope = Scope(backend=CollectingBackend(), fold=False)
+    caf_module(scope).emit(scope)
+    classdef = scope.backend.classes["CafTest"]
+
+    # x is worked out once, into a static field, and each reference calls its accessor instead of repeating it.
+    assert "x" in [field.name for field in classdef.fields]
+    # The accessor is synchronized, so the value is only worked out once even with threads.
+    assert [method.access for method in classdef.methods if method.name == "x$get"] == [
+            ("public", "static", "synchronized")]
+    assert "imul" in [item.mnemonic for item in method_code(classdef, "x$get") if not isinstance(item, Label)]
+    code = [item for item in method_code(classdef, "module") if not isinstance(item, Label)]
+    assert "imul" not in [item.mnemonic for item in code]
+    assert [item.operands for item in code if item.mnemonic == "invokestatic"].count(
+            ("CafTest", "x$get", "()Ljava/lang/Object;")) == 2
+
+    scope = Scope(fold=False)
+    check(caf_module(scope), 24, scope)
+
+    # Parameterless declarations can be used before they are declared, including by functions, and by themselves.
+    scope = Scope()
+    check(Parser(scope).parse("module CafForward = [f 1, [y]] where { f n = [n, x]; y = x; x = 2 }"), "[[1, 2], [2]]",
+          scope)
+    scope = Scope()
+    with pytest.raises(RunError) as error:
+        check(Parser(scope).parse("module CafLoop = h where { h = h }"), None, scope)
+    assert "StackOverflowError" in error.value.output
+
+def test_common_subexpressions():
+    # module CseTest = f 2.0 3.0 + f 2.0 3.0 where { f x y = (x * y) + (x * y) - y * x }
+    def product(a, b):
+        return BinaryOperator(expr1=Identifier(a), op=Operator("*"), expr2=Identifier(b))
+
+    def call():
+        return FunctionApplication(func=FunctionApplication(func=Identifier("f"), expr=Double(2)), expr=Double(3))
+
+    def cse_module(scope):
+        return Module(
+                id=Identifier("CseTest"),
+                expr=BinaryOperator(expr1=call(), op=Operator("+"), expr2=call()),
+                decls=[FunctionDeclaration(
+                    scope,
+                    id=Identifier("f"),
+                    params=[Identifier("x"), Identifier("y")],
+                    expr=BinaryOperator(
+                        expr1=BinaryOperator(
+                            expr1=Grouping(expr=product("x", "y")),
+                            op=Operator("+"),
+                            expr2=Grouping(expr=product("x", "y"))
+                        ),
+                        op=Operator("-"),
+                        expr2=product("y", "x")
+                    )
+                )]
+        )
+
+    # Equality is structural, keeps the order of children and tells different kinds of node apart.
+    assert product("x", "y") == product("x", "y")
+    assert product("x", "y") != product("y", "x")
+    assert Int(1) != Double(1) and Double(0.0) != Double(-0.0)
+    assert Char("x") != Identifier("x")
+
+    scope = Scope(backend=CollectingBackend(), fold=False)
+    cse_module(scope).emit(scope)
+
+    # x * y is worked out once and kept in a local, but y * x is a different expression.
+    invoke = [item.mnemonic for item in method_code(scope.backend.classes["fFunction"], "invoke")
+              if not isinstance(item, Label)]
+    assert invoke.count("dmul") == 2
+    assert "dstore" in invoke
+    module = [item.mnemonic for item in method_code(scope.backend.classes["CseTest"], "module")
+              if not isinstance(item, Label)]
+    assert module.count("invokestatic") == 2
+
+    scope = Scope(fold=False)
+    check(cse_module(scope), 12.0, scope)
+
+def test_comparison_branches():
+    # module BranchTest = not (2.0 < 3.0)
+    module = Module(
+            id=Identifier("BranchTest"),
+            expr=UnaryOperator(
+                op=Operator("not"),
+                expr=BinaryOperator(expr1=Double(2), op=Operator("<"), expr2=Double(3))
+            )
+    )
+    backend = CollectingBackend()
+    module.emit(Scope(backend=backend, fold=False))
+
+    # The doubles are compared directly, the not just turns the branch around, and only the result is boxed.
+    code = [item for item in method_code(backend.classes["BranchTest"], "module") if not isinstance(item, Label)]
+    mnemonics = [item.mnemonic for item in code]
+    assert mnemonics[:4] == ["ldc2_w", "ldc2_w", "dcmpg", "iflt"]
+    assert mnemonics.count("invokestatic") == 1
+    assert "invokevirtual" not in mnemonics
+
+    # Comparisons with NaN are false, as with Java's own comparison operators.
+    nan = lambda: BinaryOperator(expr1=Double(0), op=Operator("/"), expr2=Double(0))
+    check(Module(
+            id=Identifier("NaNTest"),
+            expr=BinaryOperator(expr1=nan(), op=Operator("=="), expr2=nan())
+    ), "false", Scope(fold=False))
+    check(Module(
+            id=Identifier("NaNTest"),
+            expr=UnaryOperator(
+                op=Operator("not"),
+                expr=BinaryOperator(expr1=nan(), op=Operator("<"), expr2=Double(1))
+            )
+    ), "true", Scope(fold=False))
+
+def test_data_singletons():
+    # module DataSingletonTest = Y == Y where { data T = X | Y; }
+    scope = Scope(backend=CollectingBackend())
+    module = Module(
+            id=Identifier("DataSingletonTest"),
+            expr=BinaryOperator(expr1=Constr(id=Identifier("Y")), op=Operator("=="), expr2=Constr(id=Identifier("Y"))),
+            decls=[DataTypeDeclaration(
+                scope,
+                id=Identifier("T"),
+                constrs=[Constr(id=Identifier("X")), Constr(id=Identifier("Y"))]
+            )]
+    )
+    module.emit(scope)
+
+    # Each constructor is a single instance of the data type's class, so equality is a reference comparison.
+    data = scope.backend.classes["TData"]
+    assert [field.name for field in data.fields] == ["tag", "name", "X", "Y"]
+    code = [item for item in method_code(scope.backend.classes["DataSingletonTest"], "module")
+            if not isinstance(item, Label)]
+    assert [item.operands for item in code if item.mnemonic == "getstatic"] == [("TData", "Y", "LTData;")] * 2
+    assert "if_acmpne" in [item.mnemonic for item in code]
+    assert "invokevirtual" not in [item.mnemonic for item in code]
+
+def test_list_representations():
+    # module ListRepresentationTest = [['a', 'b'], twice 'c'] where { pair x = [x, x + 1.0]; twice c = [c, c] }
+    def list_module(scope):
+        return Module(
+                id=Identifier("ListRepresentationTest"),
+                expr=Lists(exprs=[
+                    Lists(exprs=[Char("a"), Char("b")]),
+                    FunctionApplication(func=Identifier("twice"), expr=Char("c"))
+                ]),
+                decls=[FunctionDeclaration(
+                    scope,
+                    id=Identifier("pair"),
+                    params=[Identifier("x")],
+                    expr=Lists(exprs=[
+                        Identifier("x"),
+                        BinaryOperator(expr1=Identifier("x"), op=Operator("+"), expr2=Double(1))
+                    ])
+                ), FunctionDeclaration(
+                    scope,
+                    id=Identifier("twice"),
+                    params=[Identifier("c")],
+                    expr=Lists(exprs=[Identifier("c"), Identifier("c")])
+                )]
+        )
+
+    scope = Scope(backend=CollectingBackend())
+    list_module(scope).emit(scope)
+    classes = scope.backend.classes
+
+    # The constant list of chars is packed into a char[] once, in the module's static initializer...
+    module_class = classes["ListRepresentationTest"]
+    init = [item for item in method_code(module_class, "<clinit>") if not isinstance(item, Label)]
+    assert ("newarray", "char") in [(item.mnemonic, *item.operands) for item in init]
+
+    # ...the doubles built by pair are packed into a double[] each time it is called...
+    invoke = [item for item in method_code(classes["pairFunction"], "invoke") if not isinstance(item, Label)]
+    assert ("newarray", "double") in [(item.mnemonic, *item.operands) for item in invoke]
+    assert "invokestatic" not in [item.mnemonic for item in invoke]
+
+    # ...and the list of lists is a chain of cons cells.
+    module = [item for item in method_code(module_class, "module") if not isinstance(item, Label)]
+    assert [item.operands for item in module if item.mnemonic == "new"] == [("Cons",), ("Cons",)]
+
+    scope = Scope()
+    check(list_module(scope), "[[a, b], [c, c]]", scope)
+    scope = Scope()
+    check(Parser(scope).parse("module ListPairTest = pair 1.5 where { pair x = [x, x + 1.0] }"), "[1.5, 2.5]", scope)
+
+def test_hoisted_constants():
+    # module HoistTest = [add 1.0, add 1.0] where { add x y = x + y }
+    def hoist_module(scope):
+        add_one = lambda: FunctionApplication(func=Identifier("add"), expr=Double(1))
+        return Module(
+                id=Identifier("HoistTest"),
+                expr=Lists(exprs=[add_one(), add_one()]),
+                decls=[FunctionDeclaration(
+                    scope,
+                    id=Identifier("add"),
+                    params=[Identifier("x"), Identifier("y")],
+                    expr=BinaryOperator(expr1=Identifier("x"), op=Operator("+"), expr2=Identifier("y"))
+                )]
+        )
+
+    scope = Scope(backend=CollectingBackend())
+    hoist_module(scope).emit(scope)
+    classdef = scope.backend.classes["HoistTest"]
+
+    # The argument, the partial application and the list are each made once, when the class is loaded, and the
+    # module just loads the result. The function itself is made by its own class.
+    assert [item.mnemonic for item in method_code(classdef, "module") if not isinstance(item, Label)] == [
+            "getstatic", "areturn"]
+    init = [item for item in method_code(classdef, "<clinit>") if not isinstance(item, Label)]
+    assert [item.operands for item in init if item.mnemonic == "new"] == [("Cons",), ("Cons",)]
+    assert ("addFunction", "INSTANCE", "LaddFunction;") in [item.operands for item in init]
+    assert [item.mnemonic for item in init].count("invokevirtual") == 1
+    assert len(classdef.fields) == 3
+
+    scope = Scope()
+    check(hoist_module(scope),
+          "[addFunction with bound parameters: (1.0) , addFunction with bound parameters: (1.0) ]", scope)
+
+def test_class_cache(tmp_path, monkeypatch):
+    # module CacheTest = twice 3 where { twice x = add x x; add x y = x + <n> }
+    def cache_module(scope, n):
+        return Module(
+                id=Identifier("CacheTest"),
+                expr=FunctionApplication(func=Identifier("twice"), expr=Int(3)),
+                decls=[
+                    FunctionDeclaration(
+                        scope,
+                        id=Identifier("add"),
+                        params=[Identifier("x"), Identifier("y")],
+                        expr=BinaryOperator(
+                            expr1=Identifier("x"),
+                            op=Operator("+"),
+                            expr2=BinaryOperator(expr1=Identifier("y"), op=Operator("+"), expr2=Int(n))
+                        )
+                    ),
+                    FunctionDeclaration(
+                        scope,
+                        id=Identifier("twice"),
+                        params=[Identifier("x")],
+                        expr=FunctionApplication(
+                            func=FunctionApplication(func=Identifier("add"), expr=Identifier("x")),
+                            expr=Identifier("x")
+                        )
+                    )
+                ]
+        )
+
+    cache = ClassCache(str(tmp_path / "cache"))
+    scope = Scope(cache=cache)
+    check(cache_module(scope, 0), 6, scope)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # Nothing has changed, so both function classes are reused.
+    scope = Scope(cache=cache)
+    check(cache_module(scope, 0), 6, scope)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # Changing the body of add leaves its signature, and so twice, as it was.
+    scope = Scope(cache=cache)
+    check(cache_module(scope, 1), 7, scope)
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    # Only the entries used most recently are kept once the cache is full.
+    sizes = sorted(os.path.getsize(path) for path in glob.glob(str(tmp_path / "cache" / "*")))
+    cache = ClassCache(str(tmp_path / "cache"), max_bytes=sum(sizes) - 1)
+    scope = Scope(cache=cache)
+    check(cache_module(scope, 1), 7, scope)
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 0, 0)
+    cache.put("extra", b"x")
+    assert cache.evictions == 1
+    assert len(glob.glob(str(tmp_path / "cache" / "*"))) == 3
+
+    # Other processes sharing the directory may remove entries while they are being listed or evicted, which then
+    # just leaves them out, and an entry that has gone is a miss.
+    scandir = os.scandir
+
+    def racing_scandir(directory):
+        entries = list(scandir(directory))
+        # One entry goes before it is looked at, and another once it has been listed but before it is evicted.
+        os.remove(entries[0].path)
+        yield from entries
+        os.remove(entries[-1].path)
+
+    cache = ClassCache(str(tmp_path / "cache"), max_bytes=1)
+    monkeypatch.setattr(os, "scandir", racing_scandir)
+    cache.put("racing", b"racing")
+    monkeypatch.undo()
+    assert glob.glob(str(tmp_path / "cache" / "*")) == []
+    assert cache.get("racing") is None and cache.misses == 1
+
+def test_parallel_emission(tmp_path):
+    # module ParallelTest = f3 1.0 where { f0 x = x + 0.5; f1 x = f0 x * (x + 1.5); ... }
+    def parallel_module(scope):
+        decls = [DataTypeDeclaration(scope, id=Identifier("T"), constrs=[Constr(id=Identifier("X"))])]
+        for i in range(4):
+            body = BinaryOperator(expr1=Identifier("x"), op=Operator("+"), expr2=Double(i + 0.5))
+            if i:
+                call = FunctionApplication(func=Identifier("f{}".format(i - 1)), expr=Identifier("x"))
+                body = BinaryOperator(expr1=call, op=Operator("*"), expr2=body)
+            decls.append(FunctionDeclaration(scope, id=Identifier("f{}".format(i)), params=[Identifier("x")],
+                                             expr=body))
+        return Module(
+                id=Identifier("ParallelTest"),
+                expr=FunctionApplication(func=Identifier("f3"), expr=Double(1)),
+                decls=decls
+        )
+
+    def emit(name, executor=None):
+        directory = tmp_path / name
+        directory.mkdir()
+        scope = Scope(backend=ClassFileBackend(str(directory)), executor=executor)
+        parallel_module(scope).emit(scope)
+        return {path.name: path.read_bytes() for path in directory.iterdir()}
+
+    # Classes generated on other threads or processes are the same as ones generated in turn.
+    expected = emit("sequential")
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert emit("threads", executor) == expected
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        assert emit("processes", executor) == expected
+
+        scope = Scope(executor=executor)
+        check(parallel_module(scope), 1.5 * 2.5 * 3.5 * 4.5, scope)
+
+def test_jar_output(tmp_path):
+    # module JarTest = double 21 where { double x = x * 2 }
+    def jar_module(scope):
+        return Module(
+                id=Identifier("JarTest"),
+                expr=FunctionApplication(func=Identifier("double"), expr=Int(21)),
+                decls=[FunctionDeclaration(
+                    scope,
+                    id=Identifier("double"),
+                    params=[Identifier("x")],
+                    expr=BinaryOperator(expr1=Identifier("x"), op=Operator("*"), expr2=Int(2))
+                )]
+        )
+
+    scope = Scope(backend=JarBackend(str(tmp_path)))
+    jar_module(scope).emit(scope)
+    assert sorted(os.listdir(tmp_path)) == sorted(["JarTest.jar", runtime_jar()])
+
+    # The module's jar only has its own classes, and refers to the runtime's jar for the rest.
+    with zipfile.ZipFile(tmp_path / "JarTest.jar") as jar:
+        assert jar.namelist() == ["META-INF/MANIFEST.MF", "doubleFunction.class", "JarTest.class"]
+        manifest = jar.read("META-INF/MANIFEST.MF").decode("utf-8")
+        assert "Main-Class: JarTest" in manifest and "Class-Path: {}".format(runtime_jar()) in manifest
+        first = jar.read("JarTest.class")
+    with zipfile.ZipFile(tmp_path / runtime_jar()) as jar:
+        assert "AbstractFunction.class" in jar.namelist()
+
+    assert run("JarTest", str(tmp_path / "JarTest.jar")) == "42"
+
+    # Building again leaves the runtime alone and gives the same jar.
+    runtime_time = os.stat(tmp_path / runtime_jar()).st_mtime_ns
+    scope = Scope(backend=JarBackend(str(tmp_path)))
+    jar_module(scope).emit(scope)
+    assert os.stat(tmp_path / runtime_jar()).st_mtime_ns == runtime_time
+    assert sorted(os.listdir(tmp_path)) == sorted(["JarTest.jar", runtime_jar()])
+    with zipfile.ZipFile(tmp_path / "JarTest.jar") as jar:
+        assert jar.read("JarTest.class") == first
+
+def test_function_methods():
+    # module MethodTest = [add3 1.0 2.0 3.0, sum5 1.0 2.0 3.0 4.0 5.0, apply (add3 1.0 2.0) 4.0]
+    #     where { add3 x y z = x + y + z; sum5 a b c d e = a + b + c + d + e; apply f x = f x }
+    def method_module(scope):
+        def add(*names):
+            expr = Identifier(names[0])
+            for name in names[1:]:
+                expr = BinaryOperator(expr1=expr, op=Operator("+"), expr2=Identifier(name))
+            return expr
+
+        def call(func, *args):
+            expr = Identifier(func) if isinstance(func, str) else func
+            for arg in args:
+                expr = FunctionApplication(func=expr, expr=arg)
+            return expr
+
+        return Module(
+                id=Identifier("MethodTest"),
+                expr=Lists(exprs=[
+                    call("add3", Double(1), Double(2), Double(3)),
+                    call("sum5", *(Double(n) for n in range(1, 6))),
+                    call("apply", Grouping(expr=call("add3", Double(1), Double(2))), Double(4))
+                ]),
+                decls=[
+                    FunctionDeclaration(scope, id=Identifier("add3"), params=[Identifier(name) for name in "xyz"],
+                                        expr=add(*"xyz")),
+                    FunctionDeclaration(scope, id=Identifier("sum5"), params=[Identifier(name) for name in "abcde"],
+                                        expr=add(*"abcde")),
+                    FunctionDeclaration(scope, id=Identifier("apply"), params=[Identifier("f"), Identifier("x")],
+                                        expr=call("f", Identifier("x")))
+                ]
+        )
+
+    scope = Scope(backend=CollectingBackend(), function_classes=False)
+    method_module(scope).emit(scope)
+    classes = scope.backend.classes
+
+    # Function bodies are static methods of the module class, and every function value shares one class.
+    assert sorted(set(classes) - {classdef.name for classdef in runtime.classes()}) == [
+            "MethodTest", "MethodTestFunctions"]
+    assert {"add3", "sum5", "apply"} <= {method.name for method in classes["MethodTest"].methods}
+    table = classes["MethodTestFunctions"]
+    assert [field.name for field in table.fields] == ["index", "name", "add3", "sum5", "apply"]
+    assert sorted(method.descriptor for method in table.methods if method.name == "apply") == [
+            runtime.apply_descriptor(2), runtime.apply_descriptor(3)]
+
+    scope = Scope(function_classes=False)
+    check(method_module(scope), "[6.0, 15.0, 7.0]", scope)
+
+def test_parser(tmp_path):
+    source = "module ParseTest = mul 2.0 5.0 + 1.0 where { mul x y = x * y; mul :: Double -> Double -> Double }"
+    scope = Scope()
+    parser = Parser(scope)
+    module = parser.parse(source)
+
+    # The same nodes are built as by hand.
+    hand_scope = Scope()
+    expected = Module(
+            id=Identifier("ParseTest"),
+            expr=BinaryOperator(
+                expr1=FunctionApplication(
+                    func=FunctionApplication(func=Identifier("mul"), expr=Double(2)),
+                    expr=Double(5)
+                ),
+                op=Operator("+"),
+                expr2=Double(1)
+            ),
+            decls=[
+                FunctionDeclaration(
+                    hand_scope,
+                    id=Identifier("mul"),
+                    params=[Identifier("x"), Identifier("y")],
+                    expr=BinaryOperator(expr1=Identifier("x"), op=Operator("*"), expr2=Identifier("y"))
+                ),
+                TypeDeclaration(
+                    hand_scope,
+                    id=Identifier("mul"),
+                    type=FunctionType(
+                        param_type=NamedType(id=Identifier("Double")),
+                        return_type=FunctionType(
+                            param_type=NamedType(id=Identifier("Double")),
+                            return_type=NamedType(id=Identifier("Double"))
+                        )
+                    )
+                )
+            ]
+    )
+    assert str(module) == str(expected)
+    assert parser.tokens == 27 and parser.bytes == len(source) and parser.throughput > 0
+    # Making the declarations, which folds and infers their bodies, is timed apart from reading them.
+    assert parser.declare_seconds > 0
+    check(module, 11.0, scope)
+
+    # Files are mapped rather than read.
+    path = tmp_path / "source.fun"
+    path.write_text("module ParseFileTest = [X == Y, not (ord 'a' < 3 * 2 - 1)]\n"
+                    "    where { data T = X | Y; } -- a comment\n")
+    scope = Scope()
+    check(Parser(scope).parse_file(str(path)), "[false, true]", scope)
+
+    for source, line, column in [
+            ("module Bad = 1 +", 1, 17),
+            ("module Bad = 1 < 2 < 3", 1, 20),
+            ("module Bad = x where {\n    f x = x $ 1 }", 2, 13),
+            ("module Bad = f where { f = 1 } }", 1, 32)]:
+        with pytest.raises(ParseError) as error:
+            Parser(Scope()).parse(source)
+        assert (error.value.line, error.value.column) == (line, column)
+
+def test_driver(tmp_path):
+    sources = tmp_path / "src"
+    (sources / "nested").mkdir(parents=True)
+    (sources / "one.fun").write_text("module DriverOne = f 2 where { f x = x * 3 }")
+    (sources / "nested" / "two.fun").write_text("module DriverTwo = [f X == X] where { data T = X | Y; f t = t }")
+    (sources / "bad.fun").write_text("module DriverBad = 1 +")
+    (sources / "undefined.fun").write_text("module DriverUndefined = g 2 where { g x = x * y }")
+    output = tmp_path / "out"
+
+    for jobs in ("1", "2"):
+        out = io.StringIO()
+        status = driver.main([str(sources), "-o", str(output), "-f", "class", "-j", jobs,
+                              "--cache", str(tmp_path / "cache")], out)
+        lines = out.getvalue().splitlines()
+
+        # Modules are compiled and reported in order, with the broken ones not stopping the others.
+        assert status == 1
+        assert lines[0].startswith("{}: error: 1:23: Expected an expression".format(sources / "bad.fun"))
+        assert lines[1].startswith("{}: DriverOne parsed in ".format(sources / "one.fun"))
+        assert "MB/s), declarations made in " in lines[1]
+        assert lines[2] == "{}: error: Undefined identifier 'y'".format(sources / "undefined.fun")
+        assert lines[3].startswith("{}: DriverTwo parsed in ".format(sources / "nested" / "two.fun"))
+        assert lines[4].startswith("2 of 4 modules compiled in ")
+        # Both modules declare an f, so each is written into a directory of its own.
+        assert {"DriverOne.class", "fFunction.class", "Cons.class"} <= set(os.listdir(output / "DriverOne"))
+        assert {"DriverTwo.class", "fFunction.class", "TData.class", "Cons.class"} <= set(
+                os.listdir(output / "DriverTwo"))
+    assert lines[3].endswith("2 cached, 0 generated")
+
+    assert run("DriverOne", str(output / "DriverOne")) == "6"
+    assert run("DriverTwo", str(output / "DriverTwo")) == "[true]"
+
+def test_daemon(tmp_path):
+    output = tmp_path / "out"
+    source = "module DaemonTest = f 2 where {{ f x = x * {} }}"
+    server = daemon.Daemon(workers=1)
+
+    async def session():
+        socket = str(tmp_path / "daemon.sock")
+        serving = asyncio.ensure_future(daemon.serve(server, socket))
+        while not os.path.exists(socket):
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(socket)
+
+        def send(ident, method, params):
+            writer.write(json.dumps({"jsonrpc": "2.0", "id": ident, "method": method, "params": params}).encode()
+                         + b"\n")
+
+        async def receive(*idents):
+            responses = {}
+            while len(responses) < len(idents):
+                response = json.loads(await reader.readline())
+                responses[response["id"]] = response
+            return [responses[ident] for ident in idents]
+
+        async def call(*requests):
+            for request in requests:
+                send(*request)
+            return await receive(*[ident for ident, _, _ in requests])
+
+        compile = {"source": source.format(3), "output": str(output), "format": "class"}
+        first, again = await call((1, "compile", compile), (2, "compile", compile))
+        assert first["result"]["module"] == "DaemonTest" and not first["result"]["cached"]
+        assert {"DaemonTest.class", "fFunction.class", "Cons.class"} <= set(first["result"]["files"])
+        assert again["result"]["cached"] and again["result"]["files"] == first["result"]["files"]
+        assert run("DaemonTest", str(output)) == "6"
+
+        # A changed module is compiled again, reusing the classes of the declarations that haven't changed.
+        changed = dict(compile, source=source.format(3) + " -- changed")
+        result, = await call((3, "compile", changed))
+        assert not result["result"]["cached"] and result["result"]["hits"] == 1
+
+        # With the only worker kept busy, a compilation waits until it is cancelled, and writes nothing.
+        busy = threading.Event()
+        server._executor.submit(busy.wait)
+        send(4, "compile", dict(compile, source=source.format(5)))
+        send(5, "cancel", {"id": 4})
+        cancel, cancelled = await receive(5, 4)
+        busy.set()
+        assert cancel["result"] is True and cancelled["error"]["code"] == daemon.REQUEST_CANCELLED
+
+        # Modules that don't parse, or don't compile, are answered with an error like any other request.
+        error, undefined, unknown, stats = await call(
+                (6, "compile", dict(compile, source="module Bad = 1 +")),
+                (7, "compile", dict(compile, source="module Undefined = y")), (8, "link", {}), (9, "stats", {}))
+        assert error["error"]["code"] == daemon.COMPILE_ERROR and "1:17" in error["error"]["message"]
+        assert undefined["error"] == {"code": daemon.COMPILE_ERROR, "message": "Undefined identifier 'y'"}
+        assert unknown["error"]["code"] == daemon.METHOD_NOT_FOUND
+        assert stats["result"]["modules"]["entries"] == 2 and stats["result"]["modules"]["hits"] == 1
+
+        await call((10, "shutdown", {}))
+        await serving
+        assert not os.path.exists(socket)
+
+    try:
+        asyncio.run(session())
+    finally:
+        server.close()
+    assert run("DaemonTest", str(output)) == "6"
+    assert not glob.glob(str(output / ".*"))
+
+def test_batch_runner(batch_runner, tmp_path):
+    def compile(source):
+        scope = Scope()
+        return compile_isolated(Parser(scope).parse(source), scope, str(tmp_path))
+
+    # Each module is compiled into a directory of its own, so both can have a class fFunction.
+    times = compile("module Times = f 2 where { f x = x * 3 }")
+    plus = compile("module Plus = f 2 where { f x = x + 30 }")
+    divide = compile("module Divide = f 0 where { f x = 5 / x }")
+    assert os.path.dirname(times) == os.path.dirname(plus) == str(tmp_path) and times != plus
+    assert "fFunction.class" in os.listdir(times) and "fFunction.class" in os.listdir(plus)
+
+    # Results stream back in order, with a module that throws, or can't be found, not stopping the rest.
+    runs = batch_runner.runs
+    results = list(batch_runner.run_all([("Times", times), ("Divide", divide), ("Plus", [plus]), ("Times", plus)]))
+    assert [(module, ok) for module, ok, _ in results] == [
+            ("Times", True), ("Divide", False), ("Plus", True), ("Times", False)]
+    assert results[0][2] == "6\n" and results[2][2] == "32\n"
+    assert "ArithmeticException" in results[1][2] and "ClassNotFoundException" in results[3][2]
+
+    with pytest.raises(RunError) as error:
+        batch_runner.run("Divide", divide)
+    assert error.value.module == "Divide" and "ArithmeticException" in error.value.output
+    assert batch_runner.run("Times", times) == "6\n"
+    assert batch_runner.runs == runs + 6
+
+    # A module that never finishes fails once it has taken too long, and the next one runs in a new JVM.
+    loop = ClassDef("Loop")
+    main = loop.add_method(("public", "static"), "main", "([Ljava/lang/String;)V")
+    start = Label()
+    main.code.place(start)
+    main.code.add("goto", start)
+    ClassFileBackend(str(tmp_path)).write(loop)
+    with BatchRunner(timeout=1) as runner:
+        results = list(runner.run_all([("Loop", str(tmp_path)), ("Times", times)]))
+    assert results == [("Loop", False, "Loop timed out after 1 s"), ("Times", True, "6\n")]
+
+def test_direct_run(batch_runner, tmp_path):
+    # Every other test runs modules in the runner, so this one checks it against a JVM started just for the
+    # module, which verifies every class it loads.
+    require(shutil.which("java"), "Java")
+    scope = Scope(fold=False)
+    module = Parser(scope).parse("module DirectRun = [f 2, g (f 3)] where { f x = x * 3 + 1; g y = y / 2 }")
+    directory = compile_isolated(module, scope, str(tmp_path))
+    direct = subprocess.check_output(["java", "-cp", directory, "DirectRun"]).decode("utf-8")
+    assert direct.strip() == "[7, 5]"
+
+    # The runner gives the same output, and its own class passes the verifier too.
+    assert batch_runner.run("DirectRun", directory) == direct
+    answer = subprocess.run(["java", "-cp", batch_runner.directory, RUNNER], check=True, stdout=subprocess.PIPE,
+                            input="{}\tDirectRun\n".format(directory).encode("utf-8")).stdout.decode("utf-8")
+    assert answer == "ok\t{}\n{}".format(len(direct.encode("utf-8")), direct)
+
+def test_jasmin(tmp_path):
+    # Every other test assembles Jasmin source in process, so this one checks that Jasmin itself makes classes
+    # that give the same output.
+    require(shutil.which("java") and os.path.exists(JASMIN), "Java and Jasmin")
+    source = "module JasminRun = [f 2, g (f 3)] where { f x = x * 3 + 1; g y = y / 2 }"
+    outputs = []
+    for name in ("jasmin", "assembled"):
+        directory = tmp_path / name
+        directory.mkdir()
+        scope = Scope(backend=JasminBackend(str(directory)), fold=False)
+        Parser(scope).parse(source).emit(scope)
+        sources = glob.glob(str(directory / "*.j"))
+        if name == "jasmin":
+            subprocess.run(["java", "-jar", JASMIN, "-d", str(directory), *sources], check=True,
+                           stdout=subprocess.DEVNULL)
+        else:
+            for path in sources:
+                with open(path, encoding="utf-8") as infile:
+                    class_name, data = classfile.assemble(infile.read())
+                (directory / (class_name + ".class")).write_bytes(data)
+        outputs.append(subprocess.check_output(["java", "-cp", str(directory), "JasminRun"]).decode("utf-8"))
+    assert outputs[0] == outputs[1] and outputs[0].strip() == "[7, 5]"
+
+def test_evaluator():
+    cases = [
+        ("module EvalCall = f 2 where { f x = x * 3 }", "6"),
+        ("module EvalPartial = add 3 where { add x y = x + y }", "addFunction with bound parameters: (3) "),
+        ("module EvalData = [X == X, X == Y, not (ord 'a' < 3 * 2 - 1)] where { data T = X | Y }",
+         "[true, false, true]"),
+        ("module EvalDoubles = [1.5 / 0.0, 0.0 / 0.0, 1.0e10, 0.001, 123456.789, 1.0e-5] :: [Double]",
+         "[Infinity, NaN, 1.0E10, 0.001, 123456.789, 1.0E-5]"),
+        ("module EvalHigher = twice (mul 2.0) 3.0 where { twice f x = f (f x); mul a b = a * b }", "12.0"),
+        ("module EvalOverApplied = apply3 add3 1.0 2.0 3.0 where { add3 a b c = a + b + c; apply3 g = g }",
+         "6.0"),
+        ("module EvalChars = [chr 97, chr (ord 'b' + 1)]", "[a, c]"),
+        ("module EvalOverflow = 2147483647 + 1", "-2147483648"),
+        ("module EvalConstant = x * x where { x = 2.5 }", "6.25")
+    ]
+
+    # The evaluator gives what the compiled module prints, whether or not constants were folded first.
+    for source, expected in cases:
+        for fold in (True, False):
+            scope = Scope(fold=fold)
+            assert Evaluator(Parser(scope).parse(source), scope).output() == expected
+        scope = Scope()
+        check(Parser(scope).parse(source), expected.strip(), scope)
+
+    # And fails where it throws, including where arguments of the wrong type are unboxed.
+    for source, exception in [
+            ("module EvalDivide = f 0 where { f x = 5 / x }", "ArithmeticException"),
+            ("module EvalMismatch = apply3 add3 1 2 3 where { add3 a b c = a + b + c; apply3 g = g }",
+             "ClassCastException")]:
+        scope = Scope()
+        evaluator = Evaluator(Parser(scope).parse(source), scope)
+        with pytest.raises(EvaluationError) as error:
+            evaluator.evaluate()
+        assert exception in str(error.value)
+        with pytest.raises(RunError) as error:
+            check(evaluator.module, None, scope)
+        assert exception in error.value.output
+
+    # Values are Python's own, besides lists, data and functions.
+    scope = Scope()
+    module = Parser(scope).parse("module EvalValues = [g X, g Y] where { data T = X | Y; g t = f t; f = h; h t = t }")
+    values = Evaluator(module, scope).evaluate()
+    assert [value.name for value in values] == ["X", "Y"]
+
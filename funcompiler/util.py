@@ -1,57 +1,156 @@
+from funcompiler import funtype
+
+# Each helper returns a snippet of (mnemonic, *operands) tuples, to be appended with Code.add_all().
+
 def integer_to_int():
     """Assuming the top of the stack is a reference to an Integer, replace it with an int."""
-    return """
-    checkcast java/lang/Integer
-    invokevirtual java/lang/Integer.intValue()I
-    """
+    return (
+        ('checkcast', 'java/lang/Integer'),
+        ('invokevirtual', 'java/lang/Integer', 'intValue', '()I')
+    )
 
 def int_to_integer():
-    return """
-    invokestatic java/lang/Integer.valueOf(I)Ljava/lang/Integer;
-    """
+    return (
+        ('invokestatic', 'java/lang/Integer', 'valueOf', '(I)Ljava/lang/Integer;'),
+    )
 
 def double_to_Double():
-    return """
-    invokestatic java/lang/Double.valueOf(D)Ljava/lang/Double;
-    """
+    return (
+        ('invokestatic', 'java/lang/Double', 'valueOf', '(D)Ljava/lang/Double;'),
+    )
 
 def Double_to_double():
-    return """
-    checkcast java/lang/Double
-    invokevirtual java/lang/Double.doubleValue()D
-    """
+    return (
+        ('checkcast', 'java/lang/Double'),
+        ('invokevirtual', 'java/lang/Double', 'doubleValue', '()D')
+    )
 
 def char_to_Character():
-    return """
-    invokestatic java/lang/Character.valueOf(C)Ljava/lang/Character;
-    """
+    return (
+        ('invokestatic', 'java/lang/Character', 'valueOf', '(C)Ljava/lang/Character;'),
+    )
 
 def Character_to_char():
-    return """
-    checkcast java/lang/Character
-    invokevirtual java/lang/Character.charValue()C
-    """
+    return (
+        ('checkcast', 'java/lang/Character'),
+        ('invokevirtual', 'java/lang/Character', 'charValue', '()C')
+    )
 
 def print_string():
-    return """
-    getstatic java/lang/System/out Ljava/io/PrintStream;
-    swap
-    invokevirtual java/io/PrintStream/print(Ljava/lang/String;)V
-    """
+    return (
+        ('getstatic', 'java/lang/System', 'out', 'Ljava/io/PrintStream;'),
+        ('swap',),
+        ('invokevirtual', 'java/io/PrintStream', 'print', '(Ljava/lang/String;)V')
+    )
 
 def create_stringbuilder():
-    return """
-    new java/lang/StringBuilder
-    dup
-    invokespecial java/lang/StringBuilder.<init>()V
-    astore_1
-    """
+    return (
+        ('new', 'java/lang/StringBuilder'),
+        ('dup',),
+        ('invokespecial', 'java/lang/StringBuilder', '<init>', '()V'),
+        ('astore_1',)
+    )
 
 def add_to_stringbuilder():
     """Assumes it can use aload_1 to store it, and the top of the stack is the thing to add."""
-    return """
-    aload_1
-    swap
-    invokevirtual java/lang/StringBuilder.append(Ljava/lang/String;)Ljava/lang/StringBuilder;
-    astore_1
-    """
+    return (
+        ('aload_1',),
+        ('swap',),
+        ('invokevirtual', 'java/lang/StringBuilder', 'append', '(Ljava/lang/String;)Ljava/lang/StringBuilder;'),
+        ('astore_1',)
+    )
+
+def boolean_to_Boolean():
+    return (
+        ('invokestatic', 'java/lang/Boolean', 'valueOf', '(Z)Ljava/lang/Boolean;'),
+    )
+
+def Boolean_to_boolean():
+    return (
+        ('checkcast', 'java/lang/Boolean'),
+        ('invokevirtual', 'java/lang/Boolean', 'booleanValue', '()Z')
+    )
+
+def push_int(value):
+    """Pushes the int *value* with the shortest instruction that can hold it."""
+    if -1 <= value <= 5:
+        return (('iconst_m1',) if value == -1 else ('iconst_{}'.format(value),),)
+    elif -128 <= value < 128:
+        return (('bipush', value),)
+    elif -32768 <= value < 32768:
+        return (('sipush', value),)
+    return (('ldc', value),)
+
+# Types whose values can be kept on the stack as primitives, with the snippets to (box, unbox) them.
+_boxing = {
+    funtype.Int: (int_to_integer, integer_to_int),
+    funtype.Double: (double_to_Double, Double_to_double),
+    funtype.Char: (char_to_Character, Character_to_char),
+    funtype.Bool: (boolean_to_Boolean, Boolean_to_boolean)
+}
+
+def is_primitive(typ):
+    return type(typ) in _boxing
+
+def box(typ):
+    """Turns a primitive of type *typ* on top of the stack into its boxed object. Other types are already objects,
+    so nothing is needed."""
+    return _boxing[type(typ)][0]() if is_primitive(typ) else ()
+
+def unbox(typ):
+    return _boxing[type(typ)][1]() if is_primitive(typ) else ()
+
+def descriptor(typ, unbox=True):
+    """The JVM descriptor used for values of type *typ*: the primitive itself if unboxing, otherwise an Object."""
+    return typ.jvm_code if unbox and is_primitive(typ) else 'Ljava/lang/Object;'
+
+_descriptor_types = {
+    'I': funtype.Int,
+    'D': funtype.Double,
+    'C': funtype.Char,
+    'Z': funtype.Bool
+}
+
+def descriptor_type(code):
+    """The primitive type held in values with the descriptor *code*, or None for objects."""
+    return _descriptor_types[code]() if code in _descriptor_types else None
+
+def parse_descriptor(method_descriptor):
+    """Splits a method descriptor into a list of parameter descriptors and the return descriptor."""
+    params = []
+    i = 1
+    while method_descriptor[i] != ')':
+        start = i
+        while method_descriptor[i] == '[':
+            i += 1
+        if method_descriptor[i] == 'L':
+            i = method_descriptor.index(';', i)
+        i += 1
+        params.append(method_descriptor[start:i])
+
+    return params, method_descriptor[i + 1:]
+
+def _prefix(code):
+    return {'I': 'i', 'C': 'i', 'Z': 'i', 'B': 'i', 'S': 'i', 'D': 'd', 'J': 'l', 'F': 'f'}.get(code, 'a')
+
+def load(code, index):
+    """Loads the local variable at *index*, holding a value with the descriptor *code*."""
+    if index <= 3:
+        return (('{}load_{}'.format(_prefix(code), index),),)
+    return (('{}load'.format(_prefix(code)), index),)
+
+def store(code, index):
+    """Stores into the local variable at *index* a value with the descriptor *code*."""
+    if index <= 3:
+        return (('{}store_{}'.format(_prefix(code), index),),)
+    return (('{}store'.format(_prefix(code)), index),)
+
+def array_load(code):
+    """Loads an element with the descriptor *code* from an array."""
+    return (({'Z': 'b', 'C': 'c'}.get(code, _prefix(code)) + 'aload',),)
+
+def array_store(code):
+    return (({'Z': 'b', 'C': 'c'}.get(code, _prefix(code)) + 'astore',),)
+
+def return_value(code):
+    return (('{}return'.format(_prefix(code)),),)